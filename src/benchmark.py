@@ -0,0 +1,420 @@
+import datetime as dt
+import json
+import logging as log
+import optparse as op
+import os
+import random
+import shutil as sh
+import socket
+import subprocess as proc
+import tempfile
+import time
+
+BENCHMARK_HISTORY_FILE: str = os.path.expanduser("~/.cache/media-server-utils/benchmarks.json")
+# GENERATING A 3 HOUR RECORDING TAKES A WHILE.  THEY ARE KEPT HERE AND REUSED.
+RECORDING_DIR: str = os.path.expanduser("~/.cache/media-server-utils/benchmark-recordings")
+# CHANGE WHEN THE RECORDINGS CHANGE, SO OLD ONES ARE NOT REUSED.
+RECORDING_VERSION: int = 1
+FRAME_RATE: int = 30
+GOP_FRAMES: int = 60
+# THE PICTURE FREEZES AND THE SOUND GOES SILENT FOR GAP_SECONDS EVERY GAP_EVERY SECONDS, AND THERE IS
+# AN Advertisement CHAPTER OF AD_SECONDS EVERY AD_EVERY SECONDS, STARTING AD_OFFSET IN.
+GAP_EVERY: float = 240.0
+GAP_SECONDS: float = 20.0
+AD_EVERY: float = 420.0
+AD_OFFSET: float = 120.0
+AD_SECONDS: float = 60.0
+
+# MovieSections BENCHMARKS USE THIS MANY FREEZES (AND AS MANY SILENCES) PER MINUTE OF MOVIE.
+SECTIONS_PER_MINUTE: int = 10
+KEY_FRAME_LOOKUPS: int = 10000
+RANDOM_SEED: int = 20240601
+# CHANGES SMALLER THAN THIS ARE NOISE.
+SIGNIFICANT_CHANGE: float = 0.05
+
+OP_TRANSCODE: str = "transcode"
+OP_FIND_GAPS: str = "find_commercials_and_freezes"
+OP_KEY_FRAMES: str = "get_next_key_frame_after_timestamp"
+OP_REMOVE_GAPS: str = "remove_gaps"
+OP_REPLACE_FILE: str = "replace_file"
+OP_SECTIONS: str = "sections"
+OPS: [str] = [OP_TRANSCODE, OP_FIND_GAPS, OP_KEY_FRAMES, OP_REMOVE_GAPS, OP_REPLACE_FILE, OP_SECTIONS]
+
+# SCRATCH HOME OF THIS RUN.  None WHEN IMPORTED.
+benchmark_home: str | None = None
+
+if "__main__" == __name__:
+    # SETUP LOGGER BEFORE IMPORTS SO THEY CAN USE THESE SETTINGS
+    log.basicConfig(filename="benchmark.log",
+                    filemode="w",
+                    format="%(asctime)s %(filename)15.15s %(funcName)15.15s %(levelname)5.5s %(lineno)4.4s %(message)s",
+                    datefmt="%Y%m%d-%H:%M:%S"
+                    )
+    log.getLogger().setLevel(log.INFO)
+    # THE THROUGHPUT HISTORY, PROBE CACHE AND JOB STORE ARE FOUND THROUGH ~ WHEN msutils IS IMPORTED.
+    # POINT IT AT SCRATCH SPACE SO SYNTHETIC RUNS NEITHER SKEW REAL PREDICTIONS NOR FIND WARM CACHES.
+    benchmark_home = tempfile.mkdtemp(prefix="msutils-benchmark-")
+    os.environ["HOME"] = benchmark_home
+
+import msutils as msu
+import remove_gaps as rg
+import transcode_to_hevc as tcode
+
+
+def recording_layout(duration: float) -> ([(float, float)], [(float, float)]):
+    """ (freezes, advertisements) injected into a DURATION second recording. """
+    freezes: [(float, float)] = []
+    start: float = GAP_EVERY
+    while start + GAP_SECONDS < duration:
+        freezes.append((start, start + GAP_SECONDS))
+        start += GAP_EVERY
+
+    ads: [(float, float)] = []
+    start = AD_OFFSET
+    while start + AD_SECONDS < duration:
+        ads.append((start, start + AD_SECONDS))
+        start += AD_EVERY
+    return freezes, ads
+
+
+def expected_gaps(file_name: str, duration: float) -> msu.MovieSections:
+    freezes, ads = recording_layout(duration)
+    return msu.MovieSections.from_sorted(file_name, sorted(msu.MovieSection(st, en, "") for st, en in freezes + ads))
+
+
+def recording_name(minutes: float, size: str) -> str:
+    return os.path.join(RECORDING_DIR, f"benchmark-v{RECORDING_VERSION}-{minutes:g}m-{size}.mkv")
+
+
+def generate_recording(file_name: str, minutes: float, size: str) -> None:
+    """ A MINUTES long h264/aac recording of testsrc2 and a sine tone.  Only
+        deterministic sources are used, so every host generates the same one.
+    """
+    duration: float = minutes * 60
+    freezes, ads = recording_layout(duration)
+    chapters_file: str = f"{file_name}.chapters"
+    with open(chapters_file, "w") as fd:
+        fd.write(";FFMETADATA1\n")
+        for start, end in ads:
+            fd.write(f"[CHAPTER]\nTIMEBASE=1/1000\nSTART={int(start * 1000)}\nEND={int(end * 1000)}\n"
+                     f"title=Advertisement\n"
+                     )
+
+    # A STILL PICTURE OVER THE MOVING ONE IS A FREEZE.  THE SOUND IS MUTED AT THE SAME TIMES.
+    during_gaps: str = "+".join(f"between(t,{start},{end})" for start, end in freezes) or "0"
+    filters: str = f"[0:v][1:v]overlay=enable='{during_gaps}'[v];[2:a]volume=volume=0:enable='{during_gaps}'[a]"
+    partial_file: str = f"{file_name}.partial.mkv"
+    ffmpeg_args: [str] = ["nice",
+                          rg.FFMPEG_FILE,
+                          "-y",
+                          "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={FRAME_RATE}:duration={duration}",
+                          "-f", "lavfi", "-i", f"color=c=gray:size={size}:rate={FRAME_RATE}:duration={duration}",
+                          "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+                          "-f", "ffmetadata", "-i", chapters_file,
+                          "-filter_complex", filters,
+                          "-map", "[v]",
+                          "-map", "[a]",
+                          "-map_chapters", "3",
+                          "-c:v", "libx264",
+                          "-preset", "ultrafast",
+                          "-g", f"{GOP_FRAMES}",
+                          "-pix_fmt", "yuv420p",
+                          "-c:a", "aac",
+                          partial_file,
+                          ]
+    try:
+        runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, duration, "Generating", file_name=file_name)
+        if runner.run() != 0:
+            raise msu.MediaServerUtilityException(f"An error occurred generating {file_name}. "
+                                                  f"Return code: {runner.returncode}"
+                                                  )
+        os.replace(partial_file, file_name)
+    finally:
+        for f in (chapters_file, partial_file):
+            if os.path.exists(f):
+                os.unlink(f)
+
+
+def recording(minutes: float, size: str) -> str:
+    file_name: str = recording_name(minutes, size)
+    if not os.path.exists(file_name):
+        os.makedirs(RECORDING_DIR, exist_ok=True)
+        print(f"{msu.Color.BOLD}Generating{msu.Color.END} a {minutes:g} minute {size} recording.")
+        generate_recording(file_name, minutes, size)
+    return file_name
+
+
+def timed(func, *args, **kwargs) -> (float, object):
+    """ (seconds FUNC took, what it returned) """
+    start: float = time.monotonic()
+    return_val = func(*args, **kwargs)
+    return time.monotonic() - start, return_val
+
+
+def fastest(repeat: int, func, *args) -> float:
+    return min(timed(func, *args)[0] for _ in range(max(1, repeat)))
+
+
+def random_sections(rng: random.Random, duration: float, count: int) -> ([float], [float]):
+    starts: [float] = [rng.uniform(0.0, duration) for _ in range(count)]
+    return starts, [st + rng.uniform(0.5, 30.0) for st in starts]
+
+
+def bench_sections(duration: float, repeat: int) -> dict:
+    """ Seconds for the MovieSections operators on as many freezes and
+        silences as a DURATION second movie might have.
+    """
+    rng: random.Random = random.Random(RANDOM_SEED)
+    count: int = int(duration / 60 * SECTIONS_PER_MINUTE)
+    freeze_starts, freeze_ends = random_sections(rng, duration, count)
+    silence_starts, silence_ends = random_sections(rng, duration, count)
+    freezes: msu.MovieSections = msu.MovieSections.from_arrays("bench.mkv", freeze_starts, freeze_ends, "video")
+    silences: msu.MovieSections = msu.MovieSections.from_arrays("bench.mkv", silence_starts, silence_ends, "audio")
+
+    def add_each() -> None:
+        sections: msu.MovieSections = msu.MovieSections("bench.mkv")
+        for st, en in zip(freeze_starts, freeze_ends):
+            sections.add_section(msu.MovieSection(st, en, ""))
+
+    return {"from_arrays": fastest(repeat, msu.MovieSections.from_arrays, "bench.mkv", freeze_starts, freeze_ends),
+            "add_section": fastest(repeat, add_each),
+            "union": fastest(repeat, freezes.ms_union, silences),
+            "intersection": fastest(repeat, freezes.ms_intersection, silences),
+            "kept_sections": fastest(repeat, freezes.kept_sections, duration),
+            }
+
+
+def bench_key_frames(file_name: str, duration: float) -> dict:
+    rng: random.Random = random.Random(RANDOM_SEED)
+    # THE FIRST LOOKUP BUILDS THE INDEX.  TIME THAT AND THE LOOKUPS AFTER IT SEPARATELY.
+    build_secs, _ = timed(msu.KeyFrameIndex.build, file_name)
+    msu.KeyFrameIndex.for_file(file_name)
+    times: [float] = [rng.uniform(0.0, duration) for _ in range(KEY_FRAME_LOOKUPS)]
+    start: float = time.monotonic()
+    for ts in times:
+        msu.get_next_key_frame_after_timestamp(file_name, ts)
+    return {"index": build_secs, f"{KEY_FRAME_LOOKUPS} lookups": time.monotonic() - start}
+
+
+def bench_recording(minutes: float, size: str, ops: [str], replace_dir: str, add) -> None:
+    """ Time OPS on a MINUTES long recording, in the order the pipeline runs
+        them, passing each time to ADD.  Once transcoded, the later steps
+        work on the transcode.
+    """
+    source: str = recording(minutes, size)
+    probe: msu.MediaProbe = msu.MediaProbe.probe(source, use_cache=False)
+
+    with msu.JobWorkspace(prefix="benchmark-") as workspace:
+        msu.set_workspace(workspace)
+        try:
+            current: str = source
+            if OP_TRANSCODE in ops:
+                output: str = workspace.path("transcoded.mkv")
+                seconds, _ = timed(tcode.encode_video, source, source, output,
+                                   (tcode.VIDEO_CODEC, tcode.AUDIO_CODEC, tcode.CORRECT_CODEC), probe
+                                   )
+                add(OP_TRANSCODE, seconds, speed=round(probe.duration / seconds, 3))
+                current = output
+
+            gaps: msu.MovieSections = expected_gaps(current, probe.duration)
+            if OP_FIND_GAPS in ops:
+                seconds, found = timed(rg.find_commercials_and_freezes, current)
+                expected: int = len(gaps.section_list)
+                if len(found.section_list) != expected:
+                    print(f"    {msu.Color.RED}Found {len(found.section_list)} gaps, expected {expected}."
+                          f"{msu.Color.END}"
+                          )
+                add(OP_FIND_GAPS, seconds, speed=round(probe.duration / seconds, 3), found=len(found.section_list),
+                    expected=expected
+                    )
+                gaps = found
+
+            if OP_KEY_FRAMES in ops:
+                for name, seconds in bench_key_frames(current, probe.duration).items():
+                    add(f"{OP_KEY_FRAMES} {name}", seconds)
+
+            if len(gaps.section_list) > 0 and (OP_REMOVE_GAPS in ops or OP_REPLACE_FILE in ops):
+                output = workspace.path("gaps-removed.mkv")
+                seconds, _ = timed(rg.remove_gaps, gaps, output)
+                if OP_REMOVE_GAPS in ops:
+                    add(OP_REMOVE_GAPS, seconds, speed=round(probe.duration / seconds, 3))
+
+                if OP_REPLACE_FILE in ops:
+                    # THE ORIGINAL IS REPLACED WHERE IT LIVES, WHICH IS USUALLY ANOTHER FILESYSTEM.
+                    target: str = os.path.join(replace_dir or workspace.dir_name, "benchmark-replaced.mkv")
+                    sh.copyfile(current, target)
+                    try:
+                        seconds, _ = timed(msu.replace_file, target, output)
+                        add(OP_REPLACE_FILE, seconds, bytes=os.path.getsize(target))
+                    finally:
+                        os.unlink(target)
+        finally:
+            msu.set_workspace(None)
+
+
+def run_benchmarks(minutes: float, size: str, ops: [str], repeat: int, replace_dir: str) -> [dict]:
+    results: [dict] = []
+
+    def add(op_name: str, seconds: float, **extra) -> None:
+        results.append({"op": op_name, "minutes": minutes, "seconds": round(seconds, 6), **extra})
+        log.info(f"{op_name} of {minutes:g} minutes took {seconds:,.3f}s. {extra or ''}")
+
+    # THE MovieSections BENCHMARKS NEED NO RECORDING.
+    if any(o != OP_SECTIONS for o in ops):
+        bench_recording(minutes, size, ops, replace_dir, add)
+    if OP_SECTIONS in ops:
+        for name, seconds in bench_sections(minutes * 60, repeat).items():
+            add(f"{OP_SECTIONS} {name}", seconds)
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return proc.run(["git", "rev-parse", "--short", "HEAD"],
+                        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+                        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+def ffmpeg_version() -> str:
+    try:
+        return proc.run([rg.FFMPEG_FILE, "-version"], capture_output=True, text=True).stdout.partition("\n")[0]
+    except OSError:
+        return ""
+
+
+def load_history(history_file: str) -> [dict]:
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file) as fd:
+        return json.load(fd)
+
+
+def save_history(history_file: str, runs: [dict]) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(history_file)), exist_ok=True)
+    temp_file: str = f"{history_file}.tmp"
+    with open(temp_file, "w") as fd:
+        json.dump(runs, fd, indent=1)
+    os.replace(temp_file, history_file)
+
+
+def previous_run(runs: [dict], run: dict) -> dict | None:
+    """ The latest earlier run on this host of the same size and label. """
+    for earlier in reversed(runs):
+        if all(earlier.get(k) == run[k] for k in ("host", "size", "label")):
+            return earlier
+    return None
+
+
+def print_comparison(run: dict, previous: dict | None) -> None:
+    before: dict = {} if previous is None else {(r["op"], r["minutes"]): r["seconds"]
+                                                  for r in previous["results"]}
+    if previous is not None:
+        print(f"Compared with {previous['commit'] or 'unknown commit'} at {previous['started']}.")
+    for result in run["results"]:
+        line: str = f"    {result['op']:<48} {result['minutes']:>6g}m {result['seconds']:>12,.6f}s"
+        earlier: float | None = before.get((result["op"], result["minutes"]))
+        if earlier is not None and earlier > 0:
+            change: float = result["seconds"] / earlier - 1
+            color: str = msu.Color.END
+            if change > SIGNIFICANT_CHANGE:
+                color = msu.Color.RED
+            elif change < -SIGNIFICANT_CHANGE:
+                color = msu.Color.GREEN
+            line += f" {earlier:>12,.6f}s  {color}{change:+7.1%}{msu.Color.END}"
+        print(line)
+
+
+def main():
+    parser = op.OptionParser(usage="%prog [options]")
+    parser.add_option("-m", "--minutes",
+                      dest="minutes", default="5,30,180",
+                      help="Comma separated lengths of the recordings to benchmark, in minutes."
+                      )
+    parser.add_option("-s", "--size",
+                      dest="size", default="1280x720",
+                      help="Picture size of the recordings."
+                      )
+    parser.add_option("-o", "--only",
+                      dest="only", default=",".join(OPS),
+                      help=f"Comma separated benchmarks to run, out of {', '.join(OPS)}."
+                      )
+    parser.add_option("-r", "--repeat",
+                      dest="repeat", type="int", default=5,
+                      help="Run the MovieSections benchmarks this many times and keep the fastest."
+                      )
+    parser.add_option("--replace-dir",
+                      dest="replace_dir", default=None,
+                      help="Directory (e.g. on the media server's share) of the file replace_file replaces."
+                      )
+    parser.add_option("-l", "--label",
+                      dest="label", default="",
+                      help="Only compare with earlier runs with this label."
+                      )
+    parser.add_option("--history",
+                      dest="history", default=BENCHMARK_HISTORY_FILE,
+                      help="JSON file the results are added to."
+                      )
+    parser.add_option("-d", "--detect-shards",
+                      dest="detect_shards", type="int", default=rg.DETECT_SHARDS,
+                      help="As remove_gaps.py --detect-shards."
+                      )
+    parser.add_option("-c", "--coarse",
+                      dest="coarse", action="store_true", default=False,
+                      help="As remove_gaps.py --coarse."
+                      )
+    parser.add_option("--smart-render",
+                      dest="smart_render", action="store_true", default=False,
+                      help="As remove_gaps.py --smart-render."
+                      )
+    options, vals = parser.parse_args()
+    if len(vals) != 0:
+        parser.error("No arguments expected.")
+    try:
+        minutes: [float] = [float(m) for m in options.minutes.split(",")]
+    except ValueError:
+        parser.error("--minutes must be a comma separated list of numbers.")
+    if any(m <= 0 for m in minutes):
+        parser.error("--minutes must be positive.")
+    ops: [str] = options.only.split(",")
+    if any(o not in OPS for o in ops):
+        parser.error(f"--only must be a comma separated list of {', '.join(OPS)}.")
+    if options.repeat < 1:
+        parser.error("--repeat must be at least 1.")
+    if options.detect_shards < 1:
+        parser.error("--detect-shards must be at least 1.")
+    if options.replace_dir is not None and not os.path.isdir(options.replace_dir):
+        parser.error(f"{options.replace_dir} is not a directory.")
+    rg.configure_detection(options.detect_shards, options.coarse)
+    rg.configure_cutting(options.smart_render)
+
+    run: dict = {"started": dt.datetime.now().isoformat(timespec="seconds"),
+                 "host": socket.gethostname(),
+                 "commit": git_commit(),
+                 "ffmpeg": ffmpeg_version(),
+                 "label": options.label,
+                 "size": options.size,
+                 "settings": {"detect_shards": options.detect_shards,
+                              "coarse": options.coarse,
+                              "smart_render": options.smart_render,
+                              "chunk_minutes": tcode.CHUNK_MINUTES,
+                              },
+                 "results": [],
+                 }
+    for length in minutes:
+        print(f"{msu.Color.BOLD}{msu.Color.BLUE}Benchmarking{msu.Color.END} {length:g} minutes.")
+        run["results"].extend(run_benchmarks(length, options.size, ops, options.repeat, options.replace_dir))
+
+    runs: [dict] = load_history(options.history)
+    print_comparison(run, previous_run(runs, run))
+    runs.append(run)
+    save_history(options.history, runs)
+    print(f"Results added to {options.history}.")
+
+
+if "__main__" == __name__:
+    try:
+        main()
+    finally:
+        sh.rmtree(benchmark_home, ignore_errors=True)
@@ -0,0 +1,141 @@
+import logging as log
+import multiprocessing as mp
+import optparse as op
+import os
+import socket
+import sys
+import threading
+import time
+
+import msutils as msu
+from msutils.ChunkSpool import POLL_SECONDS
+from transcode_to_hevc import FFMPEG_PROGRAM_LOCS
+
+if "__main__" == __name__:
+    # SETUP LOGGER BEFORE IMPORTS SO THEY CAN USE THESE SETTINGS
+    log.basicConfig(filename="chunk-worker.log",
+                    filemode="a",
+                    format="%(asctime)s %(process)7d %(funcName)15.15s %(levelname)5.5s %(lineno)4.4s %(message)s",
+                    datefmt="%Y%m%d-%H:%M:%S"
+                    )
+    log.getLogger().setLevel(log.DEBUG)
+
+
+def partial_output_name(output: str) -> str:
+    """ Encode next to the final name and rename when done, so a half written
+        chunk is never mistaken for a finished one.
+    """
+    root, ext = os.path.splitext(output)
+    return f"{root}.{socket.gethostname()}-{os.getpid()}{ext}"
+
+
+def encode_claimed_job(spool: msu.ChunkSpool, job: msu.ChunkJob, ffmpeg_program: str, threads: int) -> None:
+    print(f"{msu.Color.BOLD}{msu.Color.BLUE}Encoding{msu.Color.END} {job.chunk}")
+    log.info(f"Encoding {job.chunk}")
+
+    stop_heartbeat: threading.Event = threading.Event()
+    heartbeat: threading.Thread = spool.heartbeat_thread(job, stop_heartbeat)
+
+    video_args: [str] = list(job.video_args)
+    if threads > 0:
+        video_args += ["-threads", str(threads), "-x265-params", f"pools={threads}"]
+    partial: str = partial_output_name(job.output)
+    try:
+        # ffmpeg -y WOULD WRITE THROUGH A LINK LEFT AT THE PARTIAL NAME.
+        if os.path.lexists(partial):
+            os.unlink(partial)
+        msu.encode_chunk(ffmpeg_program, job.chunk, video_args, output=partial)
+        os.rename(partial, job.output)
+        spool.complete(job)
+        log.info(f"Finished {job.chunk}")
+    except (msu.MediaServerUtilityException, OSError) as e:
+        log.error(f"Encoding {job.chunk} failed.")
+        log.exception(e)
+        try:
+            spool.fail(job, str(e).replace("\n", " "))
+            if os.path.exists(partial):
+                os.unlink(partial)
+        except OSError:
+            pass    # THE COORDINATOR REMOVED THE JOB
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+
+
+def work_on_spool(spool_dir: str, ffmpeg_program: str, threads: int = 0, idle_exit: float = 0) -> None:
+    """ Encode chunks published to SPOOL_DIR until there has been nothing to
+        do for IDLE_EXIT seconds.  0 means run forever.
+    """
+    spool: msu.ChunkSpool = msu.ChunkSpool(spool_dir)
+    idle_since: float = time.monotonic()
+    while idle_exit <= 0 or time.monotonic() - idle_since < idle_exit:
+        claimed: msu.ChunkJob | None = None
+        for job in spool.pending():
+            if spool.claim(job):
+                claimed = job
+                break
+
+        if claimed is None:
+            time.sleep(POLL_SECONDS)
+            continue
+
+        encode_claimed_job(spool, claimed, ffmpeg_program, threads)
+        idle_since = time.monotonic()
+
+
+def parse_command_line() -> (op.Values, [str]):
+    parser = op.OptionParser(usage="%prog [options] spool-dir")
+    parser.add_option("-f", "--ffmpeg",
+                      dest="ffmpeg", default=None,
+                      help="ffmpeg program to use. Defaults to the first one found of " +
+                           ", ".join(FFMPEG_PROGRAM_LOCS) + "."
+                      )
+    parser.add_option("-w", "--workers",
+                      dest="workers", type="int", default=1,
+                      help="Number of chunks to encode at the same time on this host."
+                      )
+    parser.add_option("-t", "--threads",
+                      dest="threads", type="int", default=0,
+                      help="Threads for each chunk encode. 0 lets ffmpeg/x265 decide."
+                      )
+    parser.add_option("-i", "--idle-exit",
+                      dest="idle_exit", type="float", default=0,
+                      help="Exit after this many seconds with nothing to encode. 0 means never."
+                      )
+    options, vals = parser.parse_args()
+
+    if len(vals) != 1:
+        parser.error("Exactly one argument (spool directory) expected.")
+    if options.workers < 1:
+        parser.error("--workers must be at least 1.")
+    if options.ffmpeg is None:
+        options.ffmpeg = next((f for f in FFMPEG_PROGRAM_LOCS if os.access(f, os.X_OK)), FFMPEG_PROGRAM_LOCS[-1])
+
+    return options, vals
+
+
+def main():
+    options, vals = parse_command_line()
+    spool_dir: str = vals[0]
+    # CHUNK PROGRESS IS NOT INTERESTING ENOUGH TO RENDER.  ONLY THE COORDINATOR SHOWS PROGRESS.
+    msu.configure_progress(terminal=False)
+
+    if options.workers == 1:
+        work_on_spool(spool_dir, options.ffmpeg, options.threads, options.idle_exit)
+        return
+
+    workers: [mp.Process] = [mp.Process(target=work_on_spool,
+                                        args=(spool_dir, options.ffmpeg, options.threads, options.idle_exit),
+                                        name=f"chunk-worker-{n}"
+                                        )
+                             for n in range(options.workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    sys.exit(max(abs(w.exitcode or 0) for w in workers))
+
+
+if "__main__" == __name__:
+    main()
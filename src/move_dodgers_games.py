@@ -1,6 +1,7 @@
-import glob
+import optparse as op
 import os
-import shutil
+
+import msutils as msu
 
 TEAM_NAME = "Dodgers"
 # FILEMATCH_GLOB = f"*{TEAM_NAME}*"
@@ -16,41 +17,11 @@ GAME_POSTERS: dict = {"2024": "game-poster.jpg",
                       "2025": "game-poster.jpg",
                       "2026": "game-poster.webp",
                       }
-
-
-def get_year_from_game_filename(fn: str) -> str:
-    yr_start_idx: int = fn.find("-s") + 2
-    yr: str = fn[yr_start_idx:yr_start_idx+4]
-
-    return yr
-
-
-def get_plex_dir_for_year(yr: str) -> str:
-    return PLEX_DIR_FOR_GAMES[yr]
-
-
-def find_extension(fn: str) -> str:
-    fn_parts: [str] = fn.split(".")
-    return fn_parts[-1]
-
-
-def create_game_poster_for(file_name: str) -> None:
-    year = get_year_from_game_filename(file_name)
-    plex_dir: str = get_plex_dir_for_year(year)
-    poster_file: str = GAME_POSTERS[year]
-    poster_file_ext: str = find_extension(poster_file)
-
-    poster_original_path: str = os.path.join(plex_dir, poster_file)
-    final_poster_path: str = os.path.join(plex_dir, f"{file_name[:-4]}.{poster_file_ext}")
-
-    shutil.copyfile(poster_original_path, final_poster_path)
-
-
-def move_game_video(file_name: str, new_file_name: str) -> None:
-    year = get_year_from_game_filename(new_file_name)
-    plex_dir: str = get_plex_dir_for_year(year)
-    final_game_video_path: str = os.path.join(plex_dir, new_file_name)
-    shutil.move(file_name, final_game_video_path)
+MOVE_RULE: msu.MoveRule = msu.MoveRule(f"{TEAM_NAME} games", GAMES_RECORDED_DIR, FILEMATCH_GLOB,
+                                       year_dirs=PLEX_DIR_FOR_GAMES,
+                                       posters=GAME_POSTERS,
+                                       ready=msu.READY_ALWAYS
+                                       )
 
 
 def standardize_filename(orig_fn: str) -> str:
@@ -84,18 +55,31 @@ def standardize_filename(orig_fn: str) -> str:
 
     return f"{year}{day}{home_away}{opponent}-s{year}e{day}{ext}"
 
+
+def parse_command_line() -> op.Values:
+    parser = op.OptionParser()
+    parser.add_option("-w", "--watch",
+                      dest="watch", action="store_true", default=False,
+                      help="Keep running and move each game as soon as its file stops changing."
+                      )
+    options, _ = parser.parse_args()
+    return options
+
+
 def main() -> None:
+    options: op.Values = parse_command_line()
     print("Upload and newly recorded DODGERS games to plex ...")
     os.chdir(GAMES_RECORDED_DIR)
-    files_to_update: [str] = glob.glob(FILEMATCH_GLOB)
-
-    for fn in files_to_update:
-        new_fn: str = fn # standardize_filename(fn)
-        fn_wo_ext: str = new_fn[:-4]
-        print(f"Moving {fn} to plex ... ", end="", flush=True)
-        create_game_poster_for(new_fn)
-        move_game_video(fn, new_fn)
-        print("COMPLETE")
+
+    if options.watch:
+        # ONLY THE FILES OF THE DIRECTORY THAT SETTLED.  OTHERS MAY STILL BE BEING WRITTEN.
+        with msu.DirectoryWatcher(GAMES_RECORDED_DIR,
+                                  lambda settled: msu.move_media([MOVE_RULE], only_dir=settled),
+                                  recursive=False
+                                  ) as watcher:
+            watcher.run()
+    else:
+        msu.move_media([MOVE_RULE])
 
 
 if "__main__" == __name__:
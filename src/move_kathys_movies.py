@@ -1,33 +1,42 @@
+import optparse as op
 import os
-import shutil
+
+import msutils as msu
 
 RECORDINGS_DIR: str = "/home/jeff/Videos/recordings/movies"
 PLEX_DIR_FOR_MOVIES: str = "/nfs/Media-02/media-store/Video/Movies"
 
-
-def process_movie(movie_dir_name: str) -> None:
-    movie_files: [str] = os.listdir(movie_dir_name)
-
-    if len(movie_files) == 1 and movie_files[0][-4:].lower() == ".mkv":
-        print("            Moving movie ... ", end="", flush=True)
-        shutil.move(movie_dir_name, PLEX_DIR_FOR_MOVIES)
-        print("Complete.")
+# EACH MOVIE IS RECORDED INTO ITS OWN DIRECTORY.  IT IS FINISHED WHEN THE .mkv IS ALL THAT IS LEFT.
+MOVE_RULE: msu.MoveRule = msu.MoveRule("Movies", RECORDINGS_DIR, "*.[mM][kK][vV]",
+                                       dest_dir=PLEX_DIR_FOR_MOVIES,
+                                       ready=msu.READY_ONLY_FILE,
+                                       depth=1
+                                       )
 
 
-def ensure_dir_exists(path: str) -> None:
-    os.makedirs(path, exist_ok=True)
+def parse_command_line() -> op.Values:
+    parser = op.OptionParser()
+    parser.add_option("-w", "--watch",
+                      dest="watch", action="store_true", default=False,
+                      help="Keep running and move each movie as soon as its recording is finished."
+                      )
+    options, _ = parser.parse_args()
+    return options
 
 
 def main() -> None:
+    options: op.Values = parse_command_line()
     print("Upload newly recorded movies to plex ...")
     os.chdir(RECORDINGS_DIR)
-    movie_list: [str] = os.listdir(os.getcwd())
-    movie_list.sort()
 
-    for movie in movie_list:
-        if os.path.isdir(movie):
-            print(f"    Found dir for movie: {movie}.")
-            process_movie(movie)
+    if options.watch:
+        # ONLY THE FILES OF THE DIRECTORY THAT SETTLED.  OTHERS MAY STILL BE BEING WRITTEN.
+        with msu.DirectoryWatcher(RECORDINGS_DIR,
+                                  lambda settled: msu.move_media([MOVE_RULE], only_dir=settled)
+                                  ) as watcher:
+            watcher.run()
+    else:
+        msu.move_media([MOVE_RULE])
     print(f"    Complete")
 
 
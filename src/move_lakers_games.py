@@ -1,6 +1,7 @@
-import glob
+import optparse as op
 import os
-import shutil
+
+import msutils as msu
 
 GAMES_RECORDED_DIR: str = "/home/jeff/Videos/recordings/Lakers"
 PLEX_DIR_FOR_GAMES: dict = {"1962": "/nfs/Media-01/media-store/Video/Sports Games/Lakers/1961-62",
@@ -37,54 +38,37 @@ GAME_POSTERS: dict = {"1962": "game-poster.webp",
                       }
 
 
-def get_year_from_game_filename(fn: str) -> str:
-    yr_start_idx: int = fn.find("-s") + 2
-    yr: str = fn[yr_start_idx:yr_start_idx+4]
-
-    return yr
-
-
-def get_plex_dir_for_year(yr: str) -> str:
-    return PLEX_DIR_FOR_GAMES[yr]
-
-
-def find_extension(fn: str) -> str:
-    fn_parts: [str] = fn.split(".")
-    return fn_parts[-1]
-
-
-def create_game_poster_for(file_name: str) -> None:
-    year = get_year_from_game_filename(file_name)
-    plex_dir: str = get_plex_dir_for_year(year)
-    poster_file: str = GAME_POSTERS[year]
-    poster_file_ext: str = find_extension(poster_file)
-
-    poster_original_path: str = os.path.join(plex_dir, poster_file)
-    final_poster_path: str = os.path.join(plex_dir, f"{file_name[:-4]}.{poster_file_ext}")
-
-    shutil.copyfile(poster_original_path, final_poster_path)
+MOVE_RULE: msu.MoveRule = msu.MoveRule("Lakers games", GAMES_RECORDED_DIR, "*.mkv",
+                                       year_dirs=PLEX_DIR_FOR_GAMES,
+                                       posters=GAME_POSTERS,
+                                       ready=msu.READY_ONLY_STEM
+                                       )
 
 
-def move_game_video(file_name: str) -> None:
-    year = get_year_from_game_filename(file_name)
-    plex_dir: str = get_plex_dir_for_year(year)
-    final_game_video_path: str = os.path.join(plex_dir, file_name)
-    shutil.move(file_name, final_game_video_path)
+def parse_command_line() -> op.Values:
+    parser = op.OptionParser()
+    parser.add_option("-w", "--watch",
+                      dest="watch", action="store_true", default=False,
+                      help="Keep running and move each game as soon as its recording is finished."
+                      )
+    options, _ = parser.parse_args()
+    return options
 
 
 def main() -> None:
+    options: op.Values = parse_command_line()
     print("Upload and newly recorded Lakers games to plex ...")
     os.chdir(GAMES_RECORDED_DIR)
-    mkv_files: [str] = glob.glob("*.mkv")
 
-    for fn in mkv_files:
-        fn_wo_ext: str = fn[:-4]
-        file_count: int = len(glob.glob(f"{fn_wo_ext}.*"))
-        if file_count == 1:
-            print(f"Moving {fn} to plex ... ", end="", flush=True)
-            create_game_poster_for(fn)
-            move_game_video(fn)
-            print("COMPLETE")
+    if options.watch:
+        # ONLY THE FILES OF THE DIRECTORY THAT SETTLED.  OTHERS MAY STILL BE BEING WRITTEN.
+        with msu.DirectoryWatcher(GAMES_RECORDED_DIR,
+                                  lambda settled: msu.move_media([MOVE_RULE], only_dir=settled),
+                                  recursive=False
+                                  ) as watcher:
+            watcher.run()
+    else:
+        msu.move_media([MOVE_RULE])
 
 
 if "__main__" == __name__:
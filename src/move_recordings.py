@@ -0,0 +1,49 @@
+import logging as log
+import optparse as op
+
+import msutils as msu
+from msutils.media_mover import TRANSFERS_PER_MOUNT
+import move_dodgers_games
+import move_kathys_movies
+import move_lakers_games
+import move_tv_episodes
+
+if "__main__" == __name__:
+    # SETUP LOGGER BEFORE IMPORTS SO THEY CAN USE THESE SETTINGS
+    log.basicConfig(filename="move-recordings.log",
+                    filemode="a",
+                    format="%(asctime)s %(threadName)12.12s %(funcName)15.15s %(levelname)5.5s %(lineno)4.4s %(message)s",
+                    datefmt="%Y%m%d-%H:%M:%S"
+                    )
+    log.getLogger().setLevel(log.INFO)
+
+# EVERYTHING THE move_* SCRIPTS HANDLE.  MOVED TOGETHER SO EVERY NAS VOLUME IS BUSY AT ONCE.
+RULES: [msu.MoveRule] = [move_lakers_games.MOVE_RULE,
+                         move_dodgers_games.MOVE_RULE,
+                         move_tv_episodes.MOVE_RULE,
+                         move_kathys_movies.MOVE_RULE,
+                         ]
+
+
+def parse_command_line() -> op.Values:
+    parser = op.OptionParser()
+    parser.add_option("-p", "--per-mount",
+                      dest="per_mount", type="int", default=TRANSFERS_PER_MOUNT,
+                      help="Number of files copied to each destination mount at the same time."
+                      )
+    options, _ = parser.parse_args()
+
+    if options.per_mount < 1:
+        parser.error("--per-mount must be at least 1.")
+    return options
+
+
+def main() -> None:
+    options: op.Values = parse_command_line()
+    print("Upload newly recorded games, episodes and movies to plex ...")
+    moved: int = msu.move_media(RULES, options.per_mount)
+    print(f"    Complete. {moved} files moved.")
+
+
+if "__main__" == __name__:
+    main()
@@ -1,61 +1,42 @@
-import glob
+import optparse as op
 import os
-import shutil
+
+import msutils as msu
 
 # RECORDINGS_DIR: str = "/media/jeff/ToolsDisk/Videos/recordings/episodes"
 RECORDINGS_DIR: str = "/home/jeff/Videos/recordings/episodes"
 PLEX_DIR_FOR_TV: str = "/nfs/Media-02/media-store/Video/Television Shows"
 
-
-def process_episode(tv_show_dir_name: str, season_dir_name: str, file_name: str) -> None:
-    # file name should not include the extension.  (Mkv will be added automatically)
-    season_path: str = os.path.join(tv_show_dir_name, season_dir_name)
-    episode_path: str = os.path.join(season_path, file_name)
-    episode_files: [str] = glob.glob(f"{episode_path}.*")
-    episode_path = f"{episode_path}.mkv"
-
-    if len(episode_files) == 1:
-        print("            Moving episode file ... ", end="", flush=True)
-        ensure_dir_exists(os.path.join(PLEX_DIR_FOR_TV, season_path))
-        dest_path: str = os.path.join(PLEX_DIR_FOR_TV, season_path, f"{file_name}.mkv")
-        shutil.move(episode_path, dest_path)
-        print("Complete.")
-
-
-def process_season(tv_show_dir_name: str, season_dir_name: str) -> None:
-    season_dir: str = os.path.join(tv_show_dir_name, season_dir_name)
-    episode_list: [str] = os.listdir(season_dir)
-    episode_list.sort()
-
-    for episode in episode_list:
-        print(f"            Found episode {episode}")
-        if episode.endswith(".mkv"):
-            process_episode(tv_show_dir_name, season_dir_name, episode[:-4])
-
-
-def process_tv_show(tv_show_dir_name: str) -> None:
-    season_list: [str] = os.listdir(tv_show_dir_name)
-    season_list.sort()
-
-    for season in season_list:
-        print(f"        Found dir for season {season}.")
-        process_season(tv_show_dir_name, season)
+MOVE_RULE: msu.MoveRule = msu.MoveRule("Television episodes", RECORDINGS_DIR, "*.mkv",
+                                       dest_dir=PLEX_DIR_FOR_TV,
+                                       ready=msu.READY_ONLY_STEM,
+                                       depth=2     # SHOW/SEASON/EPISODE
+                                       )
 
 
-def ensure_dir_exists(path: str) -> None:
-    os.makedirs(path, exist_ok=True)
+def parse_command_line() -> op.Values:
+    parser = op.OptionParser()
+    parser.add_option("-w", "--watch",
+                      dest="watch", action="store_true", default=False,
+                      help="Keep running and move each episode as soon as its recording is finished."
+                      )
+    options, _ = parser.parse_args()
+    return options
 
 
 def main() -> None:
+    options: op.Values = parse_command_line()
     print("Upload newly recorded television show episodes to plex ...")
     os.chdir(RECORDINGS_DIR)
-    show_list: [str] = os.listdir(os.getcwd())
-    show_list.sort()
 
-    for tv_show in show_list:
-        if os.path.isdir(tv_show):
-            print(f"    Found dir for show {tv_show}.")
-            process_tv_show(tv_show)
+    if options.watch:
+        # ONLY THE FILES OF THE DIRECTORY THAT SETTLED.  OTHERS MAY STILL BE BEING WRITTEN.
+        with msu.DirectoryWatcher(RECORDINGS_DIR,
+                                  lambda settled: msu.move_media([MOVE_RULE], only_dir=settled)
+                                  ) as watcher:
+            watcher.run()
+    else:
+        msu.move_media([MOVE_RULE])
 
 
 if "__main__" == __name__:
@@ -0,0 +1,324 @@
+import collections as coll
+import json
+import logging as log
+import os
+import re
+import shutil as sh
+import socket
+import stat
+import tempfile
+import threading
+import time
+import typing as typ
+
+import msutils as msu
+
+JOB_SUFFIX: str = ".job"
+LOCK_SUFFIX: str = ".lock"
+DONE_SUFFIX: str = ".done"
+FAILED_SUFFIX: str = ".failed"
+
+# A LOCK NOT TOUCHED FOR THIS LONG BELONGS TO A WORKER THAT DIED.
+STALE_LOCK_SECONDS: float = 300.0
+HEARTBEAT_SECONDS: float = 30.0
+POLL_SECONDS: float = 5.0
+# GIVE UP ON A CHUNK THAT FAILED ON THIS MANY WORKERS.
+MAX_ATTEMPTS: int = 3
+# WHEN NO WORKER HAS TOUCHED ANY CHUNK FOR THIS LONG, THE COORDINATOR ENCODES THEM ITSELF.
+UNCLAIMED_SECONDS: float = 600.0
+
+# THE ONLY ffmpeg OPTIONS A JOB FILE MAY PASS.  ANYONE WHO CAN WRITE THE SPOOL CAN WRITE A JOB FILE, AND AN
+# OPTION NAMING A FILE (OR AN EXTRA OUTPUT) WOULD WRITE WHEREVER THE WORKERS CAN.
+JOB_VIDEO_OPTIONS: {str} = {"-c:v", "-crf", "-preset", "-x265-params"}
+# x265 PARAMETERS THAT NAME NO FILE (csv, analysis-save AND THE LIKE DO).
+JOB_X265_PARAMS: {str} = {"pools", "frame-threads", "repeat-headers", "open-gop", "keyint", "min-keyint",
+                          "bframes", "aq-mode", "aq-strength", "psy-rd", "psy-rdoq", "rc-lookahead", "sao", "no-sao",
+                          "log-level",
+                          }
+JOB_VALUE_PATTERN: re.Pattern = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_.+]*")
+
+# job_file, chunk AND output ARE FULL PATHS INSIDE THE SPOOL.
+ChunkJob = coll.namedtuple("ChunkJob", "job_file chunk output video_args")
+
+
+def owner_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def checked_video_args(video_args: [str]) -> [str]:
+    """ VIDEO_ARGS if they are option and value pairs a job may pass to ffmpeg. """
+    if not isinstance(video_args, list) or len(video_args) % 2 != 0 or \
+            not all(isinstance(arg, str) for arg in video_args):
+        raise msu.MediaServerUtilityException(f"Chunk job video arguments are not option and value pairs.")
+    for option, value in zip(video_args[::2], video_args[1::2]):
+        if option not in JOB_VIDEO_OPTIONS:
+            raise msu.MediaServerUtilityException(f"Option {option} is not allowed in a chunk job.")
+        values: [str] = [value]
+        if option == "-x265-params":
+            params: [(str, str)] = [param.partition("=")[::2] for param in value.split(":")]
+            if any(key not in JOB_X265_PARAMS for key, _ in params):
+                raise msu.MediaServerUtilityException(f"x265 parameters {value} are not allowed in a chunk job.")
+            values = [param_value or "1" for _, param_value in params]
+        if any(JOB_VALUE_PATTERN.fullmatch(v) is None for v in values):
+            raise msu.MediaServerUtilityException(f"Value {value} of {option} is not allowed in a chunk job.")
+    return video_args
+
+
+def path_in_job(job_dir: str, name: str) -> str:
+    """ NAME (from a job file) as a path in JOB_DIR.  A name with a directory,
+        or a symbolic link out of JOB_DIR, is refused.
+    """
+    if not isinstance(name, str) or name in ("", ".", "..") or os.path.basename(name) != name:
+        raise msu.MediaServerUtilityException(f"Chunk job file name {name!r} is not a plain file name.")
+    path: str = os.path.join(job_dir, name)
+    if os.path.dirname(os.path.realpath(path)) != os.path.realpath(job_dir):
+        raise msu.MediaServerUtilityException(f"Chunk job file {path} is outside its job directory.")
+    return path
+
+
+class ChunkSpool:
+    """ Work queue of chunk encodes kept as plain files in a directory that
+        every host mounts (e.g. over NFS).
+
+        Each coordinator job is a sub-directory holding the source chunks.
+        chunk-0000.mkv.job describes one encode.  A worker owns it while
+        chunk-0000.mkv.lock exists (created with O_EXCL and touched as a
+        heartbeat), and marks it finished with chunk-0000.mkv.done once
+        encoded-0000.mkv is in place.
+    """
+    def __init__(self, spool_dir: str):
+        os.makedirs(spool_dir, exist_ok=True)
+        self.spool_dir: str = os.path.abspath(spool_dir)
+
+    def new_job_dir(self, source: str) -> str:
+        prefix: str = f"{os.path.splitext(os.path.basename(source))[0][:40]}-"
+        return tempfile.mkdtemp(prefix=prefix, dir=self.spool_dir)
+
+    def publish(self, chunks: [str], video_args: [str]) -> [ChunkJob]:
+        """ Make CHUNKS (already in a job dir) available to workers. """
+        checked_video_args(video_args)
+        jobs: [ChunkJob] = []
+        for chunk in chunks:
+            job: ChunkJob = ChunkJob(f"{chunk}{JOB_SUFFIX}", chunk, msu.encoded_chunk_name(chunk), video_args)
+            # WRITE THEN RENAME SO A WORKER NEVER SEES HALF A JOB FILE.
+            temp_file: str = f"{job.job_file}.tmp"
+            with open(temp_file, "w") as fd:
+                json.dump({"chunk": os.path.basename(job.chunk),
+                           "output": os.path.basename(job.output),
+                           "video_args": video_args
+                           },
+                          fd
+                          )
+            os.rename(temp_file, job.job_file)
+            jobs.append(job)
+
+        log.info(f"Published {len(jobs)} chunk jobs to {self.spool_dir}.")
+        return jobs
+
+    def wait_for(self,
+                 jobs: [ChunkJob],
+                 on_done: typ.Callable[[int], None] = None,
+                 encode_locally: typ.Callable[[ChunkJob], None] = None,
+                 unclaimed_seconds: float = UNCLAIMED_SECONDS
+                 ) -> [str]:
+        """ Block until every job is done.  ON_DONE is called with the index
+            of each job as it finishes.  Returns the encoded chunks in order.
+            When no worker has worked on any of them for UNCLAIMED_SECONDS,
+            the next unclaimed one is passed to ENCODE_LOCALLY (which writes
+            its output), or, without ENCODE_LOCALLY, the wait fails.
+        """
+        remaining: set = set(range(len(jobs)))
+        # ONLY WORKERS COUNT AS ACTIVITY.  ONCE NONE IS FOUND, THE REST ARE ENCODED HERE ONE AFTER ANOTHER.
+        encoded_here: set = set()
+        last_activity: float = time.monotonic()
+        while len(remaining) > 0:
+            for idx in sorted(remaining):
+                job: ChunkJob = jobs[idx]
+                if os.path.exists(f"{job.chunk}{DONE_SUFFIX}"):
+                    remaining.discard(idx)
+                    if idx not in encoded_here:
+                        last_activity = time.monotonic()
+                    if on_done is not None:
+                        on_done(idx)
+                elif self.attempts(job) >= MAX_ATTEMPTS:
+                    raise msu.MediaServerUtilityException(f"Chunk {job.chunk} failed on {MAX_ATTEMPTS} workers.")
+                else:
+                    self.break_stale_lock(job)
+                    if os.path.exists(f"{job.chunk}{LOCK_SUFFIX}"):
+                        last_activity = time.monotonic()
+            if len(remaining) == 0:
+                break
+
+            if time.monotonic() - last_activity >= unclaimed_seconds:
+                if encode_locally is None:
+                    raise msu.MediaServerUtilityException(f"No worker has encoded a chunk published to "
+                                                          f"{self.spool_dir} for {unclaimed_seconds:,.0f} seconds."
+                                                          )
+                for idx in sorted(remaining):
+                    if self.claim(jobs[idx]):
+                        log.warning(f"No worker is encoding chunks. Encoding {jobs[idx].chunk} locally.")
+                        self.encode_claimed(jobs[idx], encode_locally)
+                        encoded_here.add(idx)
+                        break
+                continue
+            time.sleep(POLL_SECONDS)
+
+        return [job.output for job in jobs]
+
+    def encode_claimed(self, job: ChunkJob, encode: typ.Callable[[ChunkJob], None]) -> None:
+        """ Run ENCODE on a claimed JOB, keeping its lock fresh, and mark it
+            done, or failed if ENCODE raises.
+        """
+        stop_heartbeat: threading.Event = threading.Event()
+        heartbeat: threading.Thread = self.heartbeat_thread(job, stop_heartbeat)
+        try:
+            encode(job)
+            self.complete(job)
+        except BaseException as e:
+            self.fail(job, str(e).replace("\n", " "))
+            raise
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+
+    @staticmethod
+    def heartbeat_thread(job: ChunkJob, stop: threading.Event) -> threading.Thread:
+        """ Started thread touching the lock of JOB until STOP is set. """
+        def keep_lock() -> None:
+            while not stop.wait(HEARTBEAT_SECONDS):
+                ChunkSpool.heartbeat(job)
+
+        heartbeat: threading.Thread = threading.Thread(target=keep_lock, daemon=True)
+        heartbeat.start()
+        return heartbeat
+
+    @staticmethod
+    def remove(job_dir: str) -> None:
+        sh.rmtree(job_dir, ignore_errors=True)
+
+    def pending(self) -> typ.Iterator[ChunkJob]:
+        """ Jobs not yet done, oldest coordinator job first. """
+        # A COORDINATOR CAN REMOVE ITS JOB DIR AT ANY TIME.  EACH IS STATTED ONCE AND SKIPPED IF GONE.
+        job_dirs: [(float, str)] = []
+        for name in os.listdir(self.spool_dir):
+            job_dir: str = os.path.join(self.spool_dir, name)
+            try:
+                st: os.stat_result = os.stat(job_dir)
+            except FileNotFoundError:
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                job_dirs.append((st.st_mtime, job_dir))
+
+        for _, job_dir in sorted(job_dirs):
+            try:
+                names: [str] = sorted(os.listdir(job_dir))
+            except FileNotFoundError:
+                continue    # COORDINATOR FINISHED (OR GAVE UP) MEANWHILE
+            for name in names:
+                if not name.endswith(JOB_SUFFIX):
+                    continue
+                chunk: str = os.path.join(job_dir, name[:-len(JOB_SUFFIX)])
+                if os.path.exists(f"{chunk}{DONE_SUFFIX}"):
+                    continue
+                job: ChunkJob | None = self.read_job(os.path.join(job_dir, name))
+                if job is not None and self.attempts(job) < MAX_ATTEMPTS:
+                    yield job
+
+    @staticmethod
+    def read_job(job_file: str) -> ChunkJob | None:
+        """ The job in JOB_FILE, or None if it cannot be read or is not one
+            publish would have written.
+        """
+        try:
+            with open(job_file) as fd:
+                data: dict = json.load(fd)
+        except (OSError, ValueError) as e:
+            log.warning(f"Cannot read chunk job {job_file}. {e}")
+            return None
+        job_dir: str = os.path.dirname(job_file)
+        try:
+            if not isinstance(data, dict) or f"{data.get('chunk')}{JOB_SUFFIX}" != os.path.basename(job_file):
+                raise msu.MediaServerUtilityException(f"Chunk job is not for the chunk it is named after.")
+            chunk: str = path_in_job(job_dir, data["chunk"])
+            output: str = path_in_job(job_dir, data.get("output"))
+            if os.path.basename(output) != msu.encoded_chunk_name(data["chunk"]):
+                raise msu.MediaServerUtilityException(f"Chunk job output {output} is not its chunk's.")
+            return ChunkJob(job_file, chunk, output, checked_video_args(data.get("video_args")))
+        except msu.MediaServerUtilityException as msue:
+            log.error(f"Refusing chunk job {job_file}. {msue}")
+            return None
+
+    def claim(self, job: ChunkJob) -> bool:
+        """ Try to become the only worker encoding JOB. """
+        self.break_stale_lock(job)
+        try:
+            fd: int = os.open(f"{job.chunk}{LOCK_SUFFIX}", os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        except FileNotFoundError:
+            return False    # JOB DIRECTORY REMOVED
+        with os.fdopen(fd, "w") as lock_file:
+            lock_file.write(f"{owner_name()}\n")
+
+        # ANOTHER WORKER MAY HAVE FINISHED IT BETWEEN THE SCAN AND THE CLAIM.
+        if os.path.exists(f"{job.chunk}{DONE_SUFFIX}"):
+            self.release(job)
+            return False
+        return True
+
+    @staticmethod
+    def heartbeat(job: ChunkJob) -> None:
+        try:
+            os.utime(f"{job.chunk}{LOCK_SUFFIX}")
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def break_stale_lock(job: ChunkJob) -> None:
+        lock_file: str = f"{job.chunk}{LOCK_SUFFIX}"
+        try:
+            age: float = time.time() - os.stat(lock_file).st_mtime
+        except FileNotFoundError:
+            return
+        if age < STALE_LOCK_SECONDS:
+            return
+
+        # RENAME FIRST SO ONLY ONE PROCESS BREAKS (AND COUNTS) THE LOCK.
+        broken: str = f"{lock_file}.stale-{owner_name().replace(':', '-')}"
+        try:
+            os.rename(lock_file, broken)
+        except FileNotFoundError:
+            return
+        os.unlink(broken)
+        log.warning(f"Broke lock on {job.chunk} held for {age:,.0f} seconds.")
+        ChunkSpool.record_failure(job, "stale lock")
+
+    @staticmethod
+    def release(job: ChunkJob) -> None:
+        try:
+            os.unlink(f"{job.chunk}{LOCK_SUFFIX}")
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def complete(job: ChunkJob) -> None:
+        with open(f"{job.chunk}{DONE_SUFFIX}", "w") as fd:
+            fd.write(f"{owner_name()}\n")
+        ChunkSpool.release(job)
+
+    @staticmethod
+    def record_failure(job: ChunkJob, reason: str) -> None:
+        with open(f"{job.chunk}{FAILED_SUFFIX}", "a") as fd:
+            fd.write(f"{owner_name()} {reason}\n")
+
+    def fail(self, job: ChunkJob, reason: str) -> None:
+        self.record_failure(job, reason)
+        self.release(job)
+
+    @staticmethod
+    def attempts(job: ChunkJob) -> int:
+        try:
+            with open(f"{job.chunk}{FAILED_SUFFIX}") as fd:
+                return sum(1 for _ in fd)
+        except FileNotFoundError:
+            return 0
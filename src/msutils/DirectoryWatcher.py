@@ -0,0 +1,242 @@
+import collections as coll
+import ctypes
+import ctypes.util
+import errno
+import logging as log
+import os
+import select
+import struct
+import time
+import typing as typ
+
+# FROM <sys/inotify.h>
+IN_MODIFY: int = 0x00000002
+IN_CLOSE_WRITE: int = 0x00000008
+IN_MOVED_FROM: int = 0x00000040
+IN_MOVED_TO: int = 0x00000080
+IN_CREATE: int = 0x00000100
+IN_DELETE: int = 0x00000200
+IN_DELETE_SELF: int = 0x00000400
+IN_Q_OVERFLOW: int = 0x00004000
+IN_IGNORED: int = 0x00008000
+IN_ONLYDIR: int = 0x01000000
+IN_ISDIR: int = 0x40000000
+IN_CLOEXEC: int = 0o2000000
+IN_NONBLOCK: int = 0o4000
+
+WATCH_MASK: int = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE | IN_DELETE_SELF | \
+    IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII")
+
+# A DIRECTORY IS HANDED OFF ONCE NO FILE IN IT IS BEING WRITTEN AND ITS FILES LOOK THE SAME TWICE,
+# THIS FAR APART.
+SETTLE_SECONDS: float = 5.0
+
+InotifyEvent = coll.namedtuple("InotifyEvent", "wd mask cookie name")
+
+_libc = None
+
+
+def libc():
+    global _libc
+
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return _libc
+
+
+class Inotify:
+    """ Minimal ctypes wrapper around the Linux inotify API. """
+    def __init__(self):
+        self.fd: int = libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err: int = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1: {os.strerror(err)}")
+
+    def add_watch(self, path: str, mask: int = WATCH_MASK) -> int:
+        wd: int = libc().inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err: int = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch: {os.strerror(err)}", path)
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        libc().inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout: float | None) -> [InotifyEvent]:
+        """ Events available within TIMEOUT seconds (None waits forever). """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if len(ready) == 0:
+            return []
+        try:
+            data: bytes = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events: [InotifyEvent] = []
+        offset: int = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, name_len = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name: str = os.fsdecode(data[offset:offset + name_len].rstrip(b"\0"))
+            offset += name_len
+            events.append(InotifyEvent(wd, mask, cookie, name))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def dir_snapshot(dir_name: str) -> dict | None:
+    """ {name: (size, mtime_ns)} of the files in DIR_NAME. """
+    try:
+        with os.scandir(dir_name) as entries:
+            return {e.name: (e.stat().st_size, e.stat().st_mtime_ns) for e in entries if e.is_file()}
+    except FileNotFoundError:
+        return None
+
+
+class DirectoryWatcher:
+    """ Watches ROOT and (if RECURSIVE) every directory below it.  When files
+        in a directory are written, moved in or removed, HANDLE_DIR is called
+        with that directory once its files have stopped changing.  A file
+        created or written since it was last closed is still being written,
+        however long its writer stalls, and holds back its directory.
+    """
+    def __init__(self,
+                 root: str,
+                 handle_dir: typ.Callable[[str], None],
+                 recursive: bool = True,
+                 settle_seconds: float = SETTLE_SECONDS
+                 ):
+        self.root: str = os.path.abspath(root)
+        self.handle_dir: typ.Callable[[str], None] = handle_dir
+        self.recursive: bool = recursive
+        self.settle_seconds: float = settle_seconds
+        self.inotify: Inotify = Inotify()
+        self.watches: dict = {}
+        # DIRECTORY -> (TIME TO LOOK AGAIN, SNAPSHOT WHEN LAST LOOKED OR None)
+        self.pending: dict = {}
+        # DIRECTORY -> NAMES OF THE FILES IN IT OPEN FOR WRITING
+        self.writing: coll.defaultdict = coll.defaultdict(set)
+        self.watch_tree(self.root)
+
+    def watch_tree(self, dir_name: str) -> None:
+        """ Watch DIR_NAME (and its sub-directories).  Anything already in them
+            is treated as new, since it may have arrived before the watch.
+        """
+        try:
+            self.watches[self.inotify.add_watch(dir_name)] = dir_name
+        except OSError as e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            return
+        self.changed(dir_name)
+
+        if self.recursive:
+            try:
+                with os.scandir(dir_name) as entries:
+                    sub_dirs: [str] = [e.path for e in entries if e.is_dir(follow_symlinks=False)]
+            except FileNotFoundError:
+                return
+            for sub_dir in sorted(sub_dirs):
+                self.watch_tree(sub_dir)
+
+    def unwatch_tree(self, dir_name: str) -> None:
+        """ DIR_NAME was moved away.  Its watches would report the wrong paths. """
+        for wd, watched in list(self.watches.items()):
+            if watched == dir_name or watched.startswith(f"{dir_name}/"):
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+                self.pending.pop(watched, None)
+                self.writing.pop(watched, None)
+
+    def changed(self, dir_name: str) -> None:
+        self.pending[dir_name] = (time.monotonic() + self.settle_seconds, None)
+
+    def _handle_event(self, event: InotifyEvent) -> None:
+        if event.mask & IN_Q_OVERFLOW:
+            log.warning(f"inotify queue overflowed. Rechecking everything under {self.root}.")
+            # CLOSES MAY HAVE BEEN LOST.  FILES STILL BEING WRITTEN SHOW UP AGAIN WITH THEIR NEXT WRITE.
+            self.writing.clear()
+            for dir_name in self.watches.values():
+                self.changed(dir_name)
+            return
+
+        dir_name: str | None = self.watches.get(event.wd)
+        if dir_name is None:
+            return
+        if event.mask & (IN_IGNORED | IN_DELETE_SELF):
+            del self.watches[event.wd]
+            self.pending.pop(dir_name, None)
+            self.writing.pop(dir_name, None)
+            return
+
+        path: str = os.path.join(dir_name, event.name)
+        if event.mask & IN_ISDIR:
+            if self.recursive and event.mask & (IN_CREATE | IN_MOVED_TO):
+                self.watch_tree(path)
+            elif event.mask & IN_MOVED_FROM:
+                self.unwatch_tree(path)
+            return
+
+        if event.mask & IN_MODIFY or (event.mask & IN_CREATE and not os.path.islink(path)):
+            self.writing[dir_name].add(event.name)
+            if event.mask & IN_MODIFY:
+                return      # THE CLOSE THAT FOLLOWS STARTS THE SETTLING
+        else:
+            self.writing[dir_name].discard(event.name)
+        self.changed(dir_name)
+
+    def _hand_off_settled(self) -> None:
+        now: float = time.monotonic()
+        for dir_name, (due, previous) in list(self.pending.items()):
+            if due > now:
+                continue
+            if len(self.writing.get(dir_name, ())) > 0:
+                self.pending[dir_name] = (now + self.settle_seconds, None)
+                continue
+            snapshot: dict | None = dir_snapshot(dir_name)
+            if snapshot is None:
+                del self.pending[dir_name]
+            elif snapshot != previous:
+                # STILL CHANGING (OR FIRST LOOK).  LOOK AGAIN LATER.
+                self.pending[dir_name] = (now + self.settle_seconds, snapshot)
+            else:
+                del self.pending[dir_name]
+                try:
+                    self.handle_dir(dir_name)
+                except Exception as e:
+                    log.error(f"Handling {dir_name} failed.")
+                    log.exception(e)
+                    print(f"Error handling {dir_name}. {e}")
+
+    def run_once(self, max_wait: float = None) -> None:
+        """ Wait (at most MAX_WAIT seconds) for events or for a directory to
+            be due, then hand off the directories that settled.
+        """
+        timeout: float | None = max_wait
+        if len(self.pending) > 0:
+            due_in: float = max(0.0, min(due for due, _ in self.pending.values()) - time.monotonic())
+            timeout = due_in if timeout is None else min(timeout, due_in)
+        for event in self.inotify.read_events(timeout):
+            self._handle_event(event)
+        self._hand_off_settled()
+
+    def run(self) -> None:
+        """ Watch forever. """
+        log.info(f"Watching {self.root} ({len(self.watches)} directories).")
+        while True:
+            self.run_once()
+
+    def close(self) -> None:
+        self.inotify.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,156 @@
+import collections as coll
+import logging as log
+import os
+import subprocess as proc
+import threading
+import typing as typ
+
+import msutils as msu
+
+# NUMBER OF UNHANDLED DIAGNOSTIC LINES KEPT FOR LOGGING WHEN ffmpeg FAILS.
+DIAGNOSTIC_LINES_KEPT: int = 200
+
+# HANDLERS FOR ffmpeg's DIAGNOSTIC OUTPUT RETURN True IF THEY USED THE LINE.
+LineHandler = typ.Callable[[str], bool]
+# HANDLERS FOR ONE COMPLETE -progress RECORD.
+ProgressHandler = typ.Callable[[dict], None]
+
+
+def progress_seconds(record: dict) -> float | None:
+    """ Position in the output (seconds) from a -progress record. """
+    for key in ("out_time_us", "out_time_ms"):     # out_time_ms IS ALSO IN MICROSECONDS
+        value: str = record.get(key, "N/A")
+        if value not in ("", "N/A"):
+            try:
+                return max(0, int(value)) / 1_000_000
+            except ValueError:
+                pass
+    return None
+
+
+def progress_speed(record: dict) -> float | None:
+    """ Encoding speed as a multiple of real time, e.g. "2.5x" -> 2.5 """
+    value: str = record.get("speed", "N/A").strip().rstrip("x")
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class FFmpegRunner:
+    """ Runs one ffmpeg command.  Progress is read from the machine readable
+        -progress protocol on stdout.  Diagnostics on stderr are passed to
+        the line handlers (e.g. freeze/silence detection) and anything no
+        handler wants is logged.
+    """
+    def __init__(self,
+                 ffmpeg_args: [str],
+                 duration: float = 0.0,
+                 label: str = "Progress",
+                 show_progress: bool = True,
+                 file_name: str = "",
+                 expected_seconds: float = None
+                 ):
+        self.ffmpeg_args: [str] = FFmpegRunner.with_progress_args(ffmpeg_args)
+        self.duration: float = duration
+        self.label: str = label
+        self.reporter: msu.ProgressReporter | None = None
+        self.line_handlers: [LineHandler] = []
+        self.progress_handlers: [ProgressHandler] = []
+        self.diagnostics: coll.deque = coll.deque(maxlen=DIAGNOSTIC_LINES_KEPT)
+        self.last_progress: dict = {}
+        self.returncode: int | None = None
+        self._handler_error: BaseException | None = None
+
+        if show_progress:
+            self.reporter = msu.ProgressReporter(file_name, label, duration, expected_seconds)
+            self.add_progress_handler(self.report_progress)
+
+    @staticmethod
+    def with_progress_args(ffmpeg_args: [str]) -> [str]:
+        """ Insert the progress options right after the ffmpeg program (which
+            may be preceded by "nice").
+        """
+        for idx, arg in enumerate(ffmpeg_args):
+            if os.path.basename(arg) == "ffmpeg":
+                return [*ffmpeg_args[:idx+1], "-nostats", "-progress", "pipe:1", *ffmpeg_args[idx+1:]]
+
+        raise msu.MediaServerUtilityException(f"Cannot find the ffmpeg program in {ffmpeg_args}.")
+
+    def add_line_handler(self, handler: LineHandler) -> None:
+        self.line_handlers.append(handler)
+
+    def add_progress_handler(self, handler: ProgressHandler) -> None:
+        self.progress_handlers.append(handler)
+
+    def current_time(self) -> float:
+        return progress_seconds(self.last_progress) or 0.0
+
+    def report_progress(self, record: dict) -> None:
+        current: float | None = progress_seconds(record)
+        if current is not None and record.get("progress") != "end":
+            self.reporter.update(current, progress_speed(record))
+
+    def _read_diagnostics(self, process: proc.Popen) -> None:
+        try:
+            for line in process.stderr:
+                if self._handler_error is not None:
+                    continue    # DRAIN SO ffmpeg IS NEVER BLOCKED ON A FULL PIPE
+                if not any([handler(line) for handler in self.line_handlers]):
+                    self.diagnostics.append(line)
+                    log.info(f"ffmpeg says: {line.rstrip()}")
+        except BaseException as e:
+            self._handler_error = e
+            process.kill()
+            for _ in process.stderr:
+                pass
+
+    def _read_progress(self, process: proc.Popen) -> None:
+        record: dict = {}
+        for line in process.stdout:
+            key, sep, value = line.strip().partition("=")
+            if sep == "":
+                continue
+            record[key] = value
+            if key == "progress":
+                # "progress" IS ALWAYS THE LAST KEY OF A RECORD
+                self.last_progress = record
+                for handler in self.progress_handlers:
+                    handler(record)
+                record = {}
+
+    def run(self) -> int:
+        """ Run ffmpeg to completion and return its exit code.  An exception
+            raised by a line handler stops ffmpeg and is re-raised here.
+        """
+        log.debug(f"Running {self.ffmpeg_args}")
+        with proc.Popen(self.ffmpeg_args,
+                        text=True,
+                        errors="replace",
+                        stdin=proc.DEVNULL,
+                        stdout=proc.PIPE,
+                        stderr=proc.PIPE
+                        ) as process:
+            diagnostics_reader = threading.Thread(target=self._read_diagnostics, args=(process,), daemon=True)
+            diagnostics_reader.start()
+            try:
+                self._read_progress(process)
+            except BaseException:
+                process.kill()
+                raise
+            finally:
+                diagnostics_reader.join()
+
+        self.returncode = process.returncode
+        if self._handler_error is not None:
+            raise self._handler_error
+        if self.returncode == 0:
+            if self.reporter is not None:
+                self.reporter.complete()
+        else:
+            if self.reporter is not None:
+                self.reporter.failed()
+            for line in self.diagnostics:
+                log.debug(line.rstrip())
+
+        return self.returncode
@@ -0,0 +1,189 @@
+import errno
+import fcntl
+import json
+import logging as log
+import os
+
+XATTR_PREFIX: str = "user."
+# KEPT IN EACH DIRECTORY WHOSE FILESYSTEM HAS NO USER XATTRS (SOME NFS EXPORTS).
+SIDECAR_FILE_NAME: str = ".msutils-state.json"
+NO_XATTR_ERRORS: set = {errno.ENOTSUP, errno.EOPNOTSUPP}
+
+# FILE NAME -> FileState.  EACH FILE'S ATTRIBUTES ARE READ ONCE PER PROCESS.
+_states: dict = {}
+# DIRECTORY -> {base name: [inode, {attribute: value}]}
+_sidecars: dict = {}
+# DIRECTORIES WHERE setxattr/getxattr ARE NOT SUPPORTED.
+_no_xattr_dirs: set = set()
+
+
+def _decode(value: bytes) -> str:
+    # surrogateescape KEEPS VALUES THAT ARE NOT UTF-8 INTACT.
+    return str(value, "UTF-8", "surrogateescape")
+
+
+def _encode(value: str) -> bytes:
+    return bytes(value, "UTF-8", "surrogateescape")
+
+
+class FileState:
+    """ The user.* attributes of one file.  They are kept as xattrs when
+        the filesystem allows and otherwise in a sidecar file holding the
+        attributes of every file in the directory.
+
+        Values are read on first use and cached, so checking a flag costs
+        at most one getxattr (or one sidecar read per directory).  set()
+        only records the change.  flush() (or leaving a with block) writes
+        them all.
+    """
+    def __init__(self, file_name: str):
+        self.file_name: str = os.path.abspath(file_name)
+        self.dir_name: str = os.path.dirname(self.file_name)
+        # ATTRIBUTE -> VALUE, OR None IF THE FILE DOES NOT HAVE IT.
+        self.values: dict = {}
+        self.complete: bool = False
+        self.pending: dict = {}
+
+    @classmethod
+    def of(cls, file_name: str):
+        path: str = os.path.abspath(file_name)
+        if path not in _states:
+            _states[path] = cls(path)
+        return _states[path]
+
+    @staticmethod
+    def forget(file_name: str) -> None:
+        _states.pop(os.path.abspath(file_name), None)
+
+    @staticmethod
+    def renamed(old_name: str, new_name: str) -> None:
+        """ OLD_NAME was renamed (over) NEW_NAME.  Xattrs go with the file,
+            but sidecar entries and cached state are kept by name.
+        """
+        old_path: str = os.path.abspath(old_name)
+        new_path: str = os.path.abspath(new_name)
+        _states.pop(new_path, None)
+        state: FileState | None = _states.pop(old_path, None)
+        if state is not None:
+            state.file_name = new_path
+            state.dir_name = os.path.dirname(new_path)
+            _states[new_path] = state
+
+        if os.path.dirname(old_path) in _no_xattr_dirs:
+            attrs: dict = FileState(old_path).sidecar_attrs(os.stat(new_path).st_ino)
+            _update_sidecar(os.path.dirname(old_path), os.path.basename(old_path), None)
+            _update_sidecar(os.path.dirname(new_path), os.path.basename(new_path), attrs)
+
+    def uses_xattrs(self) -> bool:
+        return self.dir_name not in _no_xattr_dirs
+
+    def _no_xattrs(self, e: OSError) -> None:
+        if e.errno not in NO_XATTR_ERRORS:
+            raise e
+        log.info(f"No user xattrs in {self.dir_name}. Keeping file state in {SIDECAR_FILE_NAME}.")
+        _no_xattr_dirs.add(self.dir_name)
+
+    def sidecar_attrs(self, ino: int = None) -> dict:
+        entry: list | None = _load_sidecar(self.dir_name).get(os.path.basename(self.file_name))
+        if entry is None:
+            return {}
+        if ino is None:
+            ino = os.stat(self.file_name).st_ino
+        # A DIFFERENT FILE THAT GOT THE SAME NAME STARTS WITH NO STATE.
+        return dict(entry[1]) if entry[0] == ino else {}
+
+    def _read(self, attr: str) -> str | None:
+        if self.uses_xattrs():
+            try:
+                return _decode(os.getxattr(self.file_name, f"{XATTR_PREFIX}{attr}"))
+            except OSError as e:
+                if e.errno == errno.ENODATA:
+                    return None
+                self._no_xattrs(e)
+        return self.sidecar_attrs().get(attr)
+
+    def get(self, attr: str) -> str | None:
+        if attr in self.pending:
+            return self.pending[attr]
+        if attr not in self.values and not self.complete:
+            self.values[attr] = self._read(attr)
+        return self.values.get(attr)
+
+    def all(self) -> dict:
+        """ Every user attribute of the file.  {name without 'user.': value} """
+        if not self.complete:
+            values: dict | None = None
+            if self.uses_xattrs():
+                try:
+                    values = {n[len(XATTR_PREFIX):]: _decode(os.getxattr(self.file_name, n))
+                              for n in os.listxattr(self.file_name) if n.startswith(XATTR_PREFIX)}
+                except OSError as e:
+                    self._no_xattrs(e)
+            if values is None:
+                values = self.sidecar_attrs()
+            self.values = values
+            self.complete = True
+        return {**{k: v for k, v in self.values.items() if v is not None}, **self.pending}
+
+    def set(self, attr: str, value: str) -> None:
+        self.pending[attr] = value
+
+    def flush(self) -> None:
+        if len(self.pending) == 0:
+            return
+        if self.uses_xattrs():
+            try:
+                for attr, value in self.pending.items():
+                    os.setxattr(self.file_name, f"{XATTR_PREFIX}{attr}", _encode(value))
+            except OSError as e:
+                self._no_xattrs(e)
+        if not self.uses_xattrs():
+            _update_sidecar(self.dir_name, os.path.basename(self.file_name), self.pending, merge=True)
+
+        self.values.update(self.pending)
+        self.pending = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+
+def _load_sidecar(dir_name: str, reload: bool = False) -> dict:
+    if reload or dir_name not in _sidecars:
+        try:
+            with open(os.path.join(dir_name, SIDECAR_FILE_NAME)) as fd:
+                _sidecars[dir_name] = json.load(fd)
+        except FileNotFoundError:
+            _sidecars[dir_name] = {}
+        except ValueError as e:
+            log.warning(f"Ignoring unreadable {SIDECAR_FILE_NAME} in {dir_name}. {e}")
+            _sidecars[dir_name] = {}
+    return _sidecars[dir_name]
+
+
+def _update_sidecar(dir_name: str, base_name: str, attrs: dict | None, ino: int = None, merge: bool = False) -> None:
+    """ Replace (MERGE: update) one file's entry, or remove it if ATTRS is
+        None.  Other processes may be updating the same directory, so the
+        sidecar is re-read under a lock and rewritten with a rename.
+    """
+    sidecar_file: str = os.path.join(dir_name, SIDECAR_FILE_NAME)
+    with open(f"{sidecar_file}.lock", "a") as lock_fd:
+        fcntl.flock(lock_fd.fileno(), fcntl.LOCK_EX)
+        entries: dict = _load_sidecar(dir_name, reload=True)
+        if attrs is None:
+            if entries.pop(base_name, None) is None:
+                return
+        else:
+            if ino is None:
+                ino = os.stat(os.path.join(dir_name, base_name)).st_ino
+            previous: list | None = entries.get(base_name)
+            if merge and previous is not None and previous[0] == ino:
+                attrs = {**previous[1], **attrs}
+            entries[base_name] = [ino, attrs]
+
+        temp_name: str = f"{sidecar_file}.{os.getpid()}.tmp"
+        with open(temp_name, "w") as fd:
+            json.dump(entries, fd, separators=(",", ":"))
+        os.replace(temp_name, sidecar_file)
@@ -0,0 +1,137 @@
+import logging as log
+
+import msutils as msu
+
+
+def is_freeze_data(output) -> bool:
+    idx = output.find("lavfi.freezedetect.freeze_")
+    return idx >= 0
+
+
+def get_freeze_location(output: str) -> float:
+    broken_line: [str] = output.split(":")
+    if len(broken_line) < 2:
+        raise msu.MediaServerUtilityException(f"Invalid freeze line supplied to get_freeze_location. {output}")
+    return float(broken_line[1].strip())
+
+
+def process_freeze_output(output) -> (float | None, float | None):
+    start_info: bool = output.find("lavfi.freezedetect.freeze_start") > 0
+    end_info: bool = output.find("lavfi.freezedetect.freeze_end") > 0
+
+    if start_info:
+        # FOUND FREEZE START TIME
+        return get_freeze_location(output), None
+    elif end_info:
+        # FOUND FREEZE END TIME
+        return None, get_freeze_location(output)
+
+    # FREEZE DURATION OR OTHER FREEZE INFO THAT WE DON'T NEED.
+    return None, None
+
+
+def process_silence_output(output: str) -> (float | None, float | None):
+    start_info: bool = output.find("silence_start: ") >= 0
+    end_info: bool = output.find("silence_end: ") >= 0
+
+    time: float = float(output.split(" ")[4].strip())
+    if start_info:
+        return time, None
+    elif end_info:
+        return None, time
+
+    return None, None
+
+
+def is_silence_data(output: str) -> bool:
+    idx = output.find("[silencedetect")
+    return idx >= 0
+
+
+class FreezeAndSilenceFinder:
+    """ Line handler for FFmpegRunner that collects the output of the
+        freezedetect and silencedetect filters.  OFFSET is added to every
+        time reported, for when ffmpeg started reading at OFFSET (-ss).
+    """
+    def __init__(self, file_name: str, offset: float = 0.0):
+        self.file_name: str = file_name
+        self.offset: float = offset
+        self.found_video_freezes: msu.MovieSections = msu.MovieSections(file_name, "video")
+        self.found_silences: msu.MovieSections = msu.MovieSections(file_name, "audio")
+
+        self.current_freeze_start: float | None = None
+        self.current_silence_start: float | None = None
+
+    def shifted(self, times: (float | None, float | None)) -> (float | None, float | None):
+        return tuple(None if t is None else t + self.offset for t in times)
+
+    def handle_line(self, ffmpeg_output: str) -> bool:
+        # MONITOR FOR A FREEZE
+        if is_freeze_data(ffmpeg_output):
+            (start_f, end_f) = self.shifted(process_freeze_output(ffmpeg_output))
+
+            # CHECK FOR EXCEPTIONS
+            if start_f is not None and end_f is not None:
+                raise msu.MediaServerUtilityException(f"Freeze start and stop received simultaneously.")
+            if start_f is not None:
+                if self.current_freeze_start is not None:
+                    raise msu.MediaServerUtilityException(f"Two consecutive freeze starts encountered. End expected.")
+                # FREEZE START DATA RECEIVED
+                self.current_freeze_start = start_f
+            elif end_f is not None:
+                if self.current_freeze_start is None:
+                    raise msu.MediaServerUtilityException(f"Freeze end without a start.")
+
+                # FREEZE END DATA RECEIVED
+                freeze_info: msu.MovieSection = msu.MovieSection(self.current_freeze_start,
+                                                                 end_f,
+                                                                 f"{self.current_freeze_start}-{end_f}"
+                                                                 )
+                self.found_video_freezes.add_section(freeze_info)
+                log.debug(f"Freeze found from {self.current_freeze_start} to {end_f}")
+                self.current_freeze_start = None
+            return True
+
+        if is_silence_data(ffmpeg_output):
+            (start_s, end_s) = self.shifted(process_silence_output(ffmpeg_output))
+
+            # CHECK FOR EXCEPTIONS
+            if start_s is not None and end_s is not None:
+                raise msu.MediaServerUtilityException(f"Silence start and stop received simultaneously.")
+            if start_s is not None:
+                if self.current_silence_start is not None:
+                    raise msu.MediaServerUtilityException(f"Two consecutive silence starts encountered. End expected.")
+                # SILENCE START DATA RECEIVED
+                self.current_silence_start = start_s
+            elif end_s is not None:
+                if self.current_silence_start is None:
+                    raise msu.MediaServerUtilityException(f"Silence end without a start.")
+                silence_info: msu.MovieSection = msu.MovieSection(self.current_silence_start,
+                                                                  end_s,
+                                                                  f"{self.current_silence_start}-{end_s}"
+                                                                  )
+                self.found_silences.add_section(silence_info)
+                log.debug(f"Silence found from {self.current_silence_start:.1f} to {end_s:.1f} secs")
+                self.current_silence_start = None
+            return True
+
+        return False
+
+    def close_open_sections(self, end: float) -> None:
+        """ Input stopped at END (-to) during a freeze or silence.  End it there. """
+        if self.current_freeze_start is not None:
+            self.found_video_freezes.add_section(msu.MovieSection(self.current_freeze_start,
+                                                                  end,
+                                                                  f"{self.current_freeze_start}-{end}"
+                                                                  ))
+            self.current_freeze_start = None
+        if self.current_silence_start is not None:
+            self.found_silences.add_section(msu.MovieSection(self.current_silence_start,
+                                                             end,
+                                                             f"{self.current_silence_start}-{end}"
+                                                             ))
+            self.current_silence_start = None
+
+    def freezes_and_silences(self) -> msu.MovieSections:
+        """ Times when the picture is frozen AND the sound is silent. """
+        return self.found_video_freezes & self.found_silences
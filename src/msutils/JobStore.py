@@ -0,0 +1,260 @@
+import json
+import logging as log
+import os
+import sqlite3
+import time
+import typing as typ
+
+import msutils as msu
+
+JOB_STORE_FILE: str = os.path.expanduser("~/.cache/media-server-utils/jobs.sqlite3")
+
+# PIPELINE STAGES OF ONE FILE, IN ORDER.
+STAGE_PROBED: str = "probed"
+STAGE_STAGED: str = "staged"
+STAGE_TRANSCODED: str = "transcoded"
+STAGE_GAPS_DETECTED: str = "gaps_detected"
+STAGE_GAPS_REMOVED: str = "gaps_removed"
+STAGE_REPLACED: str = "replaced"
+STAGES: [str] = [STAGE_PROBED, STAGE_STAGED, STAGE_TRANSCODED, STAGE_GAPS_DETECTED, STAGE_GAPS_REMOVED, STAGE_REPLACED]
+
+STATE_RUNNING: str = "running"
+STATE_FAILED: str = "failed"
+STATE_DONE: str = "done"
+STATE_ABANDONED: str = "abandoned"
+# AN UNFINISHED JOB NOT UPDATED FOR THIS LONG CRASHED AND WAS NEVER RESUMED.
+STALE_JOB_SECONDS: float = 2 * 24 * 3600.0
+
+# ONE STORE PER PROCESS.  CONNECTIONS CANNOT BE SHARED ACROSS fork().
+_default_store = None
+_default_store_pid: int = 0
+
+
+def artifact_output(file_name: str | None, **outputs) -> dict:
+    """ Output of a stage that wrote FILE_NAME (plus OUTPUTS).  Its size and
+        mtime are kept so a later run can tell it is still the file written.
+    """
+    if file_name is None:
+        return {"file": None, **outputs}
+    st: os.stat_result = os.stat(file_name)
+    return {"file": file_name, "size": st.st_size, "mtime_ns": st.st_mtime_ns, **outputs}
+
+
+def artifact_unchanged(output: dict) -> bool:
+    """ still_valid for stages recorded with artifact_output. """
+    if output.get("file") is None:
+        return True
+    try:
+        st: os.stat_result = os.stat(output["file"])
+    except FileNotFoundError:
+        return False
+    return st.st_size == output.get("size") and st.st_mtime_ns == output.get("mtime_ns")
+
+
+class JobStore:
+    """ Persistent record of the pipeline stages completed for each file,
+        with their timings and outputs (intermediate files, detected gaps),
+        so an interrupted run can pick up at the first unfinished stage.
+    """
+    def __init__(self, db_file: str = JOB_STORE_FILE):
+        self.db_file: str = db_file
+        db_dir: str = os.path.dirname(db_file)
+        if db_dir != "":
+            os.makedirs(db_dir, exist_ok=True)
+
+        self.connection = sqlite3.connect(db_file, timeout=30.0)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # A FINISHED STAGE MUST SURVIVE A POWER FAILURE.  THERE ARE ONLY A FEW WRITES PER FILE.
+        self.connection.execute("PRAGMA synchronous=FULL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                                    "  id INTEGER PRIMARY KEY, path TEXT, source_key TEXT, state TEXT,"
+                                    "  created REAL, updated REAL, attempts INTEGER, error TEXT)"
+                                    )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_path ON jobs (path)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS stages ("
+                                    "  job_id INTEGER, stage TEXT, started REAL, finished REAL, output TEXT,"
+                                    "  PRIMARY KEY (job_id, stage))"
+                                    )
+
+    def begin(self, file_name: str):
+        """ The unfinished job for FILE_NAME if the file has not changed since
+            it started, otherwise a new one.
+        """
+        path: str = os.path.abspath(file_name)
+        source_key: str = json.dumps(msu.ProbeCache.key_for(file_name))
+        now: float = time.time()
+        with self.connection:
+            row = self.connection.execute("SELECT id, source_key, attempts FROM jobs "
+                                          "WHERE path=? AND state IN (?, ?) ORDER BY id DESC LIMIT 1",
+                                          (path, STATE_RUNNING, STATE_FAILED)
+                                          ).fetchone()
+            if row is not None and row[1] == source_key:
+                self.connection.execute("UPDATE jobs SET state=?, updated=?, attempts=? WHERE id=?",
+                                        (STATE_RUNNING, now, row[2] + 1, row[0])
+                                        )
+                job: FileJob = FileJob(self, row[0], file_name)
+                log.info(f"Resuming {file_name} after stages: {', '.join(job.finished_stages()) or 'none'}.")
+                return job
+
+            if row is not None:
+                log.info(f"{file_name} changed since its last unfinished run. Starting over.")
+                self.connection.execute("UPDATE jobs SET state=?, updated=? WHERE path=? AND state IN (?, ?)",
+                                        (STATE_ABANDONED, now, path, STATE_RUNNING, STATE_FAILED)
+                                        )
+                self.remove_abandoned(path)
+            job_id: int = self.connection.execute("INSERT INTO jobs (path, source_key, state, created, updated, "
+                                                  "attempts) VALUES (?, ?, ?, ?, ?, 1)",
+                                                  (path, source_key, STATE_RUNNING, now, now)
+                                                  ).lastrowid
+        return FileJob(self, job_id, file_name)
+
+    def remove_abandoned(self, path: str = None) -> int:
+        """ Delete the intermediate files of abandoned jobs (of PATH) and
+            forget their stages, since they are never resumed.  Returns the
+            number of jobs cleaned up.
+        """
+        rows: list = self.connection.execute("SELECT id, path FROM jobs WHERE state=? AND (? IS NULL OR path=?) "
+                                             "AND id IN (SELECT job_id FROM stages)",
+                                             (STATE_ABANDONED, path, path)
+                                             ).fetchall()
+        for job_id, job_path in rows:
+            FileJob(self, job_id, job_path).remove_artifacts()
+            with self.connection:
+                self.connection.execute("DELETE FROM stages WHERE job_id=?", (job_id,))
+        return len(rows)
+
+    def sweep(self, stale_seconds: float = STALE_JOB_SECONDS) -> None:
+        """ Abandon unfinished jobs not updated for STALE_SECONDS and remove
+            the intermediate files of every abandoned job.  Run at start up.
+        """
+        now: float = time.time()
+        with self.connection:
+            stale: int = self.connection.execute("UPDATE jobs SET state=?, updated=? "
+                                                 "WHERE state IN (?, ?) AND updated < ?",
+                                                 (STATE_ABANDONED, now, STATE_RUNNING, STATE_FAILED,
+                                                  now - stale_seconds
+                                                  )
+                                                 ).rowcount
+        removed: int = self.remove_abandoned()
+        if stale > 0 or removed > 0:
+            log.info(f"Abandoned {stale} stale jobs. Removed the intermediate files of {removed} jobs.")
+
+    def stage_output(self, job_id: int, stage: str) -> dict | None:
+        row = self.connection.execute("SELECT output FROM stages WHERE job_id=? AND stage=? AND finished IS NOT NULL",
+                                      (job_id, stage)
+                                      ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def start_stage(self, job_id: int, stage: str) -> None:
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO stages VALUES (?, ?, ?, NULL, NULL)",
+                                    (job_id, stage, time.time())
+                                    )
+
+    def finish_stage(self, job_id: int, stage: str, output: dict) -> None:
+        now: float = time.time()
+        with self.connection:
+            self.connection.execute("UPDATE stages SET finished=?, output=? WHERE job_id=? AND stage=?",
+                                    (now, json.dumps(output), job_id, stage)
+                                    )
+            self.connection.execute("UPDATE jobs SET updated=? WHERE id=?", (now, job_id))
+
+    def set_state(self, job_id: int, state: str, error: str = None) -> None:
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET state=?, updated=?, error=? WHERE id=?",
+                                    (state, time.time(), error, job_id)
+                                    )
+
+    def stage_times(self, job_id: int) -> [(str, float)]:
+        """ (stage, seconds) of every finished stage of a job, in the order run. """
+        return self.connection.execute("SELECT stage, finished - started FROM stages "
+                                       "WHERE job_id=? AND finished IS NOT NULL ORDER BY started", (job_id,)
+                                       ).fetchall()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class FileJob:
+    """ The stages of one file in a JobStore. """
+    def __init__(self, store: JobStore, job_id: int, file_name: str):
+        self.store: JobStore = store
+        self.job_id: int = job_id
+        self.file_name: str = file_name
+
+    def finished_stages(self) -> [str]:
+        return [stage for stage, _ in self.store.stage_times(self.job_id)]
+
+    def output(self, stage: str) -> dict | None:
+        """ What STAGE produced, or None if it has not finished. """
+        return self.store.stage_output(self.job_id, stage)
+
+    def run_stage(self,
+                  stage: str,
+                  func: typ.Callable[[], dict],
+                  still_valid: typ.Callable[[dict], bool] = None
+                  ) -> dict:
+        """ Return the recorded output of STAGE if it finished before (and
+            STILL_VALID agrees, e.g. its files still exist).  Otherwise run FUNC
+            and record what it returns.
+        """
+        output: dict | None = self.output(stage)
+        if output is not None:
+            if still_valid is None or still_valid(output):
+                log.info(f"Reusing {stage} results for {self.file_name}.")
+                return output
+            log.info(f"Recorded {stage} results for {self.file_name} are gone. Redoing {stage}.")
+
+        self.store.start_stage(self.job_id, stage)
+        with msu.Span(self.file_name, stage):
+            output = func()
+        self.store.finish_stage(self.job_id, stage, output)
+        return output
+
+    def artifact_path(self, name: str, extension: str) -> str:
+        """ Scratch file NAME of this job.  The job id keeps it apart from
+            those of other jobs in the same directory (e.g. the cwd).
+        """
+        return os.path.abspath(msu.work_path(f"{name}-job{self.job_id}{extension}"))
+
+    def failed(self, error: str) -> None:
+        self.store.set_state(self.job_id, STATE_FAILED, error)
+
+    def complete(self) -> None:
+        self.store.set_state(self.job_id, STATE_DONE)
+        times: str = ", ".join(f"{stage} {secs:,.1f}s" for stage, secs in self.store.stage_times(self.job_id))
+        log.info(f"Finished {self.file_name}: {times}")
+
+    def artifacts(self) -> [str]:
+        """ Intermediate files recorded by this job's stages. """
+        files: [str] = []
+        for stage in STAGES:
+            output: dict | None = self.output(stage)
+            if output is not None and output.get("file") is not None:
+                files.append(output["file"])
+        return files
+
+    def remove_artifacts(self) -> None:
+        for artifact in self.artifacts():
+            try:
+                os.unlink(artifact)
+            except FileNotFoundError:
+                pass
+
+
+def default_job_store() -> JobStore:
+    """ The job store for this process.  If it cannot be opened, an in-memory
+        store is used, so nothing survives a restart but everything still works.
+    """
+    global _default_store, _default_store_pid
+
+    if _default_store_pid != os.getpid():
+        _default_store_pid = os.getpid()
+        try:
+            _default_store = JobStore()
+        except (OSError, sqlite3.Error) as e:
+            log.warning(f"Job store {JOB_STORE_FILE} is unavailable. Interrupted files will start over. {e}")
+            _default_store = JobStore(":memory:")
+
+    return _default_store
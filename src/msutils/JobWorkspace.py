@@ -0,0 +1,33 @@
+import logging as log
+import os
+import shutil as sh
+import tempfile
+
+
+class JobWorkspace:
+    """ Private scratch directory (and optional partition of cpu cores) used
+        by a single job so that concurrent jobs never share working files.
+    """
+    def __init__(self, scratch_root: str = None, cpu_cores: [int] = None, prefix: str = "job-"):
+        if scratch_root is not None:
+            os.makedirs(scratch_root, exist_ok=True)
+        self.cpu_cores: [int] = list(cpu_cores) if cpu_cores else []
+        self.dir_name: str = tempfile.mkdtemp(prefix=prefix, dir=scratch_root)
+        log.debug(f"Created workspace {self.dir_name} (cores: {self.cpu_cores or 'all'}).")
+
+    def path(self, file_name: str) -> str:
+        return os.path.join(self.dir_name, file_name)
+
+    def thread_count(self) -> int:
+        """ Number of threads ffmpeg/x265 should use.  0 lets them decide. """
+        return len(self.cpu_cores)
+
+    def cleanup(self) -> None:
+        sh.rmtree(self.dir_name, ignore_errors=True)
+        log.debug(f"Removed workspace {self.dir_name}.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cleanup()
@@ -0,0 +1,97 @@
+import array
+import bisect
+import logging as log
+import subprocess as proc
+
+import msutils as msu
+
+FFPROBE_FILE = "ffprobe"
+# INSTRUMENTATION SPAN OF A SCAN.
+KEY_FRAME_STAGE: str = "key_frames"
+
+# INDEXES BUILT DURING THIS RUN.  file name -> KeyFrameIndex
+_indexes: dict = {}
+
+
+class KeyFrameIndex:
+    """ Sorted timestamps (seconds from the start of the movie) of every key
+        frame in the first video stream of a file.  Key frames that open a
+        GOP (e.g. an HEVC CRA) are followed by leading pictures that refer to
+        the frames before them.  The rest are clean: nothing after them needs
+        anything before them, so a stream can be cut there.
+    """
+    def __init__(self, file_name: str, key_frames: [float], file_key: tuple = None, open_key_frames: [float] = ()):
+        self.file_name: str = file_name
+        self.file_key: tuple = file_key
+        self.key_frames: array.array = array.array("d", sorted(key_frames))
+        opening: set = set(open_key_frames)
+        self.clean_key_frames: array.array = array.array("d", [k for k in self.key_frames if k not in opening])
+
+    @classmethod
+    def build(cls, file_name: str):
+        """ Read the packet flags of the video stream (no decoding) and keep
+            the timestamps of the key frames.  Packets come in decoding order,
+            so one shown before the key frame it follows is a leading picture.
+        """
+        file_key: tuple = msu.ProbeCache.key_for(file_name)
+        start_time: float = msu.MediaProbe.probe(file_name).start_time
+        ffprobe_args: [str] = [FFPROBE_FILE,
+                               "-v", "error",
+                               "-select_streams", "v:0",
+                               "-show_entries", "packet=pts_time,flags",
+                               "-of", "csv=p=0",
+                               file_name,
+                               ]
+
+        key_frames: [float] = []
+        open_key_frames: [float] = []
+        last_key: float | None = None
+        with msu.Span(file_name, KEY_FRAME_STAGE), \
+                proc.Popen(ffprobe_args, text=True, stdout=proc.PIPE, stderr=proc.DEVNULL) as process:
+            for line in process.stdout:
+                pts_time, _, flags = line.strip().partition(",")
+                if pts_time in ("", "N/A"):
+                    continue
+                pts: float = float(pts_time) - start_time
+                if "K" in flags:
+                    key_frames.append(pts)
+                    last_key = pts
+                elif last_key is not None and pts < last_key:
+                    open_key_frames.append(last_key)
+                    last_key = None
+
+        if process.returncode != 0:
+            raise msu.MediaServerUtilityException(f"An error occurred while indexing key frames of {file_name}. " +
+                                                  f"Return code: {process.returncode}"
+                                                  )
+
+        log.debug(f"Indexed {len(key_frames)} key frames ({len(open_key_frames)} open GOP) in {file_name}.")
+        return cls(file_name, key_frames, file_key, open_key_frames)
+
+    @classmethod
+    def for_file(cls, file_name: str):
+        """ The index for FILE_NAME, built once and reused until the file changes. """
+        index: KeyFrameIndex | None = _indexes.get(file_name)
+        if index is None or index.file_key != msu.ProbeCache.key_for(file_name):
+            index = cls.build(file_name)
+            _indexes[file_name] = index
+        return index
+
+    def next_after(self, timestamp: float, clean: bool = False) -> float | None:
+        """ First key frame (CLEAN one) at or after TIMESTAMP. """
+        key_frames: array.array = self.clean_key_frames if clean else self.key_frames
+        idx: int = bisect.bisect_left(key_frames, timestamp)
+        if idx >= len(key_frames):
+            return None
+        return key_frames[idx]
+
+    def previous_before(self, timestamp: float, clean: bool = False) -> float | None:
+        """ Last key frame (CLEAN one) at or before TIMESTAMP. """
+        key_frames: array.array = self.clean_key_frames if clean else self.key_frames
+        idx: int = bisect.bisect_right(key_frames, timestamp)
+        if idx == 0:
+            return None
+        return key_frames[idx - 1]
+
+    def __len__(self) -> int:
+        return len(self.key_frames)
@@ -0,0 +1,241 @@
+import logging as log
+import os
+import queue
+import sqlite3
+import threading
+import time
+import typing as typ
+
+SCAN_SNAPSHOT_FILE: str = os.path.expanduser("~/.cache/media-server-utils/library-scan.sqlite3")
+MEDIA_EXTENSIONS: (str, ...) = (".mp4", ".mkv")
+# FILES FOUND BUT NOT YET TAKEN BY THE WORKERS.  THE SCAN WAITS WHEN THIS MANY ARE WAITING.
+SCAN_QUEUE_SIZE: int = 64
+
+_END_OF_SCAN = None
+
+
+class LibraryScanner:
+    """ Finds the media files under ROOT that still need processing, using
+        a snapshot of the previous scan.
+
+        A directory whose mtime has not changed has the same entries as
+        last time, so it is not listed again.  Its sub-directories come from
+        the snapshot and only its files still waiting to be processed are
+        yielded.  Any other directory is listed with os.scandir and a file
+        is yielded if it is new, has changed, or has not been marked done.
+        A file rewritten in place (not replaced by a rename) does not change
+        its directory, so it is only noticed once the directory changes or
+        with RESCAN.
+
+        Files are yielded from a bounded queue filled by a background
+        thread, so work can start while the scan is still running.  Call
+        mark_done() once a file has been processed.  NAME separates the
+        snapshots of programs that do different work on the same files.
+        RESCAN forgets the snapshot and looks at every file again.
+    """
+    def __init__(self,
+                 root: str,
+                 name: str,
+                 db_file: str = SCAN_SNAPSHOT_FILE,
+                 extensions: (str, ...) = MEDIA_EXTENSIONS,
+                 queue_size: int = SCAN_QUEUE_SIZE,
+                 rescan: bool = False
+                 ):
+        self.root: str = os.path.abspath(root)
+        self.name: str = name
+        self.db_file: str = db_file
+        self.extensions: (str, ...) = extensions
+        self.found: queue.Queue = queue.Queue(maxsize=queue_size)
+        self.stopping: bool = False
+        self.error: BaseException | None = None
+        self.dirs_listed: int = 0
+        self.dirs_skipped: int = 0
+
+        db_dir: str = os.path.dirname(db_file)
+        if db_dir != "":
+            os.makedirs(db_dir, exist_ok=True)
+        # EACH THREAD GETS ITS OWN CONNECTION.  THIS ONE IS FOR THE CONSUMER (mark_done).
+        self.connection: sqlite3.Connection = self._connect()
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS dirs ("
+                                    "  name TEXT, path TEXT, parent TEXT, mtime_ns INTEGER, scanned REAL,"
+                                    "  PRIMARY KEY (name, path))"
+                                    )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (name, parent)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS files ("
+                                    "  name TEXT, path TEXT, dir TEXT, size INTEGER, mtime_ns INTEGER, ino INTEGER,"
+                                    "  done INTEGER, PRIMARY KEY (name, path))"
+                                    )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS files_dir ON files (name, dir)")
+            if rescan:
+                self.connection.execute("DELETE FROM dirs WHERE name=?", (name,))
+                self.connection.execute("DELETE FROM files WHERE name=?", (name,))
+
+        self.thread: threading.Thread = threading.Thread(target=self._scan_all, name="library-scanner", daemon=True)
+        self.thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection = sqlite3.connect(self.db_file, timeout=30.0)
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def _is_media(self, file_name: str) -> bool:
+        return file_name.endswith(self.extensions)
+
+    def _put(self, file_name: str) -> bool:
+        """ Hand FILE_NAME to the consumer.  False if the scan should stop. """
+        while not self.stopping:
+            try:
+                self.found.put(file_name, timeout=1.0)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _list_dir(self, db: sqlite3.Connection, dir_name: str, mtime_ns: int, parent: str) -> typ.Optional[list]:
+        """ Compare a changed (or new) directory with the snapshot.  Returns
+            its sub-directories, or None if the scan should stop.
+        """
+        known: dict = {row[0]: row[1:] for row in db.execute("SELECT path, size, mtime_ns, ino, done FROM files "
+                                                             "WHERE name=? AND dir=?", (self.name, dir_name)
+                                                             )}
+        sub_dirs: [str] = []
+        media: [os.DirEntry] = []
+        with os.scandir(dir_name) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    sub_dirs.append(entry.path)
+                elif entry.is_file() and self._is_media(entry.name):
+                    media.append(entry)
+
+        to_process: [str] = []
+        with db:
+            for entry in sorted(media, key=lambda e: e.name):
+                st: os.stat_result = entry.stat()
+                current: tuple = (st.st_size, st.st_mtime_ns, st.st_ino)
+                previous: tuple | None = known.pop(entry.path, None)
+                if previous is not None and previous[:3] == current and previous[3]:
+                    continue
+                db.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, 0)",
+                           (self.name, entry.path, dir_name, *current)
+                           )
+                to_process.append(entry.path)
+
+            # WHATEVER IS LEFT WAS DELETED OR RENAMED.
+            db.executemany("DELETE FROM files WHERE name=? AND path=?", ((self.name, p) for p in known))
+            known_dirs: set = {row[0] for row in db.execute("SELECT path FROM dirs WHERE name=? AND parent=?",
+                                                            (self.name, dir_name)
+                                                            )}
+            for gone in known_dirs - set(sub_dirs):
+                self._forget_tree(db, gone)
+            # NEW SUB-DIRECTORIES ARE RECORDED NOW (WITHOUT AN mtime) SO AN INTERRUPTED SCAN CANNOT LOSE THEM.
+            db.executemany("INSERT OR IGNORE INTO dirs VALUES (?, ?, ?, NULL, NULL)",
+                           ((self.name, d, dir_name) for d in sub_dirs)
+                           )
+            db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?)",
+                       (self.name, dir_name, parent, mtime_ns, time.time())
+                       )
+
+        for file_name in to_process:
+            if not self._put(file_name):
+                return None
+        return sorted(sub_dirs)
+
+    def _forget_tree(self, db: sqlite3.Connection, dir_name: str) -> None:
+        for (sub_dir,) in db.execute("SELECT path FROM dirs WHERE name=? AND parent=?",
+                                     (self.name, dir_name)
+                                     ).fetchall():
+            self._forget_tree(db, sub_dir)
+        db.execute("DELETE FROM files WHERE name=? AND dir=?", (self.name, dir_name))
+        db.execute("DELETE FROM dirs WHERE name=? AND path=?", (self.name, dir_name))
+
+    def _skip_dir(self, db: sqlite3.Connection, dir_name: str) -> typ.Optional[list]:
+        """ An unchanged directory: yield its unfinished files from the
+            snapshot and return its sub-directories from the snapshot.
+        """
+        self.dirs_skipped += 1
+        pending: [str] = [row[0] for row in db.execute("SELECT path FROM files WHERE name=? AND dir=? AND done=0 "
+                                                       "ORDER BY path", (self.name, dir_name)
+                                                       )]
+        for file_name in pending:
+            if not self._put(file_name):
+                return None
+        return [row[0] for row in db.execute("SELECT path FROM dirs WHERE name=? AND parent=? ORDER BY path",
+                                             (self.name, dir_name)
+                                             )]
+
+    def _scan(self, db: sqlite3.Connection, dir_name: str, parent: str) -> bool:
+        try:
+            mtime_ns: int = os.stat(dir_name).st_mtime_ns
+        except FileNotFoundError:
+            return True
+
+        row = db.execute("SELECT mtime_ns FROM dirs WHERE name=? AND path=?", (self.name, dir_name)).fetchone()
+        if row is not None and row[0] == mtime_ns:
+            sub_dirs: [str] | None = self._skip_dir(db, dir_name)
+        else:
+            self.dirs_listed += 1
+            try:
+                sub_dirs: [str] | None = self._list_dir(db, dir_name, mtime_ns, parent)
+            except PermissionError as e:
+                # LIKE os.walk, CARRY ON WITH THE REST OF THE TREE.
+                log.warning(f"Cannot scan {dir_name}. {e}")
+                return True
+
+        if sub_dirs is None:
+            return False
+        for sub_dir in sub_dirs:
+            if not self._scan(db, sub_dir, dir_name):
+                return False
+        return True
+
+    def _scan_all(self) -> None:
+        start: float = time.monotonic()
+        db: sqlite3.Connection = self._connect()
+        try:
+            self._scan(db, self.root, "")
+            log.info(f"Scanned {self.root} in {time.monotonic() - start:,.1f} seconds. "
+                     f"{self.dirs_listed} directories listed, {self.dirs_skipped} unchanged."
+                     )
+        except BaseException as e:
+            self.error = e
+        finally:
+            db.close()
+            self._put(_END_OF_SCAN)
+
+    def __iter__(self) -> typ.Iterator[str]:
+        while True:
+            file_name: str | None = self.found.get()
+            if file_name is _END_OF_SCAN:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield file_name
+
+    def mark_done(self, file_name: str) -> None:
+        """ FILE_NAME, as it is now, needs no more processing. """
+        path: str = os.path.abspath(file_name)
+        try:
+            st: os.stat_result = os.stat(path)
+        except FileNotFoundError:
+            return
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, 1)",
+                                    (self.name, path, os.path.dirname(path), st.st_size, st.st_mtime_ns, st.st_ino)
+                                    )
+
+    def close(self) -> None:
+        self.stopping = True
+        # UNBLOCK THE SCAN IF IT IS WAITING FOR ROOM IN THE QUEUE.
+        while self.thread.is_alive():
+            try:
+                self.found.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,118 @@
+import collections as coll
+import json
+import logging as log
+import sqlite3
+import subprocess as proc
+
+import msutils as msu
+
+FFPROBE_FILE = "ffprobe"
+
+MediaStream = coll.namedtuple("MediaStream", "index codec_type codec_name bit_rate width height")
+
+
+def _to_float(value, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _to_int(value, default: int = 0) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class MediaProbe:
+    """ Everything we need to know about a media file, gathered from a
+        single ffprobe call.
+    """
+    def __init__(self, file_name: str, ffprobe_data: dict):
+        self.file_name: str = file_name
+        self.ffprobe_data: dict = ffprobe_data
+
+        file_format: dict = ffprobe_data.get("format", {})
+        self.format_name: str = file_format.get("format_name", "")
+        self.duration: float = _to_float(file_format.get("duration"))
+        self.start_time: float = _to_float(file_format.get("start_time"))
+        self.bit_rate: int = _to_int(file_format.get("bit_rate"))
+
+        self.streams: [MediaStream] = [
+            MediaStream(_to_int(s.get("index")),
+                        s.get("codec_type", ""),
+                        s.get("codec_name", ""),
+                        _to_int(s.get("bit_rate")),
+                        _to_int(s.get("width")),
+                        _to_int(s.get("height")),
+                        )
+            for s in ffprobe_data.get("streams", [])
+        ]
+
+        self.chapters: [msu.MovieChapter] = [
+            msu.MovieChapter.from_ffprobe(ch) for ch in ffprobe_data.get("chapters", [])
+        ]
+
+    @staticmethod
+    def run_ffprobe(file_name: str) -> dict:
+        result: proc.CompletedProcess = proc.run(
+            [
+                FFPROBE_FILE,
+                "-v", "error",
+                "-show_streams",
+                "-show_format",
+                "-show_chapters",
+                "-of", "json",
+                file_name,
+            ],
+            capture_output=True,
+        )
+
+        if result.returncode != 0:
+            raise msu.MediaServerUtilityException(f"An error occurred while probing {file_name}. " +
+                                                  f"Return code: {result.returncode}"
+                                                  )
+        try:
+            return json.loads(str(result.stdout, "UTF-8", errors="replace"))
+        except json.JSONDecodeError as jde:
+            log.exception(jde)
+            raise msu.MediaServerUtilityException(f"Cannot read ffprobe output for {file_name}.")
+
+    @classmethod
+    def probe(cls, file_name: str, use_cache: bool = True):
+        cache: msu.ProbeCache | None = msu.default_probe_cache() if use_cache else None
+        ffprobe_data: dict | None = None
+        if cache is not None:
+            try:
+                ffprobe_data = cache.get(file_name)
+            except sqlite3.Error as e:
+                log.warning(f"Probe cache lookup failed for {file_name}. {e}")
+
+        if ffprobe_data is None:
+            ffprobe_data = MediaProbe.run_ffprobe(file_name)
+            if cache is not None:
+                try:
+                    cache.put(file_name, ffprobe_data)
+                except sqlite3.Error as e:
+                    log.warning(f"Cannot save probe of {file_name} to cache. {e}")
+
+        probe = cls(file_name, ffprobe_data)
+        log.debug(f"Probed {file_name}: {probe.duration:.1f} seconds, codecs: {probe.codecs()}")
+        return probe
+
+    def codecs(self) -> [str]:
+        return [s.codec_name for s in self.streams]
+
+    def streams_of_type(self, codec_type: str) -> [MediaStream]:
+        return [s for s in self.streams if s.codec_type == codec_type]
+
+    def video_stream(self) -> MediaStream | None:
+        video: [MediaStream] = self.streams_of_type("video")
+        return video[0] if len(video) > 0 else None
+
+    def has_audio(self) -> bool:
+        return len(self.streams_of_type("audio")) > 0
+
+    def has_subtitles(self) -> bool:
+        return len(self.streams_of_type("subtitle")) > 0
@@ -2,27 +2,15 @@ import msutils as msu
 
 
 class MovieChapter:
-    def __init__(self, ffmpeg_text: [str]):
-        self.title: str = MovieChapter.find_chapter_title(ffmpeg_text)
-        self.section: msu.MovieSection = self.make_into_movie_section(ffmpeg_text[0])
-
-    def make_into_movie_section(self, time_line: str) -> msu.MovieSection:
-        start_idx = time_line.find(" start ")
-        end_idx = time_line.find(" end ")
-
-        if start_idx < 0 or end_idx < 0:
-            raise RuntimeError(f"Cannot find start/end times in: {time_line}")
-
-        start_time = float(time_line[start_idx+7:].split(",")[0])
-        end_time = float(time_line[end_idx+5:])
-
-        return msu.MovieSection(start_time, end_time, self.title)
-
-    @staticmethod
-    def find_chapter_title(chapter_text: [str]) -> str:
-        if len(chapter_text) != 3:
-            raise msu.MediaServerUtilityException(f"{chapter_text} is an invalid chapter from ffmpeg.")
-
-        title_line = chapter_text[2].strip()
-        title = title_line.split(":")
-        return title[1].strip()
+    def __init__(self, title: str, start: float, end: float):
+        self.title: str = title
+        self.section: msu.MovieSection = msu.MovieSection(start, end, self.title)
+
+    @classmethod
+    def from_ffprobe(cls, chapter: dict):
+        """ Build a chapter from one entry of ffprobe's -show_chapters json. """
+        if "start_time" not in chapter or "end_time" not in chapter:
+            raise msu.MediaServerUtilityException(f"{chapter} is an invalid chapter from ffprobe.")
+
+        title: str = chapter.get("tags", {}).get("title", "").strip()
+        return cls(title, float(chapter["start_time"]), float(chapter["end_time"]))
@@ -1,6 +1,15 @@
+import bisect
 import collections as coll
+import heapq
+import os
+
 import msutils as msu
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 MovieSection = coll.namedtuple("MovieSection", "start end comment")
 
 FREEZE_FUDGE_FACTOR: float = 0.75
@@ -27,7 +36,7 @@ def combine(sect_one: MovieSection, sect_two: MovieSection) -> MovieSection:
     high_start = max(sect_one.start, sect_two.start)
     low_end = min(sect_one.end, sect_two.end)
     if high_start > low_end:
-        raise MediaServerUtilityException(f"Cannot combine {sect_one} and {sect_two}.  No overlapping time.")
+        raise msu.MediaServerUtilityException(f"Cannot combine {sect_one} and {sect_two}.  No overlapping time.")
 
     new_start = min(sect_one.start, sect_two.start)
     new_end = max(sect_one.end, sect_two.end)
@@ -35,109 +44,149 @@ def combine(sect_one: MovieSection, sect_two: MovieSection) -> MovieSection:
     return MovieSection(new_start, new_end, new_comment)
 
 
+def coalesce(sections) -> [MovieSection]:
+    """ Merge overlapping (or touching) SECTIONS, which must be sorted by start. """
+    return_val: [MovieSection] = []
+    for sect in sections:
+        if len(return_val) > 0 and is_overlap(return_val[-1], sect):
+            return_val[-1] = combine(return_val[-1], sect)
+        else:
+            return_val.append(sect)
+
+    return return_val
+
+
+def _section_start(sect: MovieSection) -> float:
+    return sect.start
+
+
+def _section_end(sect: MovieSection) -> float:
+    return sect.end
+
+
 class MovieSections:
+    """ Set of time ranges within a movie.  section_list is always sorted and
+        never contains two sections that overlap or touch.
+    """
     def __init__(self, movie_file_name: str, list_name: str = ""):
         self.section_list: list = []
         self.file_name = movie_file_name
         self.list_name = list_name
 
+    @classmethod
+    def from_sorted(cls, movie_file_name: str, sections, list_name: str = ""):
+        """ Build from sections already sorted by start time. """
+        return_val = cls(movie_file_name, list_name)
+        return_val.section_list = coalesce(sections)
+        return return_val
+
+    @classmethod
+    def from_arrays(cls, movie_file_name: str, starts, ends, list_name: str = "", comments=None):
+        """ Bulk constructor from parallel sequences (or NumPy arrays) of start
+            and end times.  Much faster than add_section for thousands of events.
+        """
+        if np is not None:
+            start_arr = np.asarray(starts, dtype=float)
+            end_arr = np.asarray(ends, dtype=float)
+            if start_arr.shape != end_arr.shape:
+                raise msu.MediaServerUtilityException("Start and end arrays must be the same length.")
+            if np.any(start_arr > end_arr):
+                raise msu.MediaServerUtilityException("A movie section ends before it starts.")
+            order = np.lexsort((end_arr, start_arr))
+            start_list: [float] = start_arr[order].tolist()
+            end_list: [float] = end_arr[order].tolist()
+            order = order.tolist()
+        else:
+            start_list: [float] = [float(x) for x in starts]
+            end_list: [float] = [float(x) for x in ends]
+            if len(start_list) != len(end_list):
+                raise msu.MediaServerUtilityException("Start and end arrays must be the same length.")
+            if any(st > en for st, en in zip(start_list, end_list)):
+                raise msu.MediaServerUtilityException("A movie section ends before it starts.")
+            order = sorted(range(len(start_list)), key=lambda i: (start_list[i], end_list[i]))
+            start_list = [start_list[i] for i in order]
+            end_list = [end_list[i] for i in order]
+
+        if comments is None:
+            sections = (MovieSection(st, en, f"{st}-{en}") for st, en in zip(start_list, end_list))
+        else:
+            comments = list(comments)
+            sections = (MovieSection(st, en, comments[i]) for st, en, i in zip(start_list, end_list, order))
+
+        return cls.from_sorted(movie_file_name, sections, list_name)
+
+    @classmethod
+    def from_list(cls, movie_file_name: str, sections: [list], list_name: str = ""):
+        """ Inverse of to_list. """
+        return cls.from_sorted(movie_file_name,
+                               sorted(MovieSection(float(st), float(en), comment) for st, en, comment in sections),
+                               list_name
+                               )
+
+    def to_list(self) -> [list]:
+        """ [[start, end, comment], ...] suitable for json. """
+        return [[sect.start, sect.end, sect.comment] for sect in self.section_list]
+
     def add_section(self, sect: MovieSection):
         new_sect: MovieSection = MovieSection(float(sect.start), float(sect.end), sect.comment)
         if new_sect.start > new_sect.end:
-            raise MediaServerUtilityException(f"({new_sect.start},{new_sect.end}) is an invalid movie section.  "
-                                              + "It Ends before it starts."
-                                              )
-        if len(self.section_list) == 0:
-            self.section_list.append(new_sect)
-        else:
-            self._insert(new_sect)
+            raise msu.MediaServerUtilityException(f"({new_sect.start},{new_sect.end}) is an invalid movie section.  "
+                                                  + "It Ends before it starts."
+                                                  )
 
-    def _consolidate_sections(self) -> None:
-        consolidated_list = []
+        # SECTIONS ARE DISJOINT AND SORTED, SO BOTH STARTS AND ENDS ARE IN ORDER.
+        # EVERY SECTION IN [first, last) OVERLAPS OR TOUCHES THE NEW ONE.
+        first: int = bisect.bisect_left(self.section_list, new_sect.start, key=_section_end)
+        last: int = bisect.bisect_right(self.section_list, new_sect.end, lo=first, key=_section_start)
 
-        self.section_list.sort()
-        prev_sect: MovieSection = self.section_list[0]
-        for idx in range(1, len(self.section_list)):
-            curr_sect: MovieSection = self.section_list[idx]
-            if is_overlap(prev_sect, curr_sect):
-                prev_sect = combine(prev_sect, curr_sect)
-            else:
-                consolidated_list.append(prev_sect)
-                prev_sect = curr_sect
-
-        consolidated_list.append(prev_sect)
-        consolidated_list.sort()
-        self._section_list = consolidated_list
-
-    def _insert(self, new_sect: MovieSection):
-        made_update: bool = False
-
-        # Look for overlap with any existing
-        list_size: int = len(self.section_list)
-        for idx in range(list_size):
-            sect = self.section_list[idx]
-            if is_overlap(new_sect, sect):
-                self.section_list[idx] = combine(new_sect, sect)
-                made_update = True
-
-        if made_update:
-            self._consolidate_sections()
-        else:
-            # SIMPLE ADD WITH NO OVERLAPS AT ALL
-            self.section_list.append(new_sect)
-            self.section_list.sort()
+        merged: MovieSection = new_sect
+        for sect in self.section_list[first:last]:
+            merged = combine(merged, sect)
+        self.section_list[first:last] = [merged]
 
-    def ms_union(self, ms2):
+    def _check_same_file(self, ms2, operation: str) -> None:
         if self.file_name != ms2.file_name:
-            raise MediaServerUtilityException(
-                f"To union two MovieSections objects, the file_names must be the same. "
+            raise msu.MediaServerUtilityException(
+                f"To {operation} two MovieSections objects, the file_names must be the same. "
                 f"{self.file_name} != {ms2.file_name}"
                 )
 
-        return_val = MovieSections(self.file_name)
-
-        for ms in self.section_list:
-            return_val.add_section(ms)
-
-        for ms in ms2.section_list:
-            return_val.add_section(ms)
-
-        return return_val
+    def ms_union(self, ms2):
+        self._check_same_file(ms2, "union")
+        return MovieSections.from_sorted(self.file_name, heapq.merge(self.section_list, ms2.section_list))
 
     def __or__(self, ms2):
         return self.ms_union(ms2)
 
-    def _single_intersect(self, list_name: str, section: MovieSection) -> [MovieSection]:
-        return_val: [MovieSection] = []
-        for my_section in self.section_list:
+    def ms_intersection(self, ms2, min_section_dur: float = 5.0):
+        self._check_same_file(ms2, "intersect")
+
+        # SWEEP BOTH SORTED LISTS, ALWAYS ADVANCING WHICHEVER SECTION ENDS FIRST.
+        found: [MovieSection] = []
+        mine: list = self.section_list
+        theirs: list = ms2.section_list
+        i: int = 0
+        j: int = 0
+        while i < len(mine) and j < len(theirs):
+            my_section: MovieSection = mine[i]
+            section: MovieSection = theirs[j]
             if is_overlap(section, my_section):
                 new_start: float = max(section.start, my_section.start)
                 new_end: float = min(section.end, my_section.end)
-                new_section: MovieSection = MovieSection(
+                if (new_end - new_start) > min_section_dur:
+                    found.append(MovieSection(
                         new_start,
                         new_end,
-                        f"{list_name}({section.start}-{section.end}) & " +
+                        f"{ms2.list_name}({section.start}-{section.end}) & " +
                         f"{self.list_name}({my_section.start}-{my_section.end})"
-                        )
-                return_val.append(new_section)
-
-        return return_val
-
-    def ms_intersection(self, ms2, min_section_dur: float = 5.0):
+                        ))
 
-        if self.file_name != ms2.file_name:
-            raise MediaServerUtilityException(f"To intersect two MovieSections objects, "
-                                              f"the file_names must be the same. {self.file_name}"
-                                              f" != {ms2.file_name}"
-                                              )
-        return_val = MovieSections(self.file_name)
-        for section in ms2.section_list:
-            matches: [MovieSection] = self._single_intersect(ms2.list_name, section)
-            for m in matches:
-                if (m.end - m.start) > min_section_dur:
-                    return_val.add_section(m)
+            if my_section.end < section.end:
+                i += 1
+            else:
+                j += 1
 
-        return return_val
+        return MovieSections.from_sorted(self.file_name, found)
 
     def __and__(self, ms2):
         return self.ms_intersection(ms2)
@@ -151,6 +200,20 @@ class MovieSections:
 
         return return_val
 
+    def kept_sections(self, duration: float, min_section_dur: float = 5.0) -> [MovieSection]:
+        """ The parts of a DURATION long movie left once the gaps (sections
+            longer than MIN_SECTION_DUR) are cut out.
+        """
+        kept: [MovieSection] = []
+        prev_end: float = 0.0
+        for gap in [g for g in self.section_list if (g.end - g.start) > min_section_dur]:
+            if gap.start > prev_end:
+                kept.append(MovieSection(prev_end, gap.start, f"{prev_end}-{gap.start}"))
+            prev_end = max(prev_end, gap.end)
+        if duration > prev_end:
+            kept.append(MovieSection(prev_end, duration, f"{prev_end}-{duration}"))
+        return kept
+
     def create_input_file_for_video_gaps(self, inputs_file_name: str, min_section_dur: float = 5.0):
         with open(inputs_file_name, "w") as fd:
             first_gap: MovieSection = self.section_list[0]
@@ -176,7 +239,8 @@ class MovieSections:
             self.inpoint(fd, prev_gap.end)
 
     def section_header(self, fd) -> None:
-        fd.write(f"file '{self.file_name}'\n")
+        # PATHS IN THE INPUTS FILE ARE RELATIVE TO THE INPUTS FILE, NOT THE CURRENT DIRECTORY.
+        fd.write(f"file '{os.path.abspath(self.file_name)}'\n")
 
     def inpoint(self, fd, time) -> None:
         # find next i-frame (key-frame)
@@ -0,0 +1,183 @@
+import errno
+import hashlib
+import logging as log
+import os
+import shutil as sh
+import threading
+
+import msutils as msu
+from msutils.file_transfer import UNSUPPORTED_ERRORS
+
+# KEPT AT THE TOP OF EACH MOUNT.  HARD LINKS CANNOT CROSS FILESYSTEMS.
+STORE_DIR_NAME: str = ".poster-store"
+POSTER_EXTENSIONS: (str, ...) = (".jpg", ".jpeg", ".png", ".webp")
+HASH_BLOCK_SIZE: int = 1024 * 1024
+
+# ONE STORE PER PROCESS, SO EACH IMAGE IS HASHED ONCE.
+_default_store = None
+
+
+def mount_point(path: str) -> str:
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def temp_suffix() -> str:
+    # POSTERS ARE PLACED FROM SEVERAL THREADS AT ONCE.
+    return f"{os.getpid()}-{threading.get_native_id()}.tmp"
+
+
+def file_digest(file_name: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as fd:
+        for block in iter(lambda: fd.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PosterStore:
+    """ Content-addressed poster images.  Every distinct image is kept once
+        per filesystem, as <mount>/.poster-store/<sha256>.<ext>, and each
+        <video>.<ext> poster is a hard link to it, so placing a poster
+        writes no data.  Where a hard link is not allowed, the poster is
+        reflinked (or, failing that, copied).
+    """
+    def __init__(self, store_dir_name: str = STORE_DIR_NAME):
+        self.store_dir_name: str = store_dir_name
+        # (dev, ino, size, mtime_ns) -> sha256.  AN IMAGE IS ONLY READ ONCE.
+        self.digests: dict = {}
+        # dev -> STORE DIRECTORY, OR None WHEN THE MOUNT HAS NO WRITABLE TOP DIRECTORY.
+        self.store_dirs: dict = {}
+        # (dev, sha256) -> FILE HOLDING THAT IMAGE, WHEN THERE IS NO STORE DIRECTORY.
+        self.canonical: dict = {}
+
+    def digest(self, file_name: str) -> str:
+        key: tuple = msu.ProbeCache.key_for(file_name)
+        if key not in self.digests:
+            self.digests[key] = file_digest(file_name)
+        return self.digests[key]
+
+    def store_dir(self, dir_name: str) -> str | None:
+        dev: int = os.stat(dir_name).st_dev
+        if dev not in self.store_dirs:
+            store_dir: str = os.path.join(mount_point(dir_name), self.store_dir_name)
+            try:
+                os.makedirs(store_dir, exist_ok=True)
+            except OSError as e:
+                log.warning(f"Cannot create poster store {store_dir}. Linking posters to each other instead. {e}")
+                store_dir = None
+            self.store_dirs[dev] = store_dir
+        return self.store_dirs[dev]
+
+    def stored_copy(self, image: str, dir_name: str) -> str:
+        """ A file on DIR_NAME's filesystem with the same contents as IMAGE,
+            added to the store if it is not there yet.
+        """
+        digest: str = self.digest(image)
+        ext: str = os.path.splitext(image)[1].lower()
+        store_dir: str | None = self.store_dir(dir_name)
+        same_fs: bool = os.stat(image).st_dev == os.stat(dir_name).st_dev
+
+        if store_dir is None:
+            key: tuple = (os.stat(dir_name).st_dev, digest)
+            if self.canonical.get(key) is None and same_fs:
+                self.canonical[key] = image
+            return self.canonical.get(key) or image
+
+        stored: str = os.path.join(store_dir, f"{digest}{ext}")
+        if not os.path.exists(stored):
+            partial: str = f"{stored}.{temp_suffix()}"
+            if same_fs:
+                _link_or_copy(image, partial)
+            else:
+                msu.copy_file_data(image, partial)
+                sh.copymode(image, partial)
+            # ANOTHER PROCESS MAY HAVE STORED IT MEANWHILE.  EITHER COPY IS FINE.
+            os.replace(partial, stored)
+        return stored
+
+    def place(self, image: str, target: str) -> None:
+        """ Make TARGET a poster with the contents of IMAGE. """
+        target_dir: str = os.path.dirname(os.path.abspath(target))
+        source: str = self.stored_copy(image, target_dir)
+        if os.path.exists(target) and os.path.samefile(source, target):
+            return
+
+        temp_name: str = os.path.join(target_dir, f".{os.path.basename(target)}.{temp_suffix()}")
+        try:
+            _link_or_copy(source, temp_name)
+            os.replace(temp_name, target)
+        except BaseException:
+            if os.path.lexists(temp_name):
+                os.unlink(temp_name)
+            raise
+
+        dev: int = os.stat(target_dir).st_dev
+        if self.store_dirs.get(dev) is None:
+            # NO STORE ON THIS MOUNT.  LATER POSTERS LINK TO THIS ONE.
+            self.canonical.setdefault((dev, self.digest(image)), target)
+
+    def place_all(self, image: str, targets: [str]) -> None:
+        """ Batch form of place() for a whole season. """
+        for target in targets:
+            log.debug(f"Linking {image} to {target}.")
+            self.place(image, target)
+
+    def repair(self, root: str) -> (int, int):
+        """ Replace duplicate poster files under ROOT with links to a single
+            stored copy.  Returns (posters relinked, bytes freed).
+        """
+        by_size: dict = {}
+        for dir_name, _, file_names in os.walk(root):
+            if os.path.basename(dir_name) == self.store_dir_name:
+                continue
+            for fn in file_names:
+                path: str = os.path.join(dir_name, fn)
+                if fn.lower().endswith(POSTER_EXTENSIONS) and not fn.startswith(".") and not os.path.islink(path):
+                    by_size.setdefault(os.lstat(path).st_size, []).append(path)
+
+        relinked: int = 0
+        freed: int = 0
+        for size, paths in by_size.items():
+            # ONLY IMAGES THAT SHARE A SIZE CAN BE DUPLICATES.  DON'T HASH THE REST.
+            if len(paths) < 2:
+                continue
+            seen_inodes: set = set()
+            for path in sorted(paths):
+                st: os.stat_result = os.lstat(path)
+                if (st.st_dev, st.st_ino) in seen_inodes:
+                    continue
+                source: str = self.stored_copy(path, os.path.dirname(path))
+                if os.path.samefile(source, path):
+                    seen_inodes.add((st.st_dev, st.st_ino))
+                    continue
+                self.place(path, path)
+                seen_inodes.add((st.st_dev, os.stat(path).st_ino))
+                if st.st_nlink == 1:
+                    freed += size
+                relinked += 1
+                log.info(f"Relinked poster {path}.")
+
+        return relinked, freed
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+        return
+    except OSError as e:
+        if e.errno not in UNSUPPORTED_ERRORS and e.errno != errno.EMLINK:
+            raise
+    # copy_file_data REFLINKS WHEN THE FILESYSTEM CAN.
+    msu.copy_file_data(src, dst)
+    sh.copymode(src, dst)
+
+
+def default_poster_store() -> PosterStore:
+    global _default_store
+
+    if _default_store is None:
+        _default_store = PosterStore()
+    return _default_store
@@ -0,0 +1,134 @@
+import collections as coll
+import logging as log
+import os
+import queue
+import threading
+import typing as typ
+
+import msutils as msu
+
+PREFETCH_DEPTH: int = 2
+MAX_SCRATCH_BYTES: int = 60 * 1024 * 1024 * 1024
+
+# staged_path IS None WHEN THE FILE WAS NOT (OR COULD NOT BE) STAGED.
+StagedFile = coll.namedtuple("StagedFile", "file_name staged_path file_key size")
+
+
+class Prefetcher:
+    """ Copies the next few files of FILE_NAMES to local scratch in a
+        background thread while the current one is being processed.
+
+        FILE_NAMES may be a generator (e.g. a LibraryScanner still scanning).
+        Iterating yields a StagedFile for every file, in order.  A staged copy
+        may be moved elsewhere by the consumer.  Whatever is left of it is
+        removed when the consumer asks for the next file.
+    """
+    def __init__(self,
+                 file_names: typ.Iterable[str],
+                 scratch_root: str = None,
+                 depth: int = PREFETCH_DEPTH,
+                 max_scratch_bytes: int = MAX_SCRATCH_BYTES,
+                 should_stage: typ.Callable[[str], bool] = None
+                 ):
+        self.workspace: msu.JobWorkspace = msu.JobWorkspace(scratch_root, prefix="prefetch-")
+        self.max_scratch_bytes: int = max_scratch_bytes
+        self.should_stage: typ.Callable[[str], bool] | None = should_stage
+
+        self.staged: queue.Queue = queue.Queue()
+        self.slots: threading.Semaphore = threading.Semaphore(max(1, depth))
+        self.space: threading.Condition = threading.Condition()
+        self.scratch_bytes: int = 0
+        self.stopping: bool = False
+        self.current: StagedFile | None = None
+
+        self.thread: threading.Thread = threading.Thread(target=self._stage_all,
+                                                         args=(file_names,),
+                                                         name="prefetcher",
+                                                         daemon=True
+                                                         )
+        self.thread.start()
+
+    def _reserve(self, size: int) -> bool:
+        with self.space:
+            # A FILE ALWAYS FITS IN AN OTHERWISE EMPTY SCRATCH AREA.
+            while not self.stopping and self.scratch_bytes > 0 and self.scratch_bytes + size > self.max_scratch_bytes:
+                self.space.wait()
+            if self.stopping:
+                return False
+            self.scratch_bytes += size
+            return True
+
+    def _release(self, staged: StagedFile) -> None:
+        if staged.staged_path is None:
+            return
+        if os.path.lexists(staged.staged_path):
+            os.unlink(staged.staged_path)
+        with self.space:
+            self.scratch_bytes -= staged.size
+            self.space.notify_all()
+
+    def _stage(self, idx: int, file_name: str) -> StagedFile:
+        not_staged: StagedFile = StagedFile(file_name, None, None, 0)
+        if self.should_stage is not None and not self.should_stage(file_name):
+            return not_staged
+
+        size: int = os.path.getsize(file_name)
+        if size > self.max_scratch_bytes or not self._reserve(size):
+            return not_staged
+
+        staged_path: str = self.workspace.path(f"{idx:05}-{os.path.basename(file_name)}")
+        try:
+            file_key: tuple = msu.ProbeCache.key_for(file_name)
+            msu.copy_file_data(file_name, staged_path)
+        except OSError as e:
+            log.warning(f"Could not prefetch {file_name}. {e}")
+            self._release(StagedFile(file_name, staged_path, None, size))
+            return not_staged
+
+        log.debug(f"Prefetched {file_name} to {staged_path}.")
+        return StagedFile(file_name, staged_path, file_key, size)
+
+    def _stage_all(self, file_names: typ.Iterable[str]) -> None:
+        try:
+            for idx, file_name in enumerate(file_names):
+                self.slots.acquire()
+                if self.stopping:
+                    break
+                try:
+                    staged: StagedFile = self._stage(idx, file_name)
+                except Exception as e:
+                    log.exception(e)
+                    staged = StagedFile(file_name, None, None, 0)
+                self.staged.put(staged)
+        except Exception as e:
+            log.error("Could not get the next file to prefetch.")
+            log.exception(e)
+        finally:
+            self.staged.put(None)
+
+    def __iter__(self) -> typ.Iterator[StagedFile]:
+        while True:
+            if self.current is not None:
+                self._release(self.current)
+                self.current = None
+
+            staged: StagedFile | None = self.staged.get()
+            if staged is None:
+                return
+            self.slots.release()
+            self.current = staged
+            yield staged
+
+    def close(self) -> None:
+        with self.space:
+            self.stopping = True
+            self.space.notify_all()
+        self.slots.release()
+        self.thread.join()
+        self.workspace.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
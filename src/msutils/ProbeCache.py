@@ -0,0 +1,124 @@
+import json
+import logging as log
+import os
+import sqlite3
+import threading
+import time
+
+PROBE_CACHE_FILE: str = os.path.expanduser("~/.cache/media-server-utils/probe-cache.sqlite3")
+MAX_AGE_DAYS: float = 90.0
+MAX_ENTRIES: int = 250000
+SECONDS_PER_DAY: int = 24 * 60 * 60
+# ONLY REWRITE last_used WHEN IT IS THIS OLD, SO CACHE HITS STAY READ-ONLY.
+TOUCH_INTERVAL: float = SECONDS_PER_DAY
+MAINTENANCE_INTERVAL: float = SECONDS_PER_DAY
+VACUUM_AFTER_DELETES: int = 1000
+
+# ONE CACHE PER PROCESS.  CONNECTIONS CANNOT BE SHARED ACROSS fork().
+_default_cache = None
+_default_cache_pid: int = 0
+
+
+class ProbeCache:
+    """ On-disk cache of ffprobe results.  Entries are keyed by the device,
+        inode, size and modification time of the media file, so a hit only
+        costs a stat() and any change to the file is a miss.  The threads of
+        a process (e.g. the prefetcher's) share its cache.
+    """
+    def __init__(self, db_file: str = PROBE_CACHE_FILE):
+        self.db_file: str = db_file
+        db_dir: str = os.path.dirname(db_file)
+        if db_dir != "":
+            os.makedirs(db_dir, exist_ok=True)
+
+        self.connection = sqlite3.connect(db_file, timeout=30.0, check_same_thread=False)
+        self.lock: threading.RLock = threading.RLock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS probes ("
+                                    "  dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER,"
+                                    "  path TEXT, data TEXT, last_used REAL,"
+                                    "  PRIMARY KEY (dev, ino, size, mtime_ns))"
+                                    )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS probes_last_used ON probes (last_used)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value REAL)")
+
+    @staticmethod
+    def key_for(file_name: str) -> (int, int, int, int):
+        st: os.stat_result = os.stat(file_name)
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def get(self, file_name: str) -> dict | None:
+        key = ProbeCache.key_for(file_name)
+        with self.lock:
+            row = self.connection.execute("SELECT data, last_used FROM probes "
+                                          "WHERE dev=? AND ino=? AND size=? AND mtime_ns=?", key
+                                          ).fetchone()
+            if row is None:
+                return None
+
+            now: float = time.time()
+            if now - row[1] > TOUCH_INTERVAL:
+                with self.connection:
+                    self.connection.execute("UPDATE probes SET last_used=? "
+                                            "WHERE dev=? AND ino=? AND size=? AND mtime_ns=?", (now, *key)
+                                            )
+        return json.loads(row[0])
+
+    def put(self, file_name: str, ffprobe_data: dict) -> None:
+        key = ProbeCache.key_for(file_name)
+        with self.lock, self.connection:
+            # ANY OLDER VERSION OF THIS FILE CAN NEVER BE A HIT AGAIN.
+            self.connection.execute("DELETE FROM probes WHERE dev=? AND ino=?", key[:2])
+            self.connection.execute("INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (*key, file_name, json.dumps(ffprobe_data), time.time())
+                                    )
+
+    def evict(self, max_age_days: float = MAX_AGE_DAYS, max_entries: int = MAX_ENTRIES) -> int:
+        """ Remove entries not used in MAX_AGE_DAYS and the least recently
+            used entries beyond MAX_ENTRIES.  Returns the number removed.
+        """
+        cutoff: float = time.time() - max_age_days * SECONDS_PER_DAY
+        with self.lock, self.connection:
+            removed: int = self.connection.execute("DELETE FROM probes WHERE last_used < ?", (cutoff,)).rowcount
+            removed += self.connection.execute("DELETE FROM probes WHERE rowid IN "
+                                               "(SELECT rowid FROM probes ORDER BY last_used DESC "
+                                               " LIMIT -1 OFFSET ?)", (max_entries,)
+                                               ).rowcount
+        log.info(f"Evicted {removed} entries from probe cache {self.db_file}.")
+        return removed
+
+    def vacuum(self) -> None:
+        with self.lock:
+            self.connection.execute("VACUUM")
+
+    def maintain(self) -> None:
+        """ Evict (and vacuum if worthwhile) at most once per MAINTENANCE_INTERVAL. """
+        now: float = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM settings WHERE name='last_maintenance'").fetchone()
+            if row is not None and now - row[0] < MAINTENANCE_INTERVAL:
+                return
+
+            if self.evict() >= VACUUM_AFTER_DELETES:
+                self.vacuum()
+            with self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO settings VALUES ('last_maintenance', ?)", (now,))
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def default_probe_cache() -> ProbeCache | None:
+    """ The probe cache for this process, or None if it cannot be opened. """
+    global _default_cache, _default_cache_pid
+
+    if _default_cache_pid != os.getpid():
+        _default_cache_pid = os.getpid()
+        try:
+            _default_cache = ProbeCache()
+        except (OSError, sqlite3.Error) as e:
+            log.warning(f"Probe cache {PROBE_CACHE_FILE} is unavailable. Probing every file. {e}")
+            _default_cache = None
+
+    return _default_cache
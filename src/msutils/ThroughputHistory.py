@@ -0,0 +1,228 @@
+import bisect
+import collections as coll
+import datetime as dt
+import heapq
+import logging as log
+import os
+import socket
+import sqlite3
+import statistics
+import time
+import typing as typ
+
+import msutils as msu
+
+THROUGHPUT_HISTORY_FILE: str = os.path.expanduser("~/.cache/media-server-utils/throughput.sqlite3")
+
+STAGE_TRANSCODE: str = "transcode"
+STAGE_DETECT: str = "detect"
+# SPEED (MULTIPLE OF REAL TIME) ASSUMED UNTIL SOMETHING LIKE IT HAS BEEN RECORDED.
+DEFAULT_SPEEDS: dict = {STAGE_TRANSCODE: 1.0, STAGE_DETECT: 8.0}
+# PREDICTIONS USE THE MEDIAN OF THIS MANY OF THE MOST RECENT MATCHING RUNS.
+HISTORY_SAMPLES: int = 50
+HEIGHT_CLASSES: [int] = [480, 720, 1080, 1440, 2160]
+
+ORDER_SCAN: str = "scan"
+ORDER_SHORTEST_FIRST: str = "sjf"
+ORDER_DEADLINE: str = "deadline"
+ORDERS: [str] = [ORDER_SCAN, ORDER_SHORTEST_FIRST, ORDER_DEADLINE]
+
+# seconds IS THE PREDICTED TIME.  finish IS SECONDS FROM THE START OF THE BATCH.
+PlannedJob = coll.namedtuple("PlannedJob", "file_name seconds finish", defaults=(0.0,))
+
+# ONE HISTORY PER PROCESS.  CONNECTIONS CANNOT BE SHARED ACROSS fork().
+_default_history = None
+_default_history_pid: int = 0
+
+
+def height_class(height: int) -> int:
+    """ The smallest standard height at least HEIGHT (e.g. 1088 -> 1440). """
+    idx: int = bisect.bisect_left(HEIGHT_CLASSES, height)
+    return HEIGHT_CLASSES[min(idx, len(HEIGHT_CLASSES) - 1)]
+
+
+def frame_rate(probe: msu.MediaProbe) -> float:
+    for stream in probe.ffprobe_data.get("streams", []):
+        if stream.get("codec_type") == "video":
+            num, _, den = stream.get("avg_frame_rate", "0/1").partition("/")
+            try:
+                return float(num) / float(den or 1)
+            except (ValueError, ZeroDivisionError):
+                return 0.0
+    return 0.0
+
+
+class ThroughputHistory:
+    """ How fast past transcodes and detection passes ran, by source codec,
+        resolution and what was done (DETAIL, e.g. the video encoder), so
+        the time of the next one can be predicted.
+    """
+    def __init__(self, db_file: str = THROUGHPUT_HISTORY_FILE):
+        self.db_file: str = db_file
+        db_dir: str = os.path.dirname(db_file)
+        if db_dir != "":
+            os.makedirs(db_dir, exist_ok=True)
+
+        self.connection = sqlite3.connect(db_file, timeout=30.0)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS runs ("
+                                    "  ts REAL, host TEXT, stage TEXT, detail TEXT, codec TEXT, height INTEGER,"
+                                    "  fps REAL, duration REAL, seconds REAL, speed REAL)"
+                                    )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS runs_stage ON runs (stage, detail, codec, height, ts)")
+
+    def record(self, stage: str, probe: msu.MediaProbe, seconds: float, detail: str = "") -> None:
+        if seconds <= 0 or probe.duration <= 0:
+            return
+        video: msu.MediaStream | None = probe.video_stream()
+        speed: float = probe.duration / seconds
+        with self.connection:
+            self.connection.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (time.time(),
+                                     socket.gethostname(),
+                                     stage,
+                                     detail,
+                                     "" if video is None else video.codec_name,
+                                     height_class(0 if video is None else video.height),
+                                     frame_rate(probe) * speed,
+                                     probe.duration,
+                                     seconds,
+                                     speed
+                                     )
+                                    )
+        log.info(f"{stage} of {probe.file_name} ran at {speed:.2f}x ({probe.duration:,.0f}s in {seconds:,.0f}s).")
+
+    def speed(self, stage: str, probe: msu.MediaProbe, detail: str = "") -> float:
+        """ Expected speed (multiple of real time).  Falls back to less
+            specific matches when nothing exactly like PROBE has run yet.
+        """
+        video: msu.MediaStream | None = probe.video_stream()
+        codec: str = "" if video is None else video.codec_name
+        height: int = height_class(0 if video is None else video.height)
+
+        for where, args in [("stage=? AND detail=? AND codec=? AND height=?", (stage, detail, codec, height)),
+                            ("stage=? AND detail=? AND height=?", (stage, detail, height)),
+                            ("stage=? AND detail=?", (stage, detail)),
+                            ]:
+            speeds: [float] = [row[0] for row in self.connection.execute(f"SELECT speed FROM runs WHERE {where} "
+                                                                         f"ORDER BY ts DESC LIMIT ?",
+                                                                         (*args, HISTORY_SAMPLES)
+                                                                         )]
+            if len(speeds) > 0:
+                return statistics.median(speeds)
+        return DEFAULT_SPEEDS.get(stage, 1.0)
+
+    def predict(self, stage: str, probe: msu.MediaProbe, detail: str = "") -> float:
+        """ Predicted seconds for STAGE of the file PROBE describes. """
+        return probe.duration / self.speed(stage, probe, detail)
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def default_throughput_history() -> ThroughputHistory:
+    global _default_history, _default_history_pid
+
+    if _default_history_pid != os.getpid():
+        _default_history_pid = os.getpid()
+        try:
+            _default_history = ThroughputHistory()
+        except (OSError, sqlite3.Error) as e:
+            log.warning(f"Throughput history {THROUGHPUT_HISTORY_FILE} is unavailable. Using default speeds. {e}")
+            _default_history = ThroughputHistory(":memory:")
+
+    return _default_history
+
+
+def record_throughput(stage: str, probe: msu.MediaProbe, seconds: float, detail: str = "") -> None:
+    """ Never let bookkeeping fail the job it describes. """
+    try:
+        default_throughput_history().record(stage, probe, seconds, detail)
+    except sqlite3.Error as e:
+        log.warning(f"Cannot record throughput of {probe.file_name}. {e}")
+
+
+def plan_files(file_names: typ.Iterable[str], estimate: typ.Callable[[str], float]) -> [PlannedJob]:
+    """ PlannedJob for each file, with ESTIMATE giving its predicted seconds. """
+    planned: [PlannedJob] = []
+    for file_name in file_names:
+        try:
+            planned.append(PlannedJob(file_name, estimate(file_name)))
+        except (msu.MediaServerUtilityException, OSError) as e:
+            log.warning(f"Cannot predict the time for {file_name}. {e}")
+            print(f"Cannot predict the time for {file_name}. {msu.Color.RED}{e}{msu.Color.END}")
+    return planned
+
+
+def schedule(planned: [PlannedJob], jobs: int = 1) -> [PlannedJob]:
+    """ Predicted finish of each job when they are started in this order
+        on JOBS workers.
+    """
+    free_at: [float] = [0.0] * max(1, jobs)
+    scheduled: [PlannedJob] = []
+    for job in planned:
+        start: float = heapq.heappop(free_at)
+        heapq.heappush(free_at, start + job.seconds)
+        scheduled.append(job._replace(finish=start + job.seconds))
+    return scheduled
+
+
+def order_jobs(planned: [PlannedJob], order: str, jobs: int = 1, deadline: float = None) -> [PlannedJob]:
+    """ PLANNED in the order to run them.  ORDER_DEADLINE runs the shortest
+        first and drops whatever is not predicted to finish by DEADLINE
+        (seconds since the epoch), so nothing is left half done.
+    """
+    if order == ORDER_SCAN:
+        return schedule(planned, jobs)
+
+    ordered: [PlannedJob] = schedule(sorted(planned, key=lambda j: j.seconds), jobs)
+    if order == ORDER_DEADLINE and deadline is not None:
+        available: float = deadline - time.time()
+        fits: [PlannedJob] = [j for j in ordered if j.finish <= available]
+        # SOMETHING DROPPED EARLY CAN LET A LATER FILE FIT.  RE-SCHEDULE WHAT IS KEPT.
+        ordered = schedule(fits, jobs)
+    return ordered
+
+
+def parse_deadline(hh_mm: str) -> float:
+    """ The next time it is HH:MM, in seconds since the epoch. """
+    hour, _, minute = hh_mm.partition(":")
+    now: dt.datetime = dt.datetime.now()
+    deadline: dt.datetime = now.replace(hour=int(hour), minute=int(minute or 0), second=0, microsecond=0)
+    if deadline <= now:
+        deadline += dt.timedelta(days=1)
+    return deadline.timestamp()
+
+
+def pretty_duration(seconds: float) -> str:
+    mins, secs = divmod(int(round(seconds)), 60)
+    hours, mins = divmod(mins, 60)
+    return f"{hours:d}:{mins:02d}:{secs:02d}"
+
+
+def print_plan(planned: [PlannedJob], jobs: int = 1, deadline: float = None) -> None:
+    scheduled: [PlannedJob] = schedule([j for j in planned if j.seconds > 0], jobs)
+    if len(scheduled) < len(planned):
+        print(f"{len(planned) - len(scheduled):,} files need no work.")
+    for job in scheduled:
+        print(f"    {msu.Color.CYAN}{pretty_duration(job.seconds):>9}{msu.Color.END}  "
+              f"done at +{pretty_duration(job.finish):>9}  {job.file_name}"
+              )
+
+    total: float = max((j.finish for j in scheduled), default=0.0)
+    work: float = sum(j.seconds for j in scheduled)
+    print(f"{len(scheduled):,} files, {pretty_duration(work)} of work, "
+          f"{msu.Color.BOLD}{pretty_duration(total)}{msu.Color.END} with {jobs} job(s).")
+    if deadline is not None:
+        available: float = deadline - time.time()
+        end: str = dt.datetime.fromtimestamp(deadline).strftime("%H:%M")
+        if total <= available:
+            print(f"{msu.Color.GREEN}Fits{msu.Color.END} before {end} with {pretty_duration(available - total)} "
+                  f"to spare."
+                  )
+        else:
+            fitting: int = len(order_jobs(scheduled, ORDER_DEADLINE, jobs, deadline))
+            print(f"{msu.Color.RED}Does not fit{msu.Color.END} before {end}. "
+                  f"{pretty_duration(total - available)} over. {fitting:,} files fit if the shortest go first."
+                  )
@@ -1,19 +1,42 @@
+import collections as coll
 import datetime as dt
 import logging as log
 import os
-import pathlib as path
-import shutil as sh
-import subprocess as proc
 import time
 
 from .ffmpeg_utils import run_ffmpeg
+from .file_transfer import atomic_replace, copy_file_data, move_file, stage_file
+from .JobWorkspace import JobWorkspace
 from .MediaServerUtilityException import MediaServerUtilityException
 from .MovieSections import MovieSection, MovieSections
 from .MovieChapter import MovieChapter
+from . import progress
+from .progress import ProgressReporter, configure_progress
+from .instrumentation import Span, add_spans, configure_instrumentation, print_span_summary, take_spans
+from .FileState import FileState
+from .FFmpegRunner import FFmpegRunner, progress_seconds, progress_speed
+from .FreezeAndSilenceFinder import FreezeAndSilenceFinder
+from .sharded_detect import detect_detail, find_freezes_sharded
+from .coarse_detect import find_freezes_coarse_to_fine
+from .chunked_encode import encode_chunk, encode_in_chunks, encode_on_spool, encoded_chunk_name
+from .ChunkSpool import ChunkJob, ChunkSpool
+from .MediaProbe import MediaProbe, MediaStream
+from .ProbeCache import ProbeCache, default_probe_cache
+from .KeyFrameIndex import KeyFrameIndex
+from .smart_render import smart_render
+from .JobStore import FileJob, JobStore, artifact_output, artifact_unchanged, default_job_store
+from .LibraryScanner import LibraryScanner
+from .ThroughputHistory import STAGE_DETECT, STAGE_TRANSCODE, PlannedJob, ThroughputHistory, \
+    default_throughput_history, order_jobs, plan_files, print_plan, record_throughput
+from .DirectoryWatcher import DirectoryWatcher
+from .PosterStore import PosterStore, default_poster_store
+from .media_mover import MoveRule, READY_ALWAYS, READY_ONLY_FILE, READY_ONLY_STEM, move_media
+from .Prefetcher import PREFETCH_DEPTH, Prefetcher, StagedFile
+from .work_pool import run_jobs
 
 FFMPEG_FILE = "ffmpeg"
-KEY_FRAME_SCAN_DURATION: float = 15.0
-TOO_MANY_LINES_BEFORE_PROGRESS: int = 100000
+FREEZE_DETECT_FILTER: str = "freezedetect=n=0.001"
+SILENCE_DETECT_FILTER: str = "silencedetect"
 
 
 class Color:
@@ -42,6 +65,9 @@ class Color:
 
 YES: str = "Yes"
 
+# WORKSPACE OF THE JOB RUNNING IN THIS PROCESS.  None MEANS USE THE CURRENT DIRECTORY.
+current_workspace: JobWorkspace | None = None
+
 
 def round_to(value: int, base: int) -> int:
     return base * round(value/base)
@@ -59,28 +85,54 @@ def how_accurate(percent_complete: float) -> int:
     return 1
 
 
+def set_workspace(workspace: JobWorkspace | None) -> None:
+    global current_workspace
+    current_workspace = workspace
+
+
+def work_path(file_name: str) -> str:
+    """ Location of a scratch file for the job running in this process. """
+    if current_workspace is None:
+        return file_name
+    return current_workspace.path(file_name)
+
+
+def ffmpeg_thread_args() -> [str]:
+    """ ffmpeg arguments limiting threads to the cores assigned to this job. """
+    if current_workspace is None or current_workspace.thread_count() == 0:
+        return []
+    return ["-threads", f"{current_workspace.thread_count()}"]
+
+
 def is_user_attribute_set_to_yes(file_name: str, attr_name: str) -> bool:
-    attr_names = (attr for attr in os.listxattr(file_name) if attr.startswith("user."))
-    for n in attr_names:
-        if n == f"user.{attr_name}" and YES == str(os.getxattr(file_name, n), "UTF-8"):
-            return True
-    return False
+    return FileState.of(file_name).get(attr_name) == YES
 
 
 def set_user_attribute_to_yes(file_name: str, attr_name: str) -> None:
-    os.setxattr(file_name, f"user.{attr_name}", bytes(YES, "UTF-8"))
+    with FileState.of(file_name) as state:
+        state.set(attr_name, YES)
 
 
 def duplicate_xattrs(from_fn: str, to_fn: str, strip_attrs: [str] = None) -> None:
-    strip: [str] = []
-    if strip_attrs is not None:
-        for attr in strip_attrs:
-            strip.append(f"user.{attr}")
+    strip: [str] = [] if strip_attrs is None else strip_attrs
+
+    with FileState.of(to_fn) as target:
+        for attr, value in FileState.of(from_fn).all().items():
+            if attr not in strip:
+                target.set(attr, value)
 
-    attr_names = (attr for attr in os.listxattr(from_fn) if attr.startswith("user."))
-    for n in attr_names:
-        if n not in strip:
-            os.setxattr(to_fn, n, os.getxattr(from_fn, n))
+
+def count_by_stem(file_names: [str]) -> coll.Counter:
+    """ How many of FILE_NAMES match glob(f"{stem}.*") for every possible stem,
+        from a single directory listing.
+    """
+    counts: coll.Counter = coll.Counter()
+    for name in file_names:
+        dot: int = name.find(".", 1)
+        while dot >= 0:
+            counts[name[:dot]] += 1
+            dot = name.find(".", dot + 1)
+    return counts
 
 
 def clean_file_name(orig_file_name: str) -> str:
@@ -101,17 +153,19 @@ def clean_file_name(orig_file_name: str) -> str:
         return os.path.join(dir_loc, new_file_name)
 
 
-def replace_file(orig_file_name: str, replace_with_file_name: str, strip_attrs: [str] = None) -> None:
+def replace_file(orig_file_name: str,
+                 replace_with_file_name: str,
+                 strip_attrs: [str] = None,
+                 set_attrs: [str] = None
+                 ) -> None:
     print(f"    {Color.BOLD}{Color.BLUE}Replacing{Color.END} video file.")
     log.info(f"Replace {orig_file_name} with the new, updated version.")
-    backup_file_name: str = f"{orig_file_name}.backup"
-    # REPLACE ORIGINAL FILE WITH NEW, BETTER ONE
-    # 1 -> move original to .backup
-    sh.move(orig_file_name, backup_file_name)
-    # 2 -> move temp to original
+    # REPLACE ORIGINAL FILE WITH NEW, BETTER ONE.  THE NEW FILE IS COPIED NEXT TO
+    # THE ORIGINAL (OR RENAMED IF ON THE SAME FILESYSTEM), GIVEN THE ORIGINAL'S
+    # FILE ATTRIBUTES AND THEN RENAMED OVER IT.
     while True:
         try:
-            sh.copyfile(replace_with_file_name, orig_file_name)
+            atomic_replace(orig_file_name, replace_with_file_name, strip_attrs, set_attrs)
             break
         except PermissionError:
             print("Permission error ... retry one time after 1 minute.")
@@ -121,85 +175,15 @@ def replace_file(orig_file_name: str, replace_with_file_name: str, strip_attrs:
             print(f"Exception: {type(e)} --> {e}")
             raise e
 
-    # 3 -> copy file attributes provided by the user
-    duplicate_xattrs(backup_file_name, orig_file_name, strip_attrs)
-    # 4 -> remove backup file
-    path.Path.unlink(path.Path(backup_file_name))
-    path.Path.unlink(path.Path(replace_with_file_name))
     log.info(f"Completed update of {orig_file_name}.")
 
 
-def ffmpeg_output_before_transcode(output) -> [str]:
-    line_count: int = 0
-    pre_transcode_text: [str] = []
-    started_transcoding: bool = False
-    while not started_transcoding:
-        ffmpeg_output = output.readline()
-        if len(ffmpeg_output) > 3:
-            pre_transcode_text.append(ffmpeg_output)
-        started_transcoding = is_ffmpeg_update(ffmpeg_output)
-
-        line_count += 1
-        if line_count > TOO_MANY_LINES_BEFORE_PROGRESS:
-            log.error("Cannot find beginning of ffmpeg processing.")
-            log.error(pre_transcode_text)
-            raise MediaServerUtilityException("Cannot find beginning of ffmpeg processing.")
-
-    return pre_transcode_text
-
-
 def temp_results_file_name(file_name: str) -> str:
     extension: str = file_name[-4:]
     if extension != ".mp4" and extension != ".mkv":
         raise MediaServerUtilityException(f"{extension} is not a valid file type to transcode. (.mp4 or .mkv only)")
 
-    return f"temp-output{extension}"
-
-
-def find_duration(text: [str]) -> float:
-    for line in text:
-        if is_ffmpeg_duration_line(line):
-            return_val: float = get_ffmpeg_duration(line)
-
-            log.debug(f"Movie length: {return_val:.1f} seconds.")
-            return return_val
-
-    return 0
-
-
-def text_to_secs(text: str) -> float:
-    """ Convert string such as 01:14:30.54 (hh:mm:ss.xx) into 4470.54 """
-    if len(text) < 11 or text[2] != ":" or text[5] != ":":
-        log.warning(f"{text} is an invalid time duration. Using 0.")
-        return 0.0
-
-    hrs = int(text[0:2])
-    mins = int(text[3:5])
-    secs = float(text[6:])
-
-    return (hrs * 60 * 60) + (mins * 60) + secs
-
-
-def is_ffmpeg_chapter_header(text: str) -> bool:
-    """ Is the supplied output TEXT from ffmpeg indicate a list of
-        chapters is forthcoming?
-    """
-    return text.strip() == "Chapters:"
-
-
-def is_ffmpeg_duration_line(text: str) -> bool:
-    idx = text.find("Duration: ")
-    return idx == 2
-
-
-def get_ffmpeg_duration(text: str) -> float:
-    dur_in_text = text[12:23]
-    return text_to_secs(dur_in_text)
-
-
-def is_ffmpeg_chapter(text: str) -> bool:
-    idx = text.find("Chapter #")
-    return idx >= 0
+    return work_path(f"temp-output{extension}")
 
 
 def pretty_progress(current: float, total: float) -> str:
@@ -207,13 +191,14 @@ def pretty_progress(current: float, total: float) -> str:
     return f"{Color.GREEN}{progress:5.1f}%{Color.END} ({current:,.1f} of {Color.CYAN}{total:,.1f}{Color.END})"
 
 
-def pretty_progress_with_timer(start_ts: dt.datetime, current: float, total: float) -> str:
+def pretty_progress_with_timer(start_ts: dt.datetime, current: float, total: float, eta: float = None) -> str:
+    """ ETA (seconds left), when known, replaces the linear guess from the time taken so far. """
     current_ts: dt.datetime = dt.datetime.now()
     elapsed_time: dt.timedelta = current_ts - start_ts
     progress: float = 100 * current / total
 
     time_worked: int = elapsed_time.seconds
-    time_left: int = int(time_worked * (100.0 - progress) / progress)
+    time_left: int = int(time_worked * (100.0 - progress) / progress) if eta is None else int(eta)
     accuracy: int = how_accurate(progress)
     approximate_time: int = round_to(time_left, accuracy) + accuracy
 
@@ -225,71 +210,14 @@ def pretty_progress_with_timer(start_ts: dt.datetime, current: float, total: flo
            f"  {Color.BOLD}{mins:02}:{secs:02}{Color.END}    "
 
 
-def is_ffmpeg_update(text: str) -> bool:
-    idx = text.find(" time=")
-    return idx > 0
-
-
-def ffmpeg_get_current_time(text: str) -> float:
-    idx = text.find(" time=")
-    if idx < 0:
-        raise MediaServerUtilityException(f"{text} is not a valid ffmpeg progress update.")
-    time_in_text = text[idx+6:idx+6+12]
-    return text_to_secs(time_in_text)
-
-
 def all_codecs_for(file_name: str) -> [str]:
-    result: proc.CompletedProcess = proc.run(
-        [
-            "ffprobe",
-            "-v", "error",
-            "-show_entries",
-            "stream=codec_name",
-            "-of", "default=noprint_wrappers=1:nokey=1",
-            file_name,
-        ],
-        capture_output=True,
-    )
-
-    if result.returncode != 0:
-        raise MediaServerUtilityException(f"An error occurred while probing {file_name}. " +
-                                          f"Return code: {result.returncode}"
-                                          )
-
-    return_val: [str] = []
-
-    for codec in str(result.stdout, 'UTF-8').split("\n"):
-        return_val.append(codec)
-
-    return return_val
+    return MediaProbe.probe(file_name).codecs()
 
 
 def get_next_key_frame_after_timestamp(video_file: str, loc_in_video: float) -> float:
-    start: float = loc_in_video
-    stop: float = loc_in_video + KEY_FRAME_SCAN_DURATION
-    key_frames: [float] = []
-
-    ffmpeg_args: [str] = [FFMPEG_FILE,
-                          "-hide_banner",
-                          "-ss", f"{start}",
-                          "-to", f"{stop}",
-                          "-skip_frame", "nokey",
-                          "-i", video_file,
-                          "-an",
-                          "-vf", "showinfo",
-                          "-f", "null",
-                          "-",
-                          ]
-
-    with proc.Popen(ffmpeg_args, text=True, stderr=proc.PIPE) as process:
-        for line in process.stderr:
-            start_idx: int = line.find("pts_time:")
-            if start_idx >= 0:
-                end_idx: int = line.find(" ", start_idx + 9)
-                timestamp: float = float(line[start_idx+9: end_idx])
-                key_frames.append(timestamp)
-
-    if len(key_frames) == 0:
+    key_frame: float | None = KeyFrameIndex.for_file(video_file).next_after(loc_in_video)
+    if key_frame is None:
+        log.warning(f"No key frame after {loc_in_video:.2f} in {video_file}. Using {loc_in_video:.2f}.")
         return loc_in_video
 
-    return loc_in_video + key_frames[0] - 0.25
+    return key_frame - 0.25
@@ -0,0 +1,256 @@
+import concurrent.futures as cf
+import logging as log
+import os
+import shutil as sh
+import threading
+
+import msutils as msu
+
+CHUNK_DIR: str = "chunks"
+CHUNK_LIST_FILE: str = "encoded-chunks.txt"
+CHUNK_VIDEO_FILE: str = "encoded-video.mkv"
+# DO NOT SPLIT OFF A FINAL CHUNK SHORTER THAN THIS FRACTION OF A CHUNK.
+SHORTEST_LAST_CHUNK: float = 0.25
+
+
+def chunk_split_times(file_name: str, chunk_seconds: float, duration: float) -> [float]:
+    """ Key frame aligned times at which to split FILE_NAME into chunks of
+        roughly CHUNK_SECONDS.
+    """
+    index: msu.KeyFrameIndex = msu.KeyFrameIndex.for_file(file_name)
+    split_times: [float] = []
+    target: float = chunk_seconds
+    while target < duration - chunk_seconds * SHORTEST_LAST_CHUNK:
+        key_frame: float | None = index.next_after(target)
+        if key_frame is None or key_frame >= duration - chunk_seconds * SHORTEST_LAST_CHUNK:
+            break
+        if len(split_times) == 0 or key_frame > split_times[-1]:
+            split_times.append(key_frame)
+        target = key_frame + chunk_seconds
+
+    return split_times
+
+
+def split_into_chunks(ffmpeg_program: str, source: str, split_times: [float], chunk_dir: str) -> [str]:
+    """ Stream copy the first video stream of SOURCE into one file per chunk. """
+    os.makedirs(chunk_dir, exist_ok=True)
+    pattern: str = os.path.join(chunk_dir, "chunk-%04d.mkv")
+    ffmpeg_args: [str] = ["nice",
+                          ffmpeg_program,
+                          "-y",
+                          "-i", source,
+                          "-map", "0:v:0",
+                          "-c", "copy",
+                          "-f", "segment",
+                          "-segment_times", ",".join(f"{t:.6f}" for t in split_times),
+                          "-reset_timestamps", "1",
+                          pattern,
+                          ]
+    runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, label="Splitting", file_name=source)
+    if runner.run() != 0:
+        raise msu.MediaServerUtilityException(f"An error occurred splitting {source} into chunks. " +
+                                              f"Return code: {runner.returncode}"
+                                              )
+
+    return sorted(os.path.join(chunk_dir, f) for f in os.listdir(chunk_dir) if f.startswith("chunk-"))
+
+
+def encoded_chunk_name(chunk: str) -> str:
+    return chunk.replace("chunk-", "encoded-", 1)
+
+
+def encode_chunk(ffmpeg_program: str, chunk: str, video_args: [str], on_progress=None, output: str = None) -> str:
+    """ Encode the video of one chunk.  Returns the name of the encoded file. """
+    if output is None:
+        output = encoded_chunk_name(chunk)
+    ffmpeg_args: [str] = ["nice",
+                          ffmpeg_program,
+                          "-y",
+                          "-i", chunk,
+                          "-map", "0:v:0",
+                          *video_args,
+                          output,
+                          ]
+    runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, show_progress=False, file_name=chunk)
+    if on_progress is not None:
+        runner.add_progress_handler(on_progress)
+    if runner.run() != 0:
+        raise msu.MediaServerUtilityException(f"An error occurred encoding chunk {chunk}. " +
+                                              f"Return code: {runner.returncode}"
+                                              )
+    return output
+
+
+def encode_chunks(ffmpeg_program: str,
+                  chunks: [str],
+                  video_args: [str],
+                  jobs: int,
+                  file_name: str,
+                  duration: float
+                  ) -> [str]:
+    """ Encode CHUNKS concurrently, JOBS at a time, reporting combined progress. """
+    reporter: msu.ProgressReporter = msu.ProgressReporter(file_name, "Transcoding", duration)
+    positions: dict = {}
+    lock: threading.Lock = threading.Lock()
+
+    def progress_for(chunk: str):
+        def on_progress(record: dict) -> None:
+            current: float | None = msu.progress_seconds(record)
+            if current is None:
+                return
+            with lock:
+                positions[chunk] = current
+                reporter.update(sum(positions.values()))
+        return on_progress
+
+    # EACH CHUNK IS ENCODED BY ITS OWN ffmpeg PROCESS.  THE THREADS ONLY WAIT ON THEM.
+    with cf.ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures: [cf.Future] = [pool.submit(encode_chunk, ffmpeg_program, c, video_args, progress_for(c))
+                                for c in chunks]
+        try:
+            encoded: [str] = [f.result() for f in futures]
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            reporter.failed()
+            raise
+
+    reporter.complete()
+    return encoded
+
+
+def concat_chunks(ffmpeg_program: str, encoded_chunks: [str], chunk_dir: str) -> str:
+    """ Stream copy the encoded chunks, in order, into one video-only file. """
+    list_file: str = os.path.join(chunk_dir, CHUNK_LIST_FILE)
+    with open(list_file, "w") as fd:
+        for chunk in encoded_chunks:
+            fd.write(f"file '{os.path.abspath(chunk)}'\n")
+
+    output: str = os.path.join(chunk_dir, CHUNK_VIDEO_FILE)
+    ffmpeg_args: [str] = ["nice",
+                          ffmpeg_program,
+                          "-y",
+                          "-safe", "0",
+                          "-f", "concat",
+                          "-i", list_file,
+                          "-map", "0:v:0",
+                          "-c", "copy",
+                          output,
+                          ]
+    runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, show_progress=False, file_name=output)
+    if runner.run() != 0:
+        raise msu.MediaServerUtilityException(f"An error occurred joining encoded chunks. " +
+                                              f"Return code: {runner.returncode}"
+                                              )
+    return output
+
+
+def mux_with_source(ffmpeg_program: str,
+                    video_file: str,
+                    source: str,
+                    aud_codec: str,
+                    sbt_codec: str,
+                    output: str,
+                    duration: float
+                    ) -> None:
+    """ Combine the encoded video with the audio and subtitles of SOURCE,
+        which are converted here, once, for the whole movie.
+    """
+    ffmpeg_args: [str] = ["nice",
+                          ffmpeg_program,
+                          "-y",
+                          "-i", video_file,
+                          "-i", source,
+                          "-map", "0:v:0",
+                          "-map", "1:a?",
+                          "-map", "1:s?",
+                          "-map_metadata", "1",
+                          "-map_chapters", "1",
+                          "-c:v", "copy",
+                          "-c:a", aud_codec,
+                          "-c:s", sbt_codec,
+                          output,
+                          ]
+    runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, duration, "Muxing", file_name=source)
+    if runner.run() != 0:
+        raise msu.MediaServerUtilityException(f"An error occurred adding audio and subtitles to {output}. " +
+                                              f"Return code: {runner.returncode}"
+                                              )
+
+
+def encode_in_chunks(ffmpeg_program: str,
+                     source: str,
+                     output: str,
+                     video_args: [str],
+                     aud_codec: str,
+                     sbt_codec: str,
+                     chunk_seconds: float,
+                     jobs: int,
+                     duration: float
+                     ) -> None:
+    """ Transcode SOURCE into OUTPUT by splitting the video at key frames,
+        encoding the pieces concurrently and joining them back together.
+    """
+    chunk_dir: str = msu.work_path(CHUNK_DIR)
+    try:
+        split_times: [float] = chunk_split_times(source, chunk_seconds, duration)
+        log.info(f"Encoding {source} as {len(split_times) + 1} chunks, {jobs} at a time.")
+        chunks: [str] = split_into_chunks(ffmpeg_program, source, split_times, chunk_dir)
+        encoded: [str] = encode_chunks(ffmpeg_program, chunks, video_args, jobs, source, duration)
+        video_file: str = concat_chunks(ffmpeg_program, encoded, chunk_dir)
+        mux_with_source(ffmpeg_program, video_file, source, aud_codec, sbt_codec, output, duration)
+    finally:
+        sh.rmtree(chunk_dir, ignore_errors=True)
+
+
+def encode_on_spool(ffmpeg_program: str,
+                    source: str,
+                    output: str,
+                    video_args: [str],
+                    aud_codec: str,
+                    sbt_codec: str,
+                    chunk_seconds: float,
+                    spool_dir: str,
+                    duration: float
+                    ) -> None:
+    """ Like encode_in_chunks, but the chunks are published to SPOOL_DIR
+        and encoded by chunk_worker.py processes on any host that mounts it.
+    """
+    spool: msu.ChunkSpool = msu.ChunkSpool(spool_dir)
+    job_dir: str = spool.new_job_dir(source)
+    chunk_dir: str = msu.work_path(CHUNK_DIR)
+    try:
+        split_times: [float] = chunk_split_times(source, chunk_seconds, duration)
+        chunks: [str] = split_into_chunks(ffmpeg_program, source, split_times, job_dir)
+        jobs: [msu.ChunkJob] = spool.publish(chunks, video_args)
+        print(f"    Waiting for workers to encode {len(jobs)} chunks published to {job_dir}.")
+
+        bounds: [float] = [0.0, *split_times, duration]
+        reporter: msu.ProgressReporter = msu.ProgressReporter(source, "Transcoding", duration)
+        encoded_secs: float = 0.0
+
+        def chunk_done(idx: int) -> None:
+            nonlocal encoded_secs
+            if idx + 1 < len(bounds):
+                encoded_secs += bounds[idx + 1] - bounds[idx]
+            reporter.update(encoded_secs)
+
+        try:
+            # WITH NO WORKER RUNNING, THE CHUNKS ARE ENCODED HERE RATHER THAN WAITED ON FOREVER.
+            encoded: [str] = spool.wait_for(jobs,
+                                            chunk_done,
+                                            lambda job: encode_chunk(ffmpeg_program, job.chunk, job.video_args,
+                                                                     output=job.output
+                                                                     )
+                                            )
+        except BaseException:
+            reporter.failed()
+            raise
+        reporter.complete()
+
+        os.makedirs(chunk_dir, exist_ok=True)
+        video_file: str = concat_chunks(ffmpeg_program, encoded, chunk_dir)
+        mux_with_source(ffmpeg_program, video_file, source, aud_codec, sbt_codec, output, duration)
+    finally:
+        spool.remove(job_dir)
+        sh.rmtree(chunk_dir, ignore_errors=True)
@@ -0,0 +1,139 @@
+import logging as log
+
+import msutils as msu
+from msutils.sharded_detect import DetectShard, search_shards, stitch
+
+# THE COARSE PASS ONLY DECODES KEY FRAMES, AT MOST THIS MANY A SECOND, SHRUNK TO THIS WIDTH.
+COARSE_FPS: float = 2.0
+COARSE_WIDTH: int = 160
+# AND THE SOUND DOWNMIXED TO MONO AT THIS RATE.
+COARSE_SAMPLE_RATE: int = 8000
+# ITS THRESHOLDS ARE LOOSER THAN THE REAL ONES, SO IT FINDS TOO MUCH RATHER THAN TOO LITTLE.
+COARSE_FREEZE_SECONDS: float = 1.0
+COARSE_MIN_SECONDS: float = 1.0
+# KEY FRAMES CAN BE SECONDS APART, SO ITS FREEZES AND SILENCES ARE WIDENED THIS MUCH BEFORE
+# THEY ARE MATCHED UP.  OTHERWISE A SHORT GAP CAN SHRINK TO NOTHING.
+COARSE_SLACK: float = 5.0
+
+# EACH CANDIDATE IS SEARCHED PRECISELY FROM THIS LONG BEFORE IT TO THIS LONG AFTER IT.  A GAP
+# IS FOUND EXACTLY AS A FULL PASS FINDS IT AS LONG AS THE COARSE PASS PLACES IT THIS CLOSE.
+COARSE_PADDING: float = 15.0
+# A GAP THIS CLOSE TO THE EDGE OF ITS WINDOW MAY CONTINUE PAST IT.  THE WINDOW IS WIDENED.
+EDGE_SECONDS: float = 0.5
+MAX_WIDENINGS: int = 4
+
+
+def coarse_filters() -> (str, str):
+    """ -vf and -af of the coarse pass.  select, unlike fps, never repeats a
+        frame, which freezedetect would take for a freeze.
+    """
+    video: str = f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{1 / COARSE_FPS:.3f})'," \
+                 f"scale={COARSE_WIDTH}:-2," \
+                 f"{msu.FREEZE_DETECT_FILTER}:d={COARSE_FREEZE_SECONDS}"
+    audio: str = f"aformat=sample_rates={COARSE_SAMPLE_RATE}:channel_layouts=mono,{msu.SILENCE_DETECT_FILTER}"
+    return video, audio
+
+
+def find_candidates(ffmpeg_program: str, file_name: str, duration: float) -> msu.MovieSections:
+    """ Times that might be freezes and silences, from a cheap pass over FILE_NAME. """
+    video_filter, audio_filter = coarse_filters()
+    ffmpeg_args: [str] = ["nice",
+                          ffmpeg_program,
+                          *msu.ffmpeg_thread_args(),
+                          "-skip_frame:v", "nokey",
+                          "-i", file_name,
+                          "-vf", video_filter,
+                          "-map", "0:v:0",
+                          "-af", audio_filter,
+                          "-map", "0:a:0?",
+                          "-f", "null",
+                          "-",
+                          ]
+    finder: msu.FreezeAndSilenceFinder = msu.FreezeAndSilenceFinder(file_name)
+    runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, duration, "Scanning", file_name=file_name)
+    runner.add_line_handler(finder.handle_line)
+    if runner.run() != 0:
+        raise msu.MediaServerUtilityException(f"An error occurred scanning {file_name} for gaps. "
+                                              f"Return code: {runner.returncode}"
+                                              )
+    # A FREEZE OR SILENCE STILL GOING AT THE END IS A CANDIDATE TOO.
+    finder.close_open_sections(duration)
+    freezes: msu.MovieSections = with_slack(finder.found_video_freezes, COARSE_SLACK)
+    silences: msu.MovieSections = with_slack(finder.found_silences, COARSE_SLACK)
+    return freezes.ms_intersection(silences, COARSE_MIN_SECONDS)
+
+
+def with_slack(sections: msu.MovieSections, slack: float) -> msu.MovieSections:
+    return msu.MovieSections.from_sorted(sections.file_name,
+                                         [s._replace(start=s.start - slack, end=s.end + slack)
+                                          for s in sections.section_list],
+                                         sections.list_name
+                                         )
+
+
+def merge_windows(windows: [(float, float)], duration: float) -> [DetectShard]:
+    """ DetectShards covering WINDOWS ((start, end) pairs), overlapping ones joined. """
+    merged: [list] = []
+    for start, end in sorted(windows):
+        start, end = max(0.0, start), min(duration, end)
+        if len(merged) > 0 and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    # ROUNDED TO WHAT IS PASSED TO ffmpeg, SO SHIFTING ITS TIMES BY start IS EXACT.
+    return [DetectShard(round(start, 6), None if end >= duration else round(end, 6)) for start, end in merged]
+
+
+def widened(window: DetectShard,
+            found: (msu.MovieSections, msu.MovieSections),
+            padding: float,
+            duration: float
+            ) -> (float, float):
+    """ WINDOW, grown by PADDING on each side where a gap found in it runs into its edge. """
+    start: float = window.start
+    end: float = duration if window.end is None else window.end
+    freezes, silences = found
+    for sect in freezes.ms_intersection(silences, 0.0).section_list:
+        if start > 0 and sect.start <= window.start + EDGE_SECONDS:
+            start = window.start - padding
+        if window.end is not None and sect.end >= window.end - EDGE_SECONDS:
+            end = window.end + padding
+    return start, end
+
+
+def find_freezes_coarse_to_fine(ffmpeg_program: str,
+                                file_name: str,
+                                duration: float,
+                                padding: float = COARSE_PADDING,
+                                jobs: int = 1
+                                ) -> msu.MovieSections:
+    """ Times when the picture of FILE_NAME is frozen and the sound silent.
+        A cheap pass over key frames and low rate sound finds candidates.
+        Only windows of PADDING around them are then searched precisely,
+        JOBS at a time.
+    """
+    candidates: msu.MovieSections = find_candidates(ffmpeg_program, file_name, duration)
+    windows: [DetectShard] = merge_windows([(s.start - padding, s.end + padding) for s in candidates.section_list],
+                                           duration
+                                           )
+    log.info(f"Coarse pass found {len(candidates.section_list)} candidates in {file_name}. "
+             f"Searching {sum((duration if w.end is None else w.end) - w.start for w in windows):,.0f} "
+             f"of {duration:,.0f} secs precisely."
+             )
+
+    searched: dict = {}
+    widenings: int = 0
+    while True:
+        todo: [DetectShard] = [w for w in windows if w not in searched]
+        if len(todo) > 0:
+            searched.update(zip(todo, search_shards(ffmpeg_program, file_name, todo, jobs, duration)))
+        grown: [DetectShard] = merge_windows([widened(w, searched[w], padding, duration) for w in windows], duration)
+        if grown == windows:
+            break
+        if widenings == MAX_WIDENINGS:
+            log.warning(f"Gaps in {file_name} may continue past the windows searched.")
+            break
+        windows = grown
+        widenings += 1
+
+    return stitch(file_name, [searched[w] for w in windows])
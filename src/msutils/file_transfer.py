@@ -0,0 +1,136 @@
+import errno
+import fcntl
+import logging as log
+import os
+import shutil as sh
+
+import msutils as msu
+
+COPY_BLOCK_SIZE: int = 64 * 1024 * 1024
+# ioctl(2) REQUEST TO SHARE THE DATA BLOCKS OF ONE FILE WITH ANOTHER (btrfs, xfs, ...)
+FICLONE: int = 0x40049409
+# ERRORS MEANING "THIS FILESYSTEM CANNOT DO THAT", SO TRY THE NEXT METHOD.
+UNSUPPORTED_ERRORS: set = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY, errno.EPERM}
+
+
+def same_filesystem(file_name: str, target_file_name: str) -> bool:
+    target_dir: str = os.path.dirname(os.path.abspath(target_file_name))
+    return os.stat(file_name).st_dev == os.stat(target_dir).st_dev
+
+
+def _reflink(src_fd: int, dst_fd: int) -> bool:
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError as e:
+        if e.errno not in UNSUPPORTED_ERRORS:
+            raise
+        return False
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, size: int) -> bool:
+    """ Let the kernel (or the NFS server) copy the data.  False if unsupported. """
+    copied: int = 0
+    try:
+        while copied < size:
+            count: int = os.copy_file_range(src_fd, dst_fd, min(size - copied, COPY_BLOCK_SIZE))
+            if count == 0:
+                break
+            copied += count
+    except OSError as e:
+        if copied > 0 or e.errno not in UNSUPPORTED_ERRORS:
+            raise
+        return False
+    return True
+
+
+def _copy_blocks(src_fd: int, dst_fd: int) -> None:
+    buffer: bytearray = bytearray(COPY_BLOCK_SIZE)
+    view: memoryview = memoryview(buffer)
+    while True:
+        count: int = os.readv(src_fd, [buffer])
+        if count == 0:
+            break
+        written: int = 0
+        while written < count:
+            written += os.write(dst_fd, view[written:count])
+
+
+def copy_file_data(src: str, dst: str) -> None:
+    """ Copy the contents of SRC to DST using the cheapest method available:
+        reflink, then copy_file_range, then large block reads and writes.
+    """
+    with open(src, "rb") as src_fd, open(dst, "wb") as dst_fd:
+        size: int = os.fstat(src_fd.fileno()).st_size
+        if _reflink(src_fd.fileno(), dst_fd.fileno()):
+            log.debug(f"Reflinked {src} to {dst}.")
+        elif _copy_file_range(src_fd.fileno(), dst_fd.fileno(), size):
+            log.debug(f"Copied {src} to {dst} with copy_file_range.")
+        else:
+            _copy_blocks(src_fd.fileno(), dst_fd.fileno())
+            log.debug(f"Copied {src} to {dst} in {COPY_BLOCK_SIZE // (1024 * 1024)}MB blocks.")
+
+
+def stage_file(src: str, dst: str) -> None:
+    """ Make DST a read-only working copy of SRC.  SRC is left in place. """
+    if os.path.lexists(dst):
+        # NEVER WRITE THROUGH A HARD LINK LEFT BY AN EARLIER STAGE.
+        os.unlink(dst)
+
+    if same_filesystem(src, dst):
+        try:
+            os.link(src, dst)
+            log.debug(f"Staged {src} as a hard link at {dst}.")
+            return
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRORS and e.errno != errno.EMLINK:
+                raise
+
+    copy_file_data(src, dst)
+    sh.copystat(src, dst)
+
+
+def move_file(src: str, dst: str) -> None:
+    """ Rename when possible, otherwise copy and remove SRC. """
+    try:
+        os.rename(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    copy_file_data(src, dst)
+    sh.copystat(src, dst)
+    os.unlink(src)
+
+
+def atomic_replace(target: str, new_file: str, strip_attrs: [str] = None, set_attrs: [str] = None) -> None:
+    """ Replace TARGET with NEW_FILE.  The new data is written next to TARGET
+        under a temporary name, given TARGET's mode and user xattrs (less
+        STRIP_ATTRS, plus SET_ATTRS set to yes), and then renamed over TARGET,
+        so readers see either the old or the new file.
+    """
+    target_dir: str = os.path.dirname(os.path.abspath(target))
+    temp_name: str = os.path.join(target_dir, f".{os.path.basename(target)}.{os.getpid()}.tmp")
+
+    moved: bool = False
+    try:
+        move_file(new_file, temp_name)
+        moved = True
+        sh.copymode(target, temp_name)
+        msu.duplicate_xattrs(target, temp_name, strip_attrs)
+        if set_attrs is not None:
+            with msu.FileState.of(temp_name) as state:
+                for attr in set_attrs:
+                    state.set(attr, msu.YES)
+        with open(temp_name, "rb") as fd:
+            os.fsync(fd.fileno())
+        os.replace(temp_name, target)
+        msu.FileState.renamed(temp_name, target)
+    except BaseException:
+        if moved:
+            # PUT THE NEW FILE BACK SO THE CALLER CAN RETRY.
+            move_file(temp_name, new_file)
+        elif os.path.lexists(temp_name):
+            os.unlink(temp_name)
+        raise
@@ -0,0 +1,226 @@
+import collections as coll
+import json
+import logging as log
+import os
+import resource
+import socket
+import threading
+import time
+
+import msutils as msu
+
+METRIC_PREFIX: str = "msutils_stage"
+# PER FILE TOTALS THIS MANY TIMES THE MEDIAN ARE LISTED AS OUTLIERS IN THE SUMMARY.
+OUTLIER_FACTOR: float = 3.0
+
+prometheus_file: str | None = None
+trace_file: str | None = None
+# SPANS OF THIS RUN.  WORKER PROCESSES HAND THEIRS TO THE PROCESS THAT CONFIGURED INSTRUMENTATION,
+# WHICH ALONE WRITES THE PROMETHEUS FILE.
+_spans: [dict] = []
+_owner_pid: int = 0
+_run_id: str = ""
+# SPANS STILL RUNNING IN EACH THREAD, INNERMOST LAST.
+_open = threading.local()
+
+
+def configure_instrumentation(prometheus_to: str = None, trace_to: str = None) -> None:
+    """ PROMETHEUS_TO is a textfile (for node_exporter's textfile collector)
+        rewritten with totals per stage as spans finish.  TRACE_TO is a file
+        every span is appended to as one json record per line.
+    """
+    global prometheus_file, trace_file, _owner_pid, _run_id
+
+    prometheus_file = prometheus_to
+    trace_file = trace_to
+    _owner_pid = os.getpid()
+    _run_id = f"{socket.gethostname()}-{os.getpid()}-{int(time.time())}"
+
+
+def io_counters() -> (int, int):
+    """ (bytes read, bytes written) by this process and the children it has
+        waited for, including network filesystems and the page cache.
+        (0, 0) where /proc/self/io does not exist.
+    """
+    counters: dict = {}
+    try:
+        with open("/proc/self/io") as fd:
+            for line in fd:
+                key, _, value = line.partition(":")
+                counters[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return counters.get("rchar", 0), counters.get("wchar", 0)
+
+
+def resource_usage() -> dict:
+    own: resource.struct_rusage = resource.getrusage(resource.RUSAGE_SELF)
+    children: resource.struct_rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    read, written = io_counters()
+    return {"wall": time.monotonic(),
+            "cpu": own.ru_utime + own.ru_stime,
+            "child_cpu": children.ru_utime + children.ru_stime,
+            "read_bytes": read,
+            "written_bytes": written,
+            }
+
+
+def open_spans() -> list:
+    if not hasattr(_open, "stack"):
+        _open.stack = []
+    return _open.stack
+
+
+class Span:
+    """ Times one stage of one file: wall time, cpu time of this process
+        and of the processes (ffmpeg) it ran, and bytes read and written.
+        The counters are per process, so a background thread (e.g. the
+        prefetcher copying the next file) is counted in the span it overlaps.
+    """
+    def __init__(self, file_name: str, stage: str):
+        self.file_name: str = file_name
+        self.stage: str = stage
+        self.parent: str | None = None
+        self.start_ts: float = 0.0
+        self.start: dict = {}
+
+    def __enter__(self):
+        stack: list = open_spans()
+        self.parent = stack[-1].stage if len(stack) > 0 else None
+        stack.append(self)
+        self.start_ts = time.time()
+        self.start = resource_usage()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        open_spans().pop()
+        end: dict = resource_usage()
+        record: dict = {"run": _run_id,
+                        "ts": self.start_ts,
+                        "host": socket.gethostname(),
+                        "pid": os.getpid(),
+                        "file": self.file_name,
+                        "stage": self.stage,
+                        "parent": self.parent,
+                        "state": "done" if exc_type is None else "failed",
+                        **{key: round(end[key] - self.start[key], 6) for key in end},
+                        }
+        finish_span(record)
+        return False
+
+
+def finish_span(record: dict) -> None:
+    _spans.append(record)
+    if trace_file is not None:
+        try:
+            # ONE write OF ONE LINE, SO CONCURRENT JOBS APPENDING TO THE SAME TRACE DO NOT INTERLEAVE.
+            with open(trace_file, "a") as fd:
+                fd.write(json.dumps(record) + "\n")
+        except OSError as e:
+            log.warning(f"Cannot append to trace {trace_file}. {e}")
+    if os.getpid() == _owner_pid:
+        write_prometheus()
+
+
+def take_spans() -> [dict]:
+    """ The spans finished in this process since the last call. """
+    taken: [dict] = _spans[:]
+    del _spans[:]
+    return taken
+
+
+def add_spans(records: [dict]) -> None:
+    """ Spans a worker process returned with take_spans. """
+    _spans.extend(records)
+    if len(records) > 0:
+        write_prometheus()
+
+
+def stage_totals(records: [dict]) -> dict:
+    """ stage -> totals of its spans, in the order the stages first ran. """
+    totals: dict = {}
+    for record in records:
+        total: dict = totals.setdefault(record["stage"], coll.Counter(parent=0))
+        total["runs"] += 1
+        total["failures"] += record["state"] != "done"
+        for key in ("wall", "cpu", "child_cpu", "read_bytes", "written_bytes"):
+            total[key] += record[key]
+        if record["parent"] is not None:
+            total["parent"] = 1
+    return totals
+
+
+def write_prometheus() -> None:
+    if prometheus_file is None:
+        return
+    metrics: [(str, str, str)] = [("runs_total", "runs", "Stage runs."),
+                                  ("failures_total", "failures", "Stage runs that raised."),
+                                  ("wall_seconds_total", "wall", "Wall time."),
+                                  ("cpu_seconds_total", "cpu", "Cpu time of the media server utilities."),
+                                  ("child_cpu_seconds_total", "child_cpu", "Cpu time of ffmpeg and other children."),
+                                  ("read_bytes_total", "read_bytes", "Bytes read."),
+                                  ("written_bytes_total", "written_bytes", "Bytes written."),
+                                  ]
+    totals: dict = stage_totals(_spans)
+    lines: [str] = []
+    for name, key, help_text in metrics:
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} counter")
+        for stage, total in totals.items():
+            lines.append(f'{METRIC_PREFIX}_{name}{{stage="{stage}"}} {total[key]:g}')
+    lines.append(f"# HELP {METRIC_PREFIX}_last_update_seconds When a stage last finished.")
+    lines.append(f"# TYPE {METRIC_PREFIX}_last_update_seconds gauge")
+    lines.append(f"{METRIC_PREFIX}_last_update_seconds {time.time():.0f}")
+
+    # THE COLLECTOR MUST NEVER SEE A HALF WRITTEN FILE.
+    temp_file: str = f"{prometheus_file}.{os.getpid()}.tmp"
+    try:
+        with open(temp_file, "w") as fd:
+            fd.write("\n".join(lines) + "\n")
+        os.replace(temp_file, prometheus_file)
+    except OSError as e:
+        log.warning(f"Cannot write metrics to {prometheus_file}. {e}")
+
+
+def pretty_bytes(count: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if count < 1024:
+            return f"{count:,.0f}{unit}" if unit == "B" else f"{count:,.1f}{unit}"
+        count /= 1024
+    return f"{count:,.1f}TB"
+
+
+def print_span_summary() -> None:
+    """ Where the time of this run went, by stage, and the files that took
+        much longer than the others.
+    """
+    if len(_spans) == 0:
+        return
+    totals: dict = stage_totals(_spans)
+    # NESTED SPANS (e.g. KEY FRAME SCANS DURING A CUT) ARE ALREADY PART OF THEIR PARENT'S TIME.
+    run_wall: float = sum(t["wall"] for t in totals.values() if t["parent"] == 0) or 1.0
+    print(f"{msu.Color.BOLD}{'Stage':<18} {'Runs':>5} {'Wall':>11} {'Share':>6} {'ffmpeg CPU':>11} "
+          f"{'Cores':>6} {'Read':>10} {'Written':>10}{msu.Color.END}"
+          )
+    for stage, total in sorted(totals.items(), key=lambda kv: (kv[1]["parent"], -kv[1]["wall"])):
+        name: str = f"  {stage}" if total["parent"] else stage
+        cores: float = total["child_cpu"] / total["wall"] if total["wall"] > 0 else 0.0
+        failed: str = f" {msu.Color.RED}{total['failures']} failed{msu.Color.END}" if total["failures"] else ""
+        print(f"{name:<18} {total['runs']:>5} {total['wall']:>10,.1f}s "
+              f"{100 * total['wall'] / run_wall:>5.1f}% {total['child_cpu']:>10,.1f}s "
+              f"{cores:>6.1f} {pretty_bytes(total['read_bytes']):>10} {pretty_bytes(total['written_bytes']):>10}"
+              f"{failed}"
+              )
+
+    by_file: coll.Counter = coll.Counter()
+    for record in _spans:
+        if record["parent"] is None:
+            by_file[record["file"]] += record["wall"]
+    if len(by_file) > 2:
+        median: float = sorted(by_file.values())[len(by_file) // 2]
+        for file_name, wall in by_file.most_common():
+            if wall < OUTLIER_FACTOR * median:
+                break
+            print(f"    {msu.Color.YELLOW}Outlier{msu.Color.END} {wall:,.1f}s "
+                  f"({wall / median:.1f}x the median): {file_name}"
+                  )
@@ -0,0 +1,188 @@
+import collections as coll
+import concurrent.futures as cf
+import fnmatch
+import logging as log
+import os
+
+import msutils as msu
+
+# TRANSFERS RUNNING AT THE SAME TIME TO ONE DESTINATION MOUNT.  MORE ONLY MAKES ITS DISKS SEEK.
+TRANSFERS_PER_MOUNT: int = 2
+
+# WHEN A MATCHING FILE IS FINISHED AND SAFE TO MOVE.
+READY_ALWAYS: str = "always"
+# NO OTHER FILE SHARES ITS NAME (THE RECORDER'S SIDE FILES ARE GONE).
+READY_ONLY_STEM: str = "only-stem"
+# IT IS THE ONLY FILE IN ITS DIRECTORY.  THE DIRECTORY IS REMOVED AFTERWARDS.
+READY_ONLY_FILE: str = "only-file"
+
+# ONE LINE OF THE RULES TABLE.
+#   source_dir  WHERE THE RECORDINGS ARE.  FILES ARE LOOKED FOR depth DIRECTORIES BELOW IT.
+#   pattern     fnmatch PATTERN OF THE FILES TO MOVE.
+#   dest_dir    WHERE THEY GO.  THEIR DIRECTORIES BELOW source_dir ARE KEPT.
+#   year_dirs   {year: directory}.  USED INSTEAD OF dest_dir FOR FILES NAMED ...-sYYYY...
+#   posters     {year: poster}.  THE POSTER (IN THE DESTINATION) IS LINKED NEXT TO EACH FILE.
+MoveRule = coll.namedtuple("MoveRule", "name source_dir pattern dest_dir year_dirs posters ready depth",
+                           defaults=(None, None, None, READY_ONLY_STEM, 0)
+                           )
+# poster IS (COPY FROM, COPY TO) OR None.
+MoveTask = coll.namedtuple("MoveTask", "rule source dest poster")
+
+
+def year_of(file_name: str) -> str:
+    """ The season year in names like 20240412vsPadres-s2024e0412.mkv """
+    yr_start_idx: int = file_name.find("-s") + 2
+    return file_name[yr_start_idx:yr_start_idx+4]
+
+
+def snapshot(rule: MoveRule, only_dir: str = None) -> dict:
+    """ {directory: [file names]} of every directory rule.depth levels below
+        rule.source_dir, each listed exactly once.  With ONLY_DIR, just that
+        directory, if it is one of them.
+    """
+    listing: dict = {}
+
+    def walk(dir_name: str, depth: int) -> None:
+        try:
+            with os.scandir(dir_name) as entries:
+                found: [os.DirEntry] = list(entries)
+        except FileNotFoundError:
+            return
+        if depth == rule.depth:
+            listing[dir_name] = sorted(e.name for e in found if e.is_file())
+            return
+        for entry in sorted(found, key=lambda e: e.name):
+            if entry.is_dir() and not entry.name.startswith("."):
+                walk(entry.path, depth + 1)
+
+    if only_dir is None:
+        walk(rule.source_dir, 0)
+        return listing
+
+    relative: str = os.path.relpath(only_dir, rule.source_dir)
+    parts: [str] = [] if relative == "." else relative.split(os.sep)
+    if len(parts) == rule.depth and not any(p == ".." or p.startswith(".") for p in parts):
+        walk(os.path.join(rule.source_dir, *parts), rule.depth)
+    return listing
+
+
+def _is_ready(rule: MoveRule, file_name: str, file_names: [str], stem_counts: coll.Counter) -> bool:
+    if rule.ready == READY_ONLY_FILE:
+        return len(file_names) == 1
+    if rule.ready == READY_ONLY_STEM:
+        return stem_counts[os.path.splitext(file_name)[0]] == 1
+    return True
+
+
+def plan_moves(rule: MoveRule, only_dir: str = None) -> [MoveTask]:
+    """ Moves of the ready files of RULE, only those in ONLY_DIR if given. """
+    tasks: [MoveTask] = []
+    for dir_name, file_names in snapshot(rule, only_dir).items():
+        stem_counts: coll.Counter = msu.count_by_stem(file_names)
+        for fn in fnmatch.filter(file_names, rule.pattern):
+            if fn.startswith(".") or not _is_ready(rule, fn, file_names, stem_counts):
+                continue
+
+            year: str = year_of(fn)
+            if rule.year_dirs is not None:
+                if year not in rule.year_dirs:
+                    log.warning(f"{rule.name}: no directory for {year}. Leaving {fn} where it is.")
+                    print(f"{msu.Color.YELLOW}No directory for {year}.{msu.Color.END} Skipping {fn}.")
+                    continue
+                dest_dir: str = rule.year_dirs[year]
+            else:
+                dest_dir: str = os.path.normpath(os.path.join(rule.dest_dir,
+                                                              os.path.relpath(dir_name, rule.source_dir)
+                                                              ))
+
+            poster: (str, str) | None = None
+            if rule.posters is not None and year in rule.posters:
+                poster_ext: str = os.path.splitext(rule.posters[year])[1]
+                poster = (os.path.join(dest_dir, rule.posters[year]),
+                          os.path.join(dest_dir, f"{os.path.splitext(fn)[0]}{poster_ext}")
+                          )
+            tasks.append(MoveTask(rule, os.path.join(dir_name, fn), os.path.join(dest_dir, fn), poster))
+    return tasks
+
+
+def mount_of(path: str) -> int:
+    """ Device of the filesystem PATH is (or will be) on. """
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except FileNotFoundError:
+            parent: str = os.path.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+
+def transfer(task: MoveTask) -> None:
+    dest_dir: str = os.path.dirname(task.dest)
+    os.makedirs(dest_dir, exist_ok=True)
+    if task.poster is not None:
+        msu.default_poster_store().place(*task.poster)
+
+    # COPY UNDER A HIDDEN NAME SO PLEX NEVER PICKS UP HALF A VIDEO.
+    partial: str = os.path.join(dest_dir, f".{os.path.basename(task.dest)}.{os.getpid()}.tmp")
+    try:
+        msu.move_file(task.source, partial)
+    except BaseException:
+        if os.path.lexists(partial):
+            os.unlink(partial)
+        raise
+    os.rename(partial, task.dest)
+
+    source_dir: str = os.path.dirname(task.source)
+    if task.rule.ready == READY_ONLY_FILE and os.path.abspath(source_dir) != os.path.abspath(task.rule.source_dir):
+        try:
+            os.rmdir(source_dir)
+        except OSError as e:
+            log.warning(f"Could not remove {source_dir}. {e}")
+
+
+def move_media(rules: [MoveRule], per_mount: int = TRANSFERS_PER_MOUNT, only_dir: str = None) -> int:
+    """ Move every finished recording matched by RULES.  Each destination
+        mount has its own lane of PER_MOUNT transfers, so copies to
+        different NAS volumes run side by side.  Returns the number moved.
+        ONLY_DIR (e.g. a directory a DirectoryWatcher found settled) limits
+        the moves to files directly in it.  Other directories may still be
+        being written.
+    """
+    tasks: [MoveTask] = []
+    for rule in rules:
+        tasks += plan_moves(rule, only_dir)
+    if len(tasks) == 0:
+        return 0
+
+    lanes: dict = coll.defaultdict(list)
+    for task in tasks:
+        lanes[mount_of(os.path.dirname(task.dest))].append(task)
+    log.info(f"Moving {len(tasks)} files to {len(lanes)} mounts, {per_mount} at a time per mount.")
+
+    moved: int = 0
+    pools: [cf.ThreadPoolExecutor] = [cf.ThreadPoolExecutor(max_workers=per_mount, thread_name_prefix=f"mount-{dev}")
+                                      for dev in lanes]
+    try:
+        futures: dict = {}
+        for pool, lane in zip(pools, lanes.values()):
+            for task in lane:
+                futures[pool.submit(transfer, task)] = task
+
+        for future in cf.as_completed(futures):
+            task: MoveTask = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                log.error(f"Moving {task.source} failed.")
+                log.exception(e)
+                print(f"Error moving {task.source}. {msu.Color.RED}{e}{msu.Color.END}")
+                continue
+            moved += 1
+            log.info(f"Moved {task.source} to {task.dest}.")
+            print(f"Moved {os.path.basename(task.source)} to {os.path.dirname(task.dest)} ... COMPLETE")
+    finally:
+        for pool in pools:
+            pool.shutdown(wait=True)
+
+    return moved
@@ -0,0 +1,216 @@
+import datetime as dt
+import json
+import logging as log
+import os
+import socket
+import sys
+import time
+
+import msutils as msu
+
+RENDER_HZ: float = 2.0
+JSON_HZ: float = 1.0
+# WITHOUT A TERMINAL, PRINT A PLAIN PROGRESS LINE THIS OFTEN (SECONDS).
+NO_TTY_INTERVAL: float = 60.0
+UNIX_SOCKET_PREFIX: str = "unix:"
+SOCKET_RETRY_INTERVAL: float = 30.0
+
+render_hz: float = RENDER_HZ
+# None MEANS RENDER ONLY WHEN stdout IS A TERMINAL.
+render_to_terminal: bool | None = None
+json_target: str | None = None
+
+# ONE SINK PER PROCESS.  OPENED LAZILY SO FORKED WORKERS GET THEIR OWN.
+_sink = None
+_sink_pid: int = 0
+
+
+def configure_progress(hz: float = None, json_to: str = None, terminal: bool = None) -> None:
+    """ HZ limits terminal updates per second.  JSON_TO is a file name or
+        unix:/path/to/socket that receives one json record per line.
+        TERMINAL forces \\r-style rendering on or off.
+    """
+    global render_hz, json_target, render_to_terminal, _sink_pid
+
+    if hz is not None:
+        if hz <= 0:
+            raise msu.MediaServerUtilityException(f"Progress rate must be positive, not {hz:g}.")
+        render_hz = hz
+    if json_to is not None:
+        json_target = json_to
+        _sink_pid = 0
+    if terminal is not None:
+        render_to_terminal = terminal
+
+
+class JsonProgressSink:
+    """ Newline-delimited json progress records written to a file or a unix
+        domain socket.  Socket errors drop records rather than stop a job.
+    """
+    def __init__(self, target: str):
+        self.target: str = target
+        self.file = None
+        self.sock: socket.socket | None = None
+        self.next_connect: float = 0.0
+
+        if not target.startswith(UNIX_SOCKET_PREFIX):
+            self.file = open(target, "a", buffering=1)
+
+    def _connect(self) -> bool:
+        if time.monotonic() < self.next_connect:
+            return False
+        try:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(self.target[len(UNIX_SOCKET_PREFIX):])
+            return True
+        except OSError as e:
+            log.warning(f"Cannot connect to progress socket {self.target}. {e}")
+            self.sock = None
+            self.next_connect = time.monotonic() + SOCKET_RETRY_INTERVAL
+            return False
+
+    def write(self, record: dict) -> None:
+        line: str = json.dumps(record) + "\n"
+        if self.file is not None:
+            self.file.write(line)
+            return
+
+        if self.sock is None and not self._connect():
+            return
+        try:
+            self.sock.sendall(line.encode("UTF-8"))
+        except OSError as e:
+            log.warning(f"Lost connection to progress socket {self.target}. {e}")
+            self.sock.close()
+            self.sock = None
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+        if self.sock is not None:
+            self.sock.close()
+
+
+def progress_sink() -> JsonProgressSink | None:
+    global _sink, _sink_pid
+
+    if _sink_pid != os.getpid():
+        _sink_pid = os.getpid()
+        _sink = None
+        if json_target is not None:
+            try:
+                _sink = JsonProgressSink(json_target)
+            except OSError as e:
+                log.warning(f"Cannot open progress file {json_target}. {e}")
+
+    return _sink
+
+
+class ProgressReporter:
+    """ Reports the progress of one stage (transcode, search, ...) of one
+        file.  Terminal output is throttled to render_hz and skipped when
+        there is no terminal.  Records also go to the json sink if one is
+        configured.
+    """
+    def __init__(self, file_name: str, stage: str, duration: float = 0.0, expected_seconds: float = None):
+        self.file_name: str = file_name
+        self.stage: str = stage
+        self.duration: float = duration
+        # HOW LONG THE THROUGHPUT HISTORY SAYS THIS SHOULD TAKE.  None IF UNKNOWN.
+        self.expected_seconds: float | None = expected_seconds
+        self.start_ts: dt.datetime = dt.datetime.now()
+        self.position: float = 0.0
+        self.speed: float | None = None
+
+        self.to_terminal: bool = sys.stdout.isatty() if render_to_terminal is None else render_to_terminal
+        self.next_render: float = 0.0
+        self.next_plain: float = time.monotonic() + NO_TTY_INTERVAL
+        self.next_json: float = 0.0
+
+    def percent(self) -> float | None:
+        if self.duration <= 0:
+            return None
+        return min(100.0, 100 * self.position / self.duration)
+
+    def eta(self) -> float | None:
+        """ Seconds left.  Extrapolating from the time taken so far is poor
+            early on, so until then it leans on the expected time.
+        """
+        progress: float | None = self.percent()
+        elapsed: float = (dt.datetime.now() - self.start_ts).total_seconds()
+        predicted: float | None = None
+        if self.expected_seconds is not None:
+            predicted = max(0.0, self.expected_seconds - elapsed)
+        if progress is None or progress <= 0:
+            return predicted
+
+        extrapolated: float = elapsed * (100.0 - progress) / progress
+        if predicted is None:
+            return extrapolated
+        weight: float = progress / 100.0
+        return weight * extrapolated + (1.0 - weight) * predicted
+
+    def record(self, state: str) -> dict:
+        return {"ts": time.time(),
+                "host": socket.gethostname(),
+                "pid": os.getpid(),
+                "file": self.file_name,
+                "stage": self.stage,
+                "state": state,
+                "position": round(self.position, 3),
+                "duration": round(self.duration, 3),
+                "percent": None if self.percent() is None else round(self.percent(), 2),
+                "speed": self.speed,
+                "eta": None if self.eta() is None else round(self.eta(), 1),
+                }
+
+    def _render(self) -> None:
+        if self.duration > 0 and self.position > 0:
+            percent_progress = msu.pretty_progress_with_timer(self.start_ts, self.position, self.duration, self.eta())
+            print(f"    {self.stage}: {msu.Color.BOLD}{msu.Color.GREEN}{percent_progress}{msu.Color.END}    ",
+                  end="\r", flush=True
+                  )
+        else:
+            print(f"    {self.stage}: {msu.Color.BOLD}{msu.Color.CYAN}{self.position:,.1f}{msu.Color.END}    ",
+                  end="\r", flush=True
+                  )
+
+    def _plain(self) -> None:
+        percent: float | None = self.percent()
+        done: str = f"{self.position:,.1f}s" if percent is None else f"{percent:.1f}%"
+        print(f"{self.stage} {self.file_name}: {done}", flush=True)
+
+    def update(self, position: float, speed: float = None) -> None:
+        self.position = position
+        self.speed = speed
+        now: float = time.monotonic()
+
+        if self.to_terminal:
+            if now >= self.next_render:
+                self.next_render = now + 1.0 / render_hz
+                self._render()
+        elif now >= self.next_plain:
+            self.next_plain = now + NO_TTY_INTERVAL
+            self._plain()
+
+        sink: JsonProgressSink | None = progress_sink()
+        if sink is not None and now >= self.next_json:
+            self.next_json = now + 1.0 / JSON_HZ
+            sink.write(self.record("running"))
+
+    def complete(self) -> None:
+        if self.duration > 0:
+            self.position = self.duration
+            percent_progress = msu.pretty_progress(self.duration, self.duration)
+            print(f"    {msu.Color.GREEN}Complete: {msu.Color.BOLD}{percent_progress}{msu.Color.END}          ")
+        else:
+            print(f"    {self.stage}: {msu.Color.BOLD}{msu.Color.CYAN}{self.position:,.1f}{msu.Color.END}    ")
+
+        sink: JsonProgressSink | None = progress_sink()
+        if sink is not None:
+            sink.write(self.record("complete"))
+
+    def failed(self) -> None:
+        sink: JsonProgressSink | None = progress_sink()
+        if sink is not None:
+            sink.write(self.record("failed"))
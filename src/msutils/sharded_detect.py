@@ -0,0 +1,157 @@
+import collections as coll
+import concurrent.futures as cf
+import logging as log
+import threading
+
+import msutils as msu
+
+# EACH SHARD READS THIS FAR INTO THE NEXT ONE, SO A FREEZE OR SILENCE SHORTER
+# THAN THIS THAT STARTS NEAR ITS END IS STILL SEEN WHOLE BY ONE SHARD.
+DETECT_SHARD_OVERLAP: float = 60.0
+# SEEKING, PROBING AND FILTER START-UP ARE NOT WORTH PAYING FOR SHORTER SHARDS.
+MIN_SHARD_SECONDS: float = 600.0
+
+# start AND end ARE THE TIMES READ (-ss/-to).  end IS None FOR THE LAST SHARD, WHICH READS TO THE END.
+DetectShard = coll.namedtuple("DetectShard", "start end")
+
+
+def shard_count(duration: float, shards: int) -> int:
+    """ Number of shards DURATION seconds are actually split into. """
+    return max(1, min(shards, int(duration // MIN_SHARD_SECONDS)))
+
+
+def detect_detail(duration: float, shards: int) -> str:
+    """ Throughput history detail of a search with SHARDS.  A single pass has none. """
+    count: int = shard_count(duration, shards)
+    return "" if count == 1 else f"{count} shards"
+
+
+def shard_windows(duration: float, shards: int, overlap: float = DETECT_SHARD_OVERLAP) -> [DetectShard]:
+    count: int = shard_count(duration, shards)
+    # ROUNDED TO WHAT IS PASSED TO ffmpeg, SO SHIFTING ITS TIMES BY start IS EXACT.
+    bounds: [float] = [round(duration * i / count, 6) for i in range(count)]
+    return [DetectShard(start, bounds[i + 1] + overlap if i + 1 < count else None) for i, start in enumerate(bounds)]
+
+
+def shard_thread_args(shards: int) -> [str]:
+    """ Share this job's cores between the shards searched at the same time. """
+    if msu.current_workspace is None or msu.current_workspace.thread_count() == 0:
+        return []
+    return ["-threads", f"{max(1, msu.current_workspace.thread_count() // shards)}"]
+
+
+def search_shard(ffmpeg_program: str,
+                 file_name: str,
+                 shard: DetectShard,
+                 thread_args: [str],
+                 on_progress=None
+                 ) -> (msu.MovieSections, msu.MovieSections):
+    """ Freezes and silences (in whole-file time) found in one shard. """
+    ffmpeg_args: [str] = ["nice",
+                          ffmpeg_program,
+                          *thread_args,
+                          "-ss", f"{shard.start:.6f}",
+                          *([] if shard.end is None else ["-to", f"{shard.end:.6f}"]),
+                          "-i", file_name,
+                          "-vf", msu.FREEZE_DETECT_FILTER,
+                          "-map", "0:v:0",
+                          "-af", msu.SILENCE_DETECT_FILTER,
+                          "-map", "0:a:0?",
+                          "-f", "null",
+                          "-",
+                          ]
+    finder: msu.FreezeAndSilenceFinder = msu.FreezeAndSilenceFinder(file_name, shard.start)
+    runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, show_progress=False, file_name=file_name)
+    runner.add_line_handler(finder.handle_line)
+    if on_progress is not None:
+        runner.add_progress_handler(on_progress)
+    if runner.run() != 0:
+        raise msu.MediaServerUtilityException(f"An error occurred searching {file_name} from {shard.start:.1f} "
+                                              f"secs. Return code: {runner.returncode}"
+                                              )
+
+    if shard.end is not None:
+        # THE NEXT SHARD STARTS INSIDE WHATEVER WAS STILL GOING ON HERE.  THE TWO ARE JOINED BY stitch.
+        finder.close_open_sections(shard.end)
+    return finder.found_video_freezes, finder.found_silences
+
+
+def stitch(file_name: str, found: [(msu.MovieSections, msu.MovieSections)]) -> msu.MovieSections:
+    """ Join the freezes and silences of every shard into the freezes AND
+        silences of the whole file.  Sections seen by two shards overlap,
+        so each becomes a single section again.
+    """
+    freezes: msu.MovieSections = msu.MovieSections(file_name, "video")
+    silences: msu.MovieSections = msu.MovieSections(file_name, "audio")
+    for shard_freezes, shard_silences in found:
+        freezes = freezes | shard_freezes
+        silences = silences | shard_silences
+
+    # THE SAME COMMENTS A SINGLE PASS GIVES, NOT ONE PER SHARD THAT SAW THE SECTION.
+    freezes = msu.MovieSections.from_sorted(file_name,
+                                            [s._replace(comment=f"{s.start}-{s.end}") for s in freezes.section_list],
+                                            "video"
+                                            )
+    silences = msu.MovieSections.from_sorted(file_name,
+                                             [s._replace(comment=f"{s.start}-{s.end}") for s in silences.section_list],
+                                             "audio"
+                                             )
+    return freezes & silences
+
+
+def search_shards(ffmpeg_program: str,
+                  file_name: str,
+                  windows: [DetectShard],
+                  jobs: int,
+                  duration: float,
+                  expected_seconds: float = None
+                  ) -> [(msu.MovieSections, msu.MovieSections)]:
+    """ search_shard each of WINDOWS, JOBS at a time, reporting combined progress. """
+    thread_args: [str] = shard_thread_args(min(jobs, len(windows)))
+    # OVERLAPS ARE READ TWICE.  PROGRESS IS OUT OF EVERYTHING READ.
+    total: float = sum((duration if w.end is None else min(w.end, duration)) - w.start for w in windows)
+    reporter: msu.ProgressReporter = msu.ProgressReporter(file_name, "Searching", total, expected_seconds)
+    positions: dict = {}
+    lock: threading.Lock = threading.Lock()
+
+    def progress_for(shard: DetectShard):
+        def on_progress(record: dict) -> None:
+            current: float | None = msu.progress_seconds(record)
+            if current is None:
+                return
+            with lock:
+                positions[shard] = current
+                reporter.update(sum(positions.values()))
+        return on_progress
+
+    # EACH SHARD IS SEARCHED BY ITS OWN ffmpeg PROCESS.  THE THREADS ONLY WAIT ON THEM.
+    with cf.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures: [cf.Future] = [pool.submit(search_shard, ffmpeg_program, file_name, w, thread_args, progress_for(w))
+                                for w in windows]
+        try:
+            found: list = [f.result() for f in futures]
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            reporter.failed()
+            raise
+
+    reporter.complete()
+    return found
+
+
+def find_freezes_sharded(ffmpeg_program: str,
+                         file_name: str,
+                         duration: float,
+                         shards: int,
+                         expected_seconds: float = None
+                         ) -> msu.MovieSections:
+    """ Times when the picture of FILE_NAME is frozen and the sound silent,
+        searching SHARDS overlapping pieces of it at the same time.  Finds
+        the same sections as a single pass over the whole file.
+    """
+    windows: [DetectShard] = shard_windows(duration, shards)
+    log.info(f"Searching {file_name} as {len(windows)} shards.")
+    return stitch(file_name, search_shards(ffmpeg_program, file_name, windows, len(windows), duration,
+                                           expected_seconds
+                                           ))
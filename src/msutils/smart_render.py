@@ -0,0 +1,232 @@
+import collections as coll
+import logging as log
+import os
+import shutil as sh
+
+import msutils as msu
+
+SMART_RENDER_DIR: str = "smart-render"
+PIECE_LIST_FILE: str = "pieces.txt"
+STREAM_LIST_FILE: str = "kept-streams.txt"
+SPLICED_VIDEO_FILE: str = "spliced-video.mkv"
+KEPT_STREAMS_FILE: str = "kept-streams.mkv"
+# A STRETCH BETWEEN KEY FRAMES SHORTER THAN THIS IS RE-ENCODED WITH ITS NEIGHBOURS.
+MIN_COPY_SECONDS: float = 1.0
+# THE SPLICED AUDIO MAY END THIS MUCH AWAY FROM THE SPLICED VIDEO PER KEPT SECTION: ONE AUDIO PACKET.
+MAX_DRIFT_PER_CUT: float = 0.05
+# SEEKING A COPY TO JUST PAST ITS KEY FRAME LANDS ON IT, WHATEVER THE ROUNDING.  ENDING AN ENCODE
+# JUST BEFORE A KEY FRAME KEEPS IT OUT, SINCE THE COPY THAT FOLLOWS STARTS WITH IT.
+KEY_FRAME_SLACK: float = 0.001
+
+# ONE PIECE OF THE VIDEO.  copy IS True FOR KEY FRAME TO KEY FRAME STRETCHES, WHICH ARE NOT RE-ENCODED.
+RenderPiece = coll.namedtuple("RenderPiece", "start end copy")
+
+
+def plan_pieces(index: msu.KeyFrameIndex, kept: [msu.MovieSection]) -> [RenderPiece]:
+    """ Split each of KEPT into the partial GOP before its first clean key
+        frame, the GOPs that can be copied and the partial GOP after its last
+        one.  Copies start and end only at clean key frames: the leading
+        pictures of an open GOP (libx265 writes them by default) refer to
+        frames that are re-encoded or cut.
+    """
+    pieces: [RenderPiece] = []
+    for sect in kept:
+        first_key: float | None = index.next_after(sect.start, clean=True)
+        last_key: float | None = index.previous_before(sect.end, clean=True)
+        if first_key is None or last_key is None or last_key - first_key < MIN_COPY_SECONDS:
+            pieces.append(RenderPiece(sect.start, sect.end, False))
+            continue
+
+        if first_key > sect.start:
+            pieces.append(RenderPiece(sect.start, first_key, False))
+        pieces.append(RenderPiece(first_key, last_key, True))
+        if sect.end > last_key:
+            pieces.append(RenderPiece(last_key, sect.end, False))
+    return pieces
+
+
+def pix_fmt_args(probe: msu.MediaProbe) -> [str]:
+    """ Re-encoded pieces must match the bit depth and chroma of the copied ones. """
+    for stream in probe.ffprobe_data.get("streams", []):
+        if stream.get("codec_type") == "video":
+            return [] if stream.get("pix_fmt") is None else ["-pix_fmt", stream["pix_fmt"]]
+    return []
+
+
+def render_piece(ffmpeg_program: str, source: str, piece: RenderPiece, video_args: [str], output: str) -> None:
+    if piece.copy:
+        # dump_extra PUTS THE PARAMETER SETS IN EACH KEY FRAME, SO THE DECODER PICKS THEM UP AGAIN AFTER
+        # THE RE-ENCODED PIECE BEFORE IT.
+        start: float = piece.start + KEY_FRAME_SLACK
+        end: float = piece.end
+        codec_args: [str] = ["-c:v", "copy", "-bsf:v", "dump_extra", "-avoid_negative_ts", "make_zero"]
+    else:
+        start: float = piece.start
+        end: float = piece.end - KEY_FRAME_SLACK
+        codec_args: [str] = video_args
+
+    ffmpeg_args: [str] = ["nice",
+                          ffmpeg_program,
+                          "-y",
+                          "-ss", f"{start:.6f}",
+                          "-to", f"{end:.6f}",
+                          "-i", source,
+                          "-map", "0:v:0",
+                          *codec_args,
+                          output,
+                          ]
+    runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, show_progress=False, file_name=source)
+    if runner.run() != 0:
+        raise msu.MediaServerUtilityException(f"An error occurred rendering {source} from {piece.start:.2f} to "
+                                              f"{piece.end:.2f} secs. Return code: {runner.returncode}"
+                                              )
+
+
+def concat_copy(ffmpeg_program: str, list_file: str, maps: [str], output: str) -> None:
+    ffmpeg_args: [str] = ["nice",
+                          ffmpeg_program,
+                          "-y",
+                          "-safe", "0",
+                          "-f", "concat",
+                          "-i", list_file,
+                          *maps,
+                          "-c", "copy",
+                          output,
+                          ]
+    runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, show_progress=False, file_name=output)
+    if runner.run() != 0:
+        raise msu.MediaServerUtilityException(f"An error occurred joining {list_file}. " +
+                                              f"Return code: {runner.returncode}"
+                                              )
+
+
+def cut_streams_of(ffmpeg_program: str, source: str, sect: msu.MovieSection, start_time: float, output: str) -> None:
+    """ Stream copy the audio and subtitles of SECT.  The input seek lands on
+        the video key frame before SECT, so the packets up to its start are
+        dropped by the output seek, which with -copyts is in source time.
+    """
+    ffmpeg_args: [str] = ["nice",
+                          ffmpeg_program,
+                          "-y",
+                          "-ss", f"{sect.start:.6f}",
+                          "-copyts",
+                          "-i", source,
+                          "-ss", f"{start_time + sect.start:.6f}",
+                          "-to", f"{start_time + sect.end:.6f}",
+                          "-map", "0:a?",
+                          "-map", "0:s?",
+                          "-c", "copy",
+                          output,
+                          ]
+    runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, show_progress=False, file_name=source)
+    if runner.run() != 0:
+        raise msu.MediaServerUtilityException(f"An error occurred cutting the audio of {source} from "
+                                              f"{sect.start:.2f} to {sect.end:.2f} secs. "
+                                              f"Return code: {runner.returncode}"
+                                              )
+
+
+def cut_other_streams(ffmpeg_program: str,
+                      source: str,
+                      kept: [msu.MovieSection],
+                      start_time: float,
+                      work_dir: str
+                      ) -> str:
+    """ Stream copy the kept parts of the audio and subtitles of SOURCE, each
+        on its own, and join them.  Audio packets are all key frames, so each
+        cut is accurate to a packet.
+    """
+    list_file: str = os.path.join(work_dir, STREAM_LIST_FILE)
+    with open(list_file, "w") as fd:
+        for idx, sect in enumerate(kept):
+            sect_file: str = os.path.join(work_dir, f"streams-{idx:04d}.mkv")
+            cut_streams_of(ffmpeg_program, source, sect, start_time, sect_file)
+            fd.write(f"file '{os.path.abspath(sect_file)}'\n")
+
+    output: str = os.path.join(work_dir, KEPT_STREAMS_FILE)
+    concat_copy(ffmpeg_program, list_file, ["-map", "0:a?", "-map", "0:s?"], output)
+    return output
+
+
+def check_drift(source: str, video_file: str, streams_file: str, cuts: int) -> None:
+    """ The spliced audio must last as long as the spliced video, or the
+        sound of the cut movie drifts away from its picture.
+    """
+    streams: msu.MediaProbe = msu.MediaProbe.probe(streams_file, use_cache=False)
+    if not any(s.codec_type == "audio" for s in streams.streams):
+        return
+    video: msu.MediaProbe = msu.MediaProbe.probe(video_file, use_cache=False)
+    drift: float = streams.duration - video.duration
+    log.debug(f"Spliced audio of {source} is {drift:+.3f} secs off its video.")
+    if abs(drift) > cuts * MAX_DRIFT_PER_CUT:
+        raise msu.MediaServerUtilityException(f"The spliced audio of {source} lasts {streams.duration:.3f} secs, "
+                                              f"its video {video.duration:.3f} secs."
+                                              )
+
+
+def smart_render(ffmpeg_program: str,
+                 gaps: msu.MovieSections,
+                 output_file_name: str,
+                 video_args: [str],
+                 probe: msu.MediaProbe
+                 ) -> None:
+    """ Remove GAPS from their movie with frame accurate cuts at close to the
+        cost of a remux.  Only the partial GOPs at each cut are re-encoded
+        (with VIDEO_ARGS, which must produce the movie's video codec).  The
+        rest of the video, the audio and the subtitles are copied.
+    """
+    source: str = gaps.file_name
+    kept: [msu.MovieSection] = gaps.kept_sections(probe.duration)
+    if len(kept) == 0:
+        raise msu.MediaServerUtilityException(f"Nothing is left of {source} once its gaps are cut.")
+    pieces: [RenderPiece] = plan_pieces(msu.KeyFrameIndex.for_file(source), kept)
+    encoded_secs: float = sum(p.end - p.start for p in pieces if not p.copy)
+    log.info(f"Smart rendering {source}: {len(pieces)} pieces, {encoded_secs:,.1f} of "
+             f"{sum(s.end - s.start for s in kept):,.1f} secs re-encoded."
+             )
+
+    work_dir: str = msu.work_path(SMART_RENDER_DIR)
+    os.makedirs(work_dir, exist_ok=True)
+    reporter: msu.ProgressReporter = msu.ProgressReporter(source, "Cutting", sum(p.end - p.start for p in pieces))
+    encode_args: [str] = [*video_args, *pix_fmt_args(probe)]
+    try:
+        piece_files: [str] = []
+        done_secs: float = 0.0
+        for idx, piece in enumerate(pieces):
+            piece_file: str = os.path.join(work_dir, f"piece-{idx:04d}.mkv")
+            render_piece(ffmpeg_program, source, piece, encode_args, piece_file)
+            piece_files.append(piece_file)
+            done_secs += piece.end - piece.start
+            reporter.update(done_secs)
+
+        list_file: str = os.path.join(work_dir, PIECE_LIST_FILE)
+        with open(list_file, "w") as fd:
+            for piece_file in piece_files:
+                fd.write(f"file '{os.path.abspath(piece_file)}'\n")
+        video_file: str = os.path.join(work_dir, SPLICED_VIDEO_FILE)
+        concat_copy(ffmpeg_program, list_file, ["-map", "0:v:0"], video_file)
+        streams_file: str = cut_other_streams(ffmpeg_program, source, kept, probe.start_time, work_dir)
+        check_drift(source, video_file, streams_file, len(kept))
+
+        ffmpeg_args: [str] = ["nice",
+                              ffmpeg_program,
+                              "-y",
+                              "-i", video_file,
+                              "-i", streams_file,
+                              "-map", "0:v:0",
+                              "-map", "1:a?",
+                              "-map", "1:s?",
+                              "-c", "copy",
+                              output_file_name,
+                              ]
+        runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, show_progress=False, file_name=source)
+        if runner.run() != 0:
+            raise msu.MediaServerUtilityException(f"An error occurred joining the pieces of {source}. " +
+                                                  f"Return code: {runner.returncode}"
+                                                  )
+    except BaseException:
+        reporter.failed()
+        raise
+    finally:
+        sh.rmtree(work_dir, ignore_errors=True)
+    reporter.complete()
@@ -0,0 +1,108 @@
+import concurrent.futures as cf
+import logging as log
+import logging.handlers as logh
+import multiprocessing as mp
+import os
+import typing as typ
+
+import msutils as msu
+
+# CORES RESERVED FOR THE WORKER PROCESS.  SET ONCE BY THE POOL INITIALIZER.
+worker_cores: [int] = []
+
+
+def partition_cores(jobs: int, cores_per_job: int) -> [[int]]:
+    """ Split the cores this process may use into one list per job.  An
+        empty list means the job is not pinned to specific cores.
+    """
+    if cores_per_job <= 0:
+        return [[] for _ in range(jobs)]
+
+    available: [int] = sorted(os.sched_getaffinity(0))
+    if jobs * cores_per_job > len(available):
+        log.warning(f"{jobs} jobs x {cores_per_job} cores exceeds the {len(available)} cores available. "
+                    f"Cores will be shared."
+                    )
+
+    partitions: [[int]] = []
+    for job in range(jobs):
+        first: int = job * cores_per_job
+        partitions.append(sorted({available[(first + i) % len(available)] for i in range(cores_per_job)}))
+    return partitions
+
+
+def _init_worker(log_queue: mp.Queue, core_queue: mp.Queue) -> None:
+    global worker_cores
+
+    # SEND ALL LOG RECORDS TO THE PARENT SO ONLY ONE PROCESS WRITES THE LOG FILE.
+    root = log.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logh.QueueHandler(log_queue))
+
+    worker_cores = core_queue.get()
+    if len(worker_cores) > 0:
+        # CHILD PROCESSES (ffmpeg, x265) INHERIT THE AFFINITY.
+        os.sched_setaffinity(0, worker_cores)
+    log.debug(f"Worker {os.getpid()} started. Cores: {worker_cores or 'all'}")
+
+
+def _run_job(job_func: typ.Callable[[str], typ.Any], file_name: str, scratch_root: str) -> typ.Any:
+    with msu.JobWorkspace(scratch_root, worker_cores) as workspace:
+        msu.set_workspace(workspace)
+        try:
+            return job_func(file_name)
+        finally:
+            msu.set_workspace(None)
+
+
+def run_jobs(job_func: typ.Callable[[str], typ.Any],
+             file_names: typ.Iterable[str],
+             jobs: int,
+             scratch_root: str = None,
+             cores_per_job: int = 0,
+             on_done: typ.Callable[[str, typ.Any], None] = None
+             ) -> None:
+    """ Run JOB_FUNC once for each file using a pool of JOBS processes.  Every
+        job runs inside its own JobWorkspace under SCRATCH_ROOT.  FILE_NAMES
+        is consumed as jobs free up, so it may still be growing.  ON_DONE is
+        called (in this process) with the file name and JOB_FUNC's result
+        for each job that did not raise.
+    """
+    log_queue: mp.Queue = mp.Queue()
+    core_queue: mp.Queue = mp.Queue()
+    for cores in partition_cores(jobs, cores_per_job):
+        core_queue.put(cores)
+
+    def finish(done: set) -> None:
+        for future in done:
+            file_name: str = futures.pop(future)
+            try:
+                result: typ.Any = future.result()
+            except Exception as e:
+                log.error(f"Job for {file_name} failed.")
+                log.exception(e)
+                print(f"Error processing {file_name}. {msu.Color.RED}{e}{msu.Color.END}")
+                continue
+            if on_done is not None:
+                on_done(file_name, result)
+
+    futures: dict = {}
+    listener = logh.QueueListener(log_queue, *log.getLogger().handlers, respect_handler_level=True)
+    listener.start()
+    try:
+        with cf.ProcessPoolExecutor(max_workers=jobs,
+                                    initializer=_init_worker,
+                                    initargs=(log_queue, core_queue)
+                                    ) as pool:
+            for fn in file_names:
+                # KEEP ONE JOB QUEUED PER WORKER.  THE REST OF THE LIST MAY NOT EXIST YET.
+                if len(futures) >= 2 * jobs:
+                    done, _ = cf.wait(futures, return_when=cf.FIRST_COMPLETED)
+                    finish(done)
+                futures[pool.submit(_run_job, job_func, fn, scratch_root)] = fn
+            while len(futures) > 0:
+                done, _ = cf.wait(futures, return_when=cf.FIRST_COMPLETED)
+                finish(done)
+    finally:
+        listener.stop()
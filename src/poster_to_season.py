@@ -1,7 +1,8 @@
 import logging as log
 import optparse as op
 import os
-import shutil
+
+import msutils as msu
 
 if "__main__" == __name__:
     # SETUP LOGGER BEFORE IMPORTS SO THEY CAN USE THESE SETTINGS
@@ -23,8 +24,17 @@ def parse_command_line() -> op.Values:
                       dest="season_dir",
                       help="Directory the videos for the season are located."
                       )
+    parser.add_option("-r", "--repair",
+                      dest="repair_dir",
+                      help="Replace duplicate posters anywhere under this directory with links to one copy."
+                      )
     options, _ = parser.parse_args()
 
+    if options.repair_dir:
+        if not os.path.isdir(options.repair_dir):
+            parser.error(f"Cannot find directory {options.repair_dir}.")
+        return options
+
     if not options.poster_file:
         parser.error("Filename of poster is missing.")
     if not options.season_dir:
@@ -40,18 +50,28 @@ def parse_command_line() -> op.Values:
 
 def main() -> None:
     options: op.Values = parse_command_line()
+    store: msu.PosterStore = msu.default_poster_store()
+
+    if options.repair_dir:
+        print(f"Linking duplicate posters under {options.repair_dir} ...")
+        relinked, freed = store.repair(options.repair_dir)
+        print(f"    {relinked:,} posters relinked. {freed / (1024 * 1024):,.1f} MB freed.")
+        return
+
     dot_idx: int = options.poster_file.rfind(".")
     # FILE EXTENSION OF POSTER (INCLUDING THE PERIOD)
     poster_ext: str = options.poster_file[dot_idx:]
 
+    poster_paths: [str] = []
     for file_name in sorted(os.listdir(options.season_dir)):
         if file_name.endswith(".mp4") or file_name.endswith(".mkv"):
-            print(f"Copying poster for {file_name}")
+            print(f"Linking poster for {file_name}")
             # build poster filename
             poster_file_name: str = f"{file_name[:-4]}{poster_ext}"
-            poster_full_path: str = os.path.join(options.season_dir, poster_file_name)
-            log.debug(f"Copying {options.poster_file} to {poster_full_path}.")
-            shutil.copyfile(options.poster_file, poster_full_path)
+            poster_paths.append(os.path.join(options.season_dir, poster_file_name))
+
+    # THE POSTER IS HASHED ONCE AND EVERY VIDEO GETS A LINK TO THE SAME COPY.
+    store.place_all(options.poster_file, poster_paths)
 
 
 if __name__ == "__main__":
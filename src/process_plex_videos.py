@@ -4,12 +4,27 @@ import optparse as op
 import os
 import shutil
 import sys
+import typing as typ
 
 import msutils as msu
-from remove_gaps import video_gap_removal
-from transcode_to_hevc import transcode
+from msutils.JobStore import STAGE_GAPS_DETECTED, STAGE_GAPS_REMOVED, STAGE_PROBED, STAGE_REPLACED, STAGE_STAGED, \
+    STAGE_TRANSCODED
+from remove_gaps import configure_cutting, configure_detection, find_commercials, find_freezes, \
+    predicted_detect_seconds, remove_gaps, COARSE_PADDING, DETECT_SHARDS, NO_GAPS_FIELD
+from msutils.ThroughputHistory import ORDER_DEADLINE, ORDER_SCAN, ORDERS, parse_deadline
+from transcode_to_hevc import can_cut_while_encoding, codecs_to_use, configure_chunking, encode_video, \
+    needs_transcode, planned_video_codec, predicted_transcode_seconds, \
+    stage_work_copy, use_chunks, CHUNK_JOBS, TRANSCODED_ATTRIBUTE, VIDEO_CODEC, WORK_FILE
 
 MAX_RETRIES: int = 10
+TRANSCODED_FILE: str = "transcoded"
+GAPS_REMOVED_FILE: str = "gaps-removed"
+SCANNER_NAME: str = "process_plex_videos"
+# FIND FREEZES AND SILENCES DURING THE TRANSCODE INSTEAD OF DECODING THE FILE A SECOND TIME.
+FUSED_GAP_DETECTION: bool = True
+# WHEN A FILE NEEDS BOTH, FIND ITS GAPS BEFORE THE TRANSCODE AND LEAVE THEM OUT OF IT, INSTEAD
+# OF WRITING THE WHOLE FILE AGAIN TO CUT THEM.  TAKES PRIORITY OVER FUSED_GAP_DETECTION.
+CUT_WHILE_TRANSCODING: bool = True
 
 if "__main__" == __name__:
     # SETUP LOGGER BEFORE IMPORTS SO THEY CAN USE THESE SETTINGS
@@ -21,7 +36,128 @@ if "__main__" == __name__:
     log.getLogger().setLevel(log.DEBUG)
 
 
-def process_single_file(file_name: str) -> None:
+def cuts_while_transcoding(vid_codec: str, probe: msu.MediaProbe) -> bool:
+    return CUT_WHILE_TRANSCODING and can_cut_while_encoding(vid_codec, probe)
+
+
+def run_stages(file_name: str, job: msu.FileJob, staged: msu.StagedFile = None) -> None:
+    """ Transcode FILE_NAME and remove its gaps working on local copies, one
+        recorded stage at a time.  The original is replaced once, at the end.
+        Stages finished by an earlier, interrupted run are not repeated.
+    """
+    extension: str = file_name[-4:]
+    probe: msu.MediaProbe | None = None
+
+    def probe_file() -> dict:
+        nonlocal probe
+        probe = msu.MediaProbe.probe(file_name)
+        return {"duration": probe.duration, "codecs": probe.codecs()}
+
+    job.run_stage(STAGE_PROBED, probe_file)
+    if probe is None:
+        # PROBED BY AN EARLIER RUN.  THE PROBE CACHE STILL HAS IT.
+        probe = msu.MediaProbe.probe(file_name)
+
+    codecs: tuple | None = codecs_to_use(file_name, probe)
+    find_gaps: bool = not msu.is_user_attribute_set_to_yes(file_name, NO_GAPS_FIELD)
+    if codecs is None and not find_gaps:
+        print(f"    {file_name} {msu.Color.BOLD}{msu.Color.DOUBLE_UNDERLINE}has already been processed"
+              f"{msu.Color.END}."
+              )
+        return
+
+    def stage() -> dict:
+        work_file_name: str = job.artifact_path(WORK_FILE, extension)
+        stage_work_copy(file_name, work_file_name, staged)
+        return msu.artifact_output(work_file_name)
+
+    work_file: str = job.run_stage(STAGE_STAGED, stage, msu.artifact_unchanged)["file"]
+    # FIND THE GAPS FIRST AND LEAVE THEM OUT OF THE ENCODE, SO THE FILE IS ONLY WRITTEN ONCE.
+    cut_first: bool = find_gaps and codecs is not None and cuts_while_transcoding(codecs[0], probe)
+
+    def detect_in(source: str, fused_gaps: typ.Optional[list]) -> typ.Callable[[], dict]:
+        def detect() -> dict:
+            try:
+                if fused_gaps is not None:
+                    log.info(f"Using gaps found during transcode of: {file_name}")
+                    freezes: msu.MovieSections = msu.MovieSections.from_list(source, fused_gaps)
+                else:
+                    log.info(f"Finding gaps in: {file_name}")
+                    print(f"{msu.Color.BOLD}{msu.Color.BLUE}Finding gaps{msu.Color.END} in: {file_name}")
+                    freezes: msu.MovieSections = find_freezes(source, probe.duration, probe)
+            except msu.MediaServerUtilityException:
+                # LOGGED ALREADY.  LEAVE THE FILE UNMARKED SO A LATER RUN TRIES AGAIN.
+                return {"gaps": None}
+            except UnicodeDecodeError:
+                # MARK FILE AS PROCESSED.
+                return {"gaps": []}
+
+            commercials: msu.MovieSections = msu.MovieSections.from_sorted(source,
+                                                                           find_commercials(probe).section_list
+                                                                           )
+            return {"gaps": (commercials | freezes).to_list()}
+        return detect
+
+    detected: dict = {"gaps": None}
+    if cut_first:
+        detected = job.run_stage(STAGE_GAPS_DETECTED, detect_in(work_file, None))
+
+    def transcode() -> dict:
+        if codecs is None:
+            return {"file": None, "gaps": None}
+        cuts: msu.MovieSections | None = None
+        if cut_first and detected["gaps"]:
+            cuts = msu.MovieSections.from_list(work_file, detected["gaps"])
+        cutting: str = "" if cuts is None else f", cutting {cuts.total_time():,.1f} seconds of gaps"
+        print(f"{msu.Color.BOLD}{msu.Color.BLUE}Transcoding{msu.Color.END} {file_name} to "
+              f"{codecs[0]}/{codecs[1]}/{codecs[2]}{cutting}."
+              )
+        output: str = job.artifact_path(TRANSCODED_FILE, extension)
+        freezes: msu.MovieSections | None = encode_video(file_name,
+                                                         work_file,
+                                                         output,
+                                                         codecs,
+                                                         probe,
+                                                         FUSED_GAP_DETECTION and find_gaps and not cut_first,
+                                                         cuts
+                                                         )
+        return msu.artifact_output(output, gaps=None if freezes is None else freezes.to_list())
+
+    transcoded: dict = job.run_stage(STAGE_TRANSCODED, transcode, msu.artifact_unchanged)
+    current: str = transcoded["file"] or work_file
+
+    if find_gaps and not cut_first:
+        detected = job.run_stage(STAGE_GAPS_DETECTED, detect_in(current, transcoded["gaps"]))
+
+        if detected["gaps"]:
+            def remove() -> dict:
+                output: str = job.artifact_path(GAPS_REMOVED_FILE, extension)
+                remove_gaps(msu.MovieSections.from_list(current, detected["gaps"]), output)
+                return msu.artifact_output(output)
+
+            current = job.run_stage(STAGE_GAPS_REMOVED, remove, msu.artifact_unchanged)["file"]
+    if detected["gaps"] is not None and len(detected["gaps"]) == 0:
+        log.info("Found no gaps to remove.")
+        print(f"    Found no gaps to remove in {file_name}.")
+
+    def replace() -> dict:
+        done_attrs: [str] = [*([TRANSCODED_ATTRIBUTE] if codecs is not None else []),
+                             *([NO_GAPS_FIELD] if detected["gaps"] is not None else []),
+                             ]
+        if current != work_file:
+            # THE NEW FILE IS MARKED BEFORE IT TAKES THE ORIGINAL'S PLACE.  AFTER A CRASH BEFORE THIS STAGE IS
+            # RECORDED, THE NEXT RUN SEES A CHANGED (SO ABANDONED) JOB, BUT ALSO A FILE THAT IS ALREADY DONE.
+            msu.replace_file(file_name, current, [TRANSCODED_ATTRIBUTE, NO_GAPS_FIELD], done_attrs)
+        else:
+            for attr in done_attrs:
+                msu.set_user_attribute_to_yes(file_name, attr)
+        return {"file": None}
+
+    job.run_stage(STAGE_REPLACED, replace)
+
+
+def process_single_file(file_name: str, staged: msu.StagedFile = None) -> bool:
+    """ Returns True if FILE_NAME was fully processed. """
     current_timestamp: dt.datetime = dt.datetime.now()
     print(f"{msu.Color.OVERLINE}{msu.Color.UNDERLINE}{msu.Color.BOLD}{current_timestamp.strftime('%m/%d/%Y')} "
           f"{msu.Color.BOLD}{msu.Color.PURPLE}{current_timestamp.strftime('%H:%M:%S')} "
@@ -33,13 +169,18 @@ def process_single_file(file_name: str) -> None:
 
     clean_file_name: str = msu.clean_file_name(file_name)
     shutil.move(file_name, clean_file_name)
+    store: msu.JobStore = msu.default_job_store()
     while not success and retry_count <= MAX_RETRIES:
+        # EACH RETRY (AND EACH RUN AFTER A CRASH) STARTS AT THE FIRST UNFINISHED STAGE.
+        job: msu.FileJob = store.begin(clean_file_name)
         try:
-            transcode(clean_file_name)
-            video_gap_removal(clean_file_name)
+            run_stages(clean_file_name, job, staged)
+            job.complete()
+            job.remove_artifacts()
             success = True
 
         except msu.MediaServerUtilityException as msue:
+            job.failed(str(msue))
             retry_count += 1
             log.error(msue)
             log.exception(msue)
@@ -49,25 +190,230 @@ def process_single_file(file_name: str) -> None:
                             f"Skipping to next.  This file will need to be reprocessed."
                             )
                 print(f"Error processing {clean_file_name}. {msu.Color.RED}GIVING UP{msu.Color.END}")
+                # A LATER RUN RESUMES THIS JOB, BUT REDOES ANY STAGE WHOSE FILE IS GONE.
+                job.remove_artifacts()
             else:
                 log.info(f"Received exception processing {clean_file_name}.  RETRY # {retry_count}")
                 print(f"\n    Error processing {file_name}.  " +
                       f"RETRY {msu.Color.BOLD}{msu.Color.PURPLE}#{retry_count}{msu.Color.END}"
                       )
 
+    return success
 
-def process_dir_tree(dir_name: str) -> None:
-    for (current_dir, dirs, files) in os.walk(dir_name):
-        dirs.sort()
-        for f in sorted(files):
-            if f.endswith(".mp4") or f.endswith(".mkv"):
-                full_path = os.path.join(current_dir, f)
-                process_single_file(full_path)
 
+def process_file_job(file_name: str) -> (bool, [dict]):
+    """ process_single_file in a worker process.  Its instrumentation spans
+        go back to the parent with the result.
+    """
+    return process_single_file(file_name), msu.take_spans()
 
-def main():
+
+def needs_processing(file_name: str) -> bool:
+    """ Whether FILE_NAME will be transcoded or searched for gaps.  Only those are worth prefetching. """
+    return not msu.is_user_attribute_set_to_yes(file_name, NO_GAPS_FIELD) or needs_transcode(file_name)
+
+
+def predicted_seconds(file_name: str) -> float:
+    """ Predicted time to transcode FILE_NAME and find its gaps. """
+    probe: msu.MediaProbe = msu.MediaProbe.probe(file_name)
+    vid_codec: typ.Optional[str] = planned_video_codec(file_name, probe)
+    seconds: float = 0.0 if vid_codec is None else predicted_transcode_seconds(probe, vid_codec)
+
+    if not msu.is_user_attribute_set_to_yes(file_name, NO_GAPS_FIELD):
+        # FUSED DETECTION COSTS NOTHING EXTRA, BUT ONLY RIDES ALONG WITH A WHOLE-FILE VIDEO ENCODE.
+        fused: bool = FUSED_GAP_DETECTION and vid_codec == VIDEO_CODEC and not use_chunks(vid_codec, probe)
+        if not fused or cuts_while_transcoding(vid_codec, probe):
+            seconds += predicted_detect_seconds(probe)
+    return seconds
+
+
+def process_dir_tree(dir_name: str,
+                     jobs: int = 1,
+                     scratch_dir: str = None,
+                     cores_per_job: int = 0,
+                     prefetch: int = msu.PREFETCH_DEPTH,
+                     rescan: bool = False,
+                     order: str = ORDER_SCAN,
+                     deadline: float = None,
+                     plan_only: bool = False
+                     ) -> None:
+    # ONLY NEW, CHANGED OR UNFINISHED FILES ARE FOUND.  WORK STARTS WHILE THE SCAN CONTINUES.
+    with msu.LibraryScanner(dir_name, SCANNER_NAME, rescan=rescan) as scanner:
+        def file_done(file_name: str, success: bool) -> None:
+            if success:
+                scanner.mark_done(msu.clean_file_name(file_name))
+
+        files: typ.Iterable[str] = scanner
+        if plan_only or order != ORDER_SCAN:
+            # ORDERING (OR PLANNING) NEEDS EVERY FILE AND ITS PREDICTED TIME BEFORE ANYTHING STARTS.
+            planned: [msu.PlannedJob] = msu.plan_files(scanner, predicted_seconds)
+            ordered: [msu.PlannedJob] = msu.order_jobs(planned, order, jobs, deadline)
+            if len(ordered) < len(planned):
+                log.info(f"{len(planned) - len(ordered)} files are not predicted to finish in time. Left for later.")
+                print(f"{len(planned) - len(ordered):,} files would not finish before the deadline. Left for later.")
+            if plan_only:
+                msu.print_plan(ordered, jobs, deadline)
+                return
+            files = [job.file_name for job in ordered]
+
+        if jobs <= 1:
+            if prefetch <= 0:
+                for full_path in files:
+                    file_done(full_path, process_single_file(full_path))
+            else:
+                # COPY THE NEXT FILES TO LOCAL DISK WHILE THE CURRENT ONE IS ENCODING.
+                with msu.Prefetcher(files,
+                                    scratch_dir or os.getcwd(),
+                                    prefetch,
+                                    should_stage=needs_processing
+                                    ) as prefetcher:
+                    for staged in prefetcher:
+                        file_done(staged.file_name, process_single_file(staged.file_name, staged))
+            return
+
+        def job_done(file_name: str, result: (bool, [dict])) -> None:
+            success, spans = result
+            msu.add_spans(spans)
+            file_done(file_name, success)
+
+        log.info(f"Processing files using {jobs} concurrent jobs.")
+        msu.run_jobs(process_file_job, files, jobs, scratch_dir, cores_per_job, job_done)
+
+
+def parse_command_line() -> (op.Values, [str]):
     parser = op.OptionParser()
-    _, vals = parser.parse_args()
+    parser.add_option("-j", "--jobs",
+                      dest="jobs", type="int", default=1,
+                      help="Number of files to process concurrently."
+                      )
+    parser.add_option("-c", "--cores-per-job",
+                      dest="cores_per_job", type="int", default=0,
+                      help="Pin each job (and its ffmpeg threads) to this many cores. 0 means no pinning."
+                      )
+    parser.add_option("--chunk-minutes",
+                      dest="chunk_minutes", type="float", default=0.0,
+                      help="Encode long videos in chunks of this many minutes, in parallel. 0 disables."
+                      )
+    parser.add_option("--chunk-jobs",
+                      dest="chunk_jobs", type="int", default=CHUNK_JOBS,
+                      help="Number of chunks of one video to encode at the same time."
+                      )
+    parser.add_option("--spool-dir",
+                      dest="spool_dir", default=None,
+                      help="Shared directory where chunks are handed to chunk_worker.py processes. "
+                           "Requires --chunk-minutes."
+                      )
+    parser.add_option("-2", "--two-pass",
+                      dest="two_pass", action="store_true", default=False,
+                      help="Decode each file twice: once to transcode and again to find gaps."
+                      )
+    parser.add_option("--cut-separately",
+                      dest="cut_separately", action="store_true", default=False,
+                      help="Remove gaps by writing the transcoded file again, instead of leaving them out of the "
+                           "transcode."
+                      )
+    parser.add_option("--smart-render",
+                      dest="smart_render", action="store_true", default=False,
+                      help="When gaps are cut from hevc video without transcoding it, cut exactly, re-encoding only "
+                           "the frames between each cut and the nearest key frame."
+                      )
+    parser.add_option("--detect-shards",
+                      dest="detect_shards", type="int", default=DETECT_SHARDS,
+                      help="When gaps are found in a separate pass, search this many pieces of each long video "
+                           "at the same time."
+                      )
+    parser.add_option("--coarse-detect",
+                      dest="coarse", action="store_true", default=False,
+                      help="When gaps are found in a separate pass, find candidates with a quick pass over key "
+                           "frames and search only around them."
+                      )
+    parser.add_option("--coarse-padding",
+                      dest="coarse_padding", type="float", default=COARSE_PADDING,
+                      help="Seconds searched before and after each candidate gap."
+                      )
+    parser.add_option("-p", "--prefetch",
+                      dest="prefetch", type="int", default=msu.PREFETCH_DEPTH,
+                      help="Number of upcoming files to copy to local disk during an encode (single job only)."
+                      )
+    parser.add_option("--plan",
+                      dest="plan", action="store_true", default=False,
+                      help="Only predict how long each file and the whole batch will take. Nothing is changed."
+                      )
+    parser.add_option("--order",
+                      dest="order", type="choice", choices=ORDERS, default=ORDER_SCAN,
+                      help="Order to process files in: " + ", ".join(ORDERS) + ". sjf runs the shortest "
+                           "first. deadline also skips files that would not finish before --until."
+                      )
+    parser.add_option("--until",
+                      dest="until", default=None,
+                      help="End of the processing window (HH:MM) for --plan and --order deadline."
+                      )
+    parser.add_option("--progress-hz",
+                      dest="progress_hz", type="float", default=msu.progress.RENDER_HZ,
+                      help="Maximum progress updates per second on the terminal."
+                      )
+    parser.add_option("--progress-json",
+                      dest="progress_json", default=None,
+                      help="File (or unix:/path/to/socket) that receives json progress records, one per line."
+                      )
+    parser.add_option("--metrics-file",
+                      dest="metrics_file", default=None,
+                      help="Prometheus textfile (e.g. in node_exporter's textfile directory) kept up to date with "
+                           "the time, cpu and bytes of each stage."
+                      )
+    parser.add_option("--trace-file",
+                      dest="trace_file", default=None,
+                      help="File every stage of every file is appended to, as one json record per line."
+                      )
+    parser.add_option("-r", "--rescan",
+                      dest="rescan", action="store_true", default=False,
+                      help="Look at every file again instead of only new or changed ones."
+                      )
+    parser.add_option("-s", "--scratch-dir",
+                      dest="scratch_dir", default=None,
+                      help="Directory in which each job creates its private working directory."
+                      )
+    options, vals = parser.parse_args()
+
+    if options.jobs < 1:
+        parser.error("--jobs must be at least 1.")
+    if options.cores_per_job < 0:
+        parser.error("--cores-per-job cannot be negative.")
+    if options.progress_hz <= 0:
+        parser.error("--progress-hz must be positive.")
+    if options.chunk_minutes < 0:
+        parser.error("--chunk-minutes cannot be negative.")
+    if options.detect_shards < 1:
+        parser.error("--detect-shards must be at least 1.")
+    if options.coarse_padding <= 0:
+        parser.error("--coarse-padding must be positive.")
+    if options.order == ORDER_DEADLINE and options.until is None:
+        parser.error("--order deadline requires --until.")
+    options.deadline = None
+    if options.until is not None:
+        try:
+            options.deadline = parse_deadline(options.until)
+        except ValueError:
+            parser.error(f"--until {options.until} is not a time (HH:MM).")
+
+    return options, vals
+
+
+def main():
+    global FUSED_GAP_DETECTION, CUT_WHILE_TRANSCODING
+
+    options, vals = parse_command_line()
+    FUSED_GAP_DETECTION = not options.two_pass
+    CUT_WHILE_TRANSCODING = not options.cut_separately
+    configure_chunking(options.chunk_minutes, options.chunk_jobs, options.spool_dir)
+    configure_detection(options.detect_shards, options.coarse, options.coarse_padding)
+    configure_cutting(options.smart_render)
+    # CONCURRENT JOBS WOULD OVERWRITE EACH OTHER'S PROGRESS LINE.
+    msu.configure_progress(options.progress_hz, options.progress_json, False if options.jobs > 1 else None)
+    msu.configure_instrumentation(options.metrics_file, options.trace_file)
+    if not options.plan:
+        # INTERMEDIATE FILES OF JOBS THAT WILL NEVER RESUME ARE SEVERAL GB EACH.
+        msu.default_job_store().sweep()
     path_to_process: str = vals[0]
 
     if len(vals) != 1:
@@ -76,10 +422,24 @@ def main():
         sys.exit(1)
     else:
         if path_to_process.endswith(".mp4") or path_to_process.endswith(".mkv"):
-            process_single_file(path_to_process)
+            if options.plan:
+                msu.print_plan(msu.plan_files([path_to_process], predicted_seconds), 1, options.deadline)
+            else:
+                process_single_file(path_to_process)
+                msu.print_span_summary()
         else:
             if os.path.isdir(path_to_process):
-                process_dir_tree(path_to_process)
+                process_dir_tree(path_to_process,
+                                 options.jobs,
+                                 options.scratch_dir,
+                                 options.cores_per_job,
+                                 options.prefetch,
+                                 options.rescan,
+                                 options.order,
+                                 options.deadline,
+                                 options.plan
+                                 )
+                msu.print_span_summary()
             else:
                 log.error(f"{path_to_process} is not a valid video file or directory.")
                 print(f"{path_to_process} is not a valid video file or directory.")
@@ -1,13 +1,14 @@
-import datetime as dt
 import logging as log
 import optparse as op
 import os
 import pathlib as path
-import subprocess as proc
 import sys
+import time
+import typing as typ
 
 import msutils as msu
 import transcode_to_hevc as tcode
+from msutils.coarse_detect import COARSE_PADDING
 
 FFMPEG_FILE = "ffmpeg"
 INPUTS_FILE_NAME = "ffmpeg_inputs_file.txt"
@@ -15,6 +16,15 @@ TEMP_FILE = "temp_output.mkv"
 
 NO_GAPS_FIELD = "checked-for-gaps"
 NO_GAPS_VALUE = "Yes"
+SCANNER_NAME: str = "remove_gaps"
+# SEARCH THIS MANY PIECES OF EACH FILE FOR FREEZES AT THE SAME TIME.  1 IS A SINGLE PASS.
+DETECT_SHARDS: int = 1
+# FIND CANDIDATES WITH A CHEAP PASS AND ONLY SEARCH AROUND THEM PRECISELY.
+COARSE_TO_FINE: bool = False
+COARSE_DETAIL: str = "coarse-to-fine"
+# CUT VIDEOS THIS ENCODER CAN RE-ENCODE FRAME ACCURATELY, RE-ENCODING ONLY THE PARTIAL GOPs AT EACH CUT.
+SMART_RENDER: bool = False
+SMART_RENDER_ENCODERS: dict = {"hevc": tcode.VIDEO_CODEC}
 
 if "__main__" == __name__:
     # SETUP LOGGER BEFORE IMPORTS SO THEY CAN USE THESE SETTINGS
@@ -26,21 +36,32 @@ if "__main__" == __name__:
     log.getLogger().setLevel(log.INFO)
 
 
-def remove_gaps(gaps: msu.MovieSections):
-    gaps.create_input_file_for_video_gaps(INPUTS_FILE_NAME)
-    output_file_name: str = msu.temp_results_file_name(gaps.file_name)
+def configure_cutting(smart_render: bool) -> None:
+    global SMART_RENDER
+
+    SMART_RENDER = smart_render
+
+
+def smart_render_args(probe: msu.MediaProbe) -> typ.Optional[list]:
+    """ Encoder arguments for the pieces a smart render re-encodes, or None
+        if the video of PROBE cannot be smart rendered.
+    """
+    video: msu.MediaStream | None = probe.video_stream()
+    if not SMART_RENDER or video is None or video.codec_name not in SMART_RENDER_ENCODERS:
+        return None
+    # EACH PIECE CARRIES ITS OWN PARAMETER SETS, SINCE THE SPLICED FILE ONLY KEEPS THOSE OF THE FIRST.
+    x265_params: str = "repeat-headers=1"
+    if msu.current_workspace is not None and msu.current_workspace.thread_count() > 0:
+        x265_params += f":pools={msu.current_workspace.thread_count()}"
+    return ["-c:v", SMART_RENDER_ENCODERS[video.codec_name], "-x265-params", x265_params]
+
+
+def remove_gaps(gaps: msu.MovieSections, output_file_name: str = None):
+    if output_file_name is None:
+        output_file_name = msu.temp_results_file_name(gaps.file_name)
+    probe: msu.MediaProbe = msu.MediaProbe.probe(gaps.file_name)
+    video_args: typ.Optional[list] = smart_render_args(probe)
 
-    ffmpeg_args = ["nice",
-                   FFMPEG_FILE,
-                   "-y",
-                   "-safe", "0",
-                   "-f", "concat",
-                   "-i", INPUTS_FILE_NAME,
-                   "-map", "0",
-                   "-c", "copy",
-                   "-c:s", "copy",
-                   output_file_name
-                   ]
     print(f"    {msu.Color.BLUE}{msu.Color.BOLD}Removing{msu.Color.END} "
           f"{msu.Color.BOLD}{msu.Color.GREEN}{gaps.total_time():.1f}{msu.Color.END} seconds from movie."
           )
@@ -51,214 +72,166 @@ def remove_gaps(gaps: msu.MovieSections):
                   f"{msu.Color.BOLD}{msu.Color.YELLOW}{x.comment}{msu.Color.END}"
                   )
 
-    current: float = 0.0
+    if video_args is not None:
+        msu.smart_render(FFMPEG_FILE, gaps, output_file_name, video_args, probe)
+        log.info(f"Gap removal complete for {gaps.file_name}.")
+        return
 
-    with proc.Popen(ffmpeg_args, text=True, stderr=proc.PIPE) as process:
-        for line in process.stderr:
-            if msu.is_ffmpeg_update(line):
-                current = msu.ffmpeg_get_current_time(line)
-                print(f"        Removing: {msu.Color.BOLD}{msu.Color.CYAN}{current:,.1f}{msu.Color.END}    ", end="\r")
+    inputs_file_name: str = msu.work_path(INPUTS_FILE_NAME)
+    gaps.create_input_file_for_video_gaps(inputs_file_name)
+    ffmpeg_args = ["nice",
+                   FFMPEG_FILE,
+                   "-y",
+                   "-safe", "0",
+                   "-f", "concat",
+                   "-i", inputs_file_name,
+                   "-map", "0",
+                   "-c", "copy",
+                   "-c:s", "copy",
+                   output_file_name
+                   ]
+    runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, label="Removing", file_name=gaps.file_name)
+    if runner.run() != 0:
+        raise msu.MediaServerUtilityException(f"An error occurred removing gaps from {gaps.file_name}. " +
+                                              f"Return code: {runner.returncode}"
+                                              )
 
-    print(f"        Removing: {msu.Color.BOLD}{msu.Color.CYAN}{current:,.1f}{msu.Color.END}    ")
     log.info(f"Gap removal complete for {gaps.file_name}.")
-    path.Path.unlink(path.Path(INPUTS_FILE_NAME))
+    path.Path.unlink(path.Path(inputs_file_name))
 
 
-def find_movie_chapters(text: [str]) -> [msu.MovieChapter]:
-    chapters: [msu.MovieChapter] = []
-    i = 0
+def find_commercials(probe: msu.MediaProbe) -> msu.MovieSections:
+    commercials: msu.MovieSections = msu.MovieSections(probe.file_name)
+    for movie_ch in filter(lambda ch: ch.title == "Advertisement", probe.chapters):
+        log.info(f"Movie chapter found: {movie_ch.title} ({movie_ch.section.start:.1f}-" +
+                 f"{movie_ch.section.end:.1f})"
+                 )
+        commercials.add_section(movie_ch.section)
 
-    for i, line in enumerate(text):
-        if msu.is_ffmpeg_chapter_header(line):
-            break
+    return commercials
 
-    for j in range(i+1, len(text), 3):
-        if msu.is_ffmpeg_chapter(text[j]):
-            curr_chapter: msu.MovieChapter = msu.MovieChapter([text[j], text[j+1], text[j+2]])
-            chapters.append(curr_chapter)
-            log.info(f"Movie chapter found: {curr_chapter.title} ({curr_chapter.section.start:.1f}-" +
-                     f"{curr_chapter.section.end:.1f})"
-                     )
-        else:
-            break
-
-    return chapters
-
-
-def is_freeze_data(output) -> bool:
-    idx = output.find("lavfi.freezedetect.freeze_")
-    return idx >= 0
-
-
-def get_freeze_location(output: str) -> float:
-    broken_line: [str] = output.split(":")
-    if len(broken_line) < 2:
-        raise msu.MediaServerUtilityException(f"Invalid freeze line supplied to get_freeze_location. {output}")
-    return float(broken_line[1].strip())
-
-
-def process_freeze_output(output) -> (float | None, float | None):
-    start_info: bool = output.find("lavfi.freezedetect.freeze_start") > 0
-    end_info: bool = output.find("lavfi.freezedetect.freeze_end") > 0
-
-    if start_info:
-        # FOUND FREEZE START TIME
-        return get_freeze_location(output), None
-    elif end_info:
-        # FOUND FREEZE END TIME
-        return None, get_freeze_location(output)
-
-    # FREEZE DURATION OR OTHER FREEZE INFO THAT WE DON'T NEED.
-    return None, None
-
-
-def process_silence_output(output: str) -> (float | None, float | None):
-    start_info: bool = output.find("silence_start: ") >= 0
-    end_info: bool = output.find("silence_end: ") >= 0
-
-    time: float = float(output.split(" ")[4].strip())
-    if start_info:
-        return time, None
-    elif end_info:
-        return None, time
-
-    return None, None
-
-
-def is_silence_data(output: str) -> bool:
-    idx = output.find("[silencedetect")
-    return idx >= 0
-
-
-def look_for_freezes_and_progress(file_name: str, output, duration: float = 0.0) -> [msu.MovieSection]:
-    start_ts: dt.datetime = dt.datetime.now()
-    found_video_freezes: msu.MovieSections = msu.MovieSections(file_name, "video")
-    found_silences: msu.MovieSections = msu.MovieSections(file_name, "audio")
-
-    current_freeze_start: float | None = None
-    current_silence_start: float | None = None
-
-    for ffmpeg_output in output:
-        # MONITOR FOR A FREEZE
-        if is_freeze_data(ffmpeg_output):
-            (start_f, end_f) = process_freeze_output(ffmpeg_output)
-
-            # CHECK FOR EXCEPTIONS
-            if start_f is not None and end_f is not None:
-                raise msu.MediaServerUtilityException(f"Freeze start and stop received simultaneously.")
-            if start_f is not None:
-                if current_freeze_start is not None:
-                    raise msu.MediaServerUtilityException(f"Two consecutive freeze starts encountered. End expected.")
-                # FREEZE START DATA RECEIVED
-                current_freeze_start = start_f
-            elif end_f is not None:
-                if current_freeze_start is None:
-                    raise msu.MediaServerUtilityException(f"Freeze end without a start.")
-
-                # FREEZE END DATA RECEIVED
-                freeze_info: msu.MovieSection = msu.MovieSection(current_freeze_start,
-                                                                 end_f,
-                                                                 f"{current_freeze_start}-{end_f}"
-                                                                 )
-                found_video_freezes.add_section(freeze_info)
-                log.debug(f"Freeze found from {current_freeze_start} to {end_f}")
-                current_freeze_start = None
-
-        elif is_silence_data(ffmpeg_output):
-            (start_s, end_s) = process_silence_output(ffmpeg_output)
-
-            # CHECK FOR EXCEPTIONS
-            if start_s is not None and end_s is not None:
-                raise msu.MediaServerUtilityException(f"Silence start and stop received simultaneously.")
-            if start_s is not None:
-                if current_silence_start is not None:
-                    raise msu.MediaServerUtilityException(f"Two consecutive silence starts encountered. End expected.")
-                # FREEZE START DATA RECEIVED
-                current_silence_start = start_s
-            elif end_s is not None:
-                if current_silence_start is None:
-                    raise msu.MediaServerUtilityException(f"Silence end without a start.")
-                silence_info: msu.MovieSection = msu.MovieSection(current_silence_start,
-                                                                  end_s,
-                                                                  f"{current_silence_start}-{end_s}"
-                                                                  )
-                found_silences.add_section(silence_info)
-                log.debug(f"Silence found from {current_silence_start:.1f} to {end_s:.1f} secs")
-                current_silence_start = None
-
-        # MONITOR FOR PROGRESS UPDATES
-        elif msu.is_ffmpeg_update(ffmpeg_output):
-            current_loc = msu.ffmpeg_get_current_time(ffmpeg_output)
-            percent_progress = msu.pretty_progress_with_timer(start_ts, current_loc, duration)
-            print(f"    Searching: {msu.Color.BOLD}{msu.Color.GREEN}{percent_progress}{msu.Color.END}    ", end="\r")
-
-    percent_progress = msu.pretty_progress(duration, duration)
-    print(f"    {msu.Color.GREEN}Complete: {msu.Color.BOLD}{percent_progress}{msu.Color.END}          ")
-    return found_video_freezes & found_silences
-
-
-def find_commercials_and_freezes(file_name: str) -> msu.MovieSections:
-    commercials: msu.MovieSections = msu.MovieSections(file_name)
+
+def find_commercials_and_freezes(file_name: str, probe: msu.MediaProbe = None) -> msu.MovieSections:
+    if probe is None:
+        probe = msu.MediaProbe.probe(file_name)
+    commercials: msu.MovieSections = find_commercials(probe)
+    vid_freezes: msu.MovieSections = find_freezes(file_name, probe.duration, probe)
+    all_gaps: msu.MovieSections = commercials | vid_freezes
+    return all_gaps
+
+
+def configure_detection(shards: int, coarse_to_fine: bool = False, padding: float = COARSE_PADDING) -> None:
+    global DETECT_SHARDS, COARSE_TO_FINE, COARSE_PADDING
+
+    DETECT_SHARDS = shards
+    COARSE_TO_FINE = coarse_to_fine
+    COARSE_PADDING = padding
+
+
+def detect_detail(duration: float) -> str:
+    """ How gaps are searched for, as recorded in the throughput history. """
+    if COARSE_TO_FINE:
+        return COARSE_DETAIL
+    return msu.detect_detail(duration, DETECT_SHARDS)
+
+
+def predicted_detect_seconds(probe: msu.MediaProbe) -> float:
+    return msu.default_throughput_history().predict(msu.STAGE_DETECT, probe, detect_detail(probe.duration))
+
+
+def find_freezes(file_name: str, duration: float = 0.0, probe: msu.MediaProbe = None) -> msu.MovieSections:
+    """ Times when the picture of FILE_NAME is frozen and the sound silent.
+        PROBE (of FILE_NAME or the file it was made from) is used to record
+        and predict how long the search takes.
+    """
+    expected: float | None = None if probe is None else predicted_detect_seconds(probe)
+    if duration > 0 and detect_detail(duration) != "":
+        start: float = time.monotonic()
+        try:
+            if COARSE_TO_FINE:
+                freezes: msu.MovieSections = msu.find_freezes_coarse_to_fine(FFMPEG_FILE, file_name, duration,
+                                                                             COARSE_PADDING, DETECT_SHARDS
+                                                                             )
+            else:
+                freezes: msu.MovieSections = msu.find_freezes_sharded(FFMPEG_FILE, file_name, duration,
+                                                                      DETECT_SHARDS, expected
+                                                                      )
+        except msu.MediaServerUtilityException as exc:
+            print(exc)
+            log.exception(exc)
+            raise exc
+        if probe is not None:
+            msu.record_throughput(msu.STAGE_DETECT, probe, time.monotonic() - start, detect_detail(duration))
+        return freezes
 
     ffmpeg_args = ["nice",
                    FFMPEG_FILE,
+                   *msu.ffmpeg_thread_args(),     # decoder threads
                    "-i", file_name,
-                   "-vf", "freezedetect=n=0.001",
+                   "-vf", msu.FREEZE_DETECT_FILTER,
                    "-map", "0:v:0",
-                   "-af", "silencedetect",
+                   "-af", msu.SILENCE_DETECT_FILTER,
                    "-map", "0:a:0?",
                    "-f", "null",
                    "-",
                    ]
 
-    with proc.Popen(ffmpeg_args, text=True, stderr=proc.PIPE) as process:
-        try:
-            pre_transcode_text: [str] = msu.ffmpeg_output_before_transcode(process.stderr)
-            duration: float = msu.find_duration(pre_transcode_text)
-            chapters: [msu.MovieChapter] = find_movie_chapters(pre_transcode_text)
-            for movie_ch in filter(lambda ch: ch.title == "Advertisement", chapters):
-                commercials.add_section(movie_ch.section)
+    finder: msu.FreezeAndSilenceFinder = msu.FreezeAndSilenceFinder(file_name)
+    runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, duration, "Searching",
+                                                file_name=file_name,
+                                                expected_seconds=expected
+                                                )
+    runner.add_line_handler(finder.handle_line)
+    start: float = time.monotonic()
+    try:
+        runner.run()
+    except msu.MediaServerUtilityException as exc:
+        print(exc)
+        log.exception(exc)
+        raise exc
 
-            vid_freezes: msu.MovieSections = look_for_freezes_and_progress(file_name, process.stderr, duration)
-
-        except msu.MediaServerUtilityException as exc:
-            print(exc)
-            log.exception(exc)
-            process.kill()
-            process.wait()
-            raise exc
-
-    all_gaps: msu.MovieSections = commercials | vid_freezes
-    return all_gaps
+    freezes: msu.MovieSections = finder.freezes_and_silences()
+    if probe is not None and runner.returncode == 0:
+        msu.record_throughput(msu.STAGE_DETECT, probe, time.monotonic() - start)
+    return freezes
 
 
 def gaps_already_removed(file_name: str) -> bool:
-    attr_names = (attr for attr in os.listxattr(file_name) if attr.startswith("user."))
-    for n in attr_names:
-        if n == f"user.{NO_GAPS_FIELD}" and NO_GAPS_VALUE == str(os.getxattr(file_name, n), "UTF-8"):
-            log.info(f"{file_name} has already been processed by gap remover.")
-            print(f"    {file_name} {msu.Color.BOLD}{msu.Color.DOUBLE_UNDERLINE}has already been processed "
-                  f"{msu.Color.END}by the gap remover."
-                  )
-            return True
+    if msu.FileState.of(file_name).get(NO_GAPS_FIELD) == NO_GAPS_VALUE:
+        log.info(f"{file_name} has already been processed by gap remover.")
+        print(f"    {file_name} {msu.Color.BOLD}{msu.Color.DOUBLE_UNDERLINE}has already been processed "
+              f"{msu.Color.END}by the gap remover."
+              )
+        return True
     return False
 
 
-def video_gap_removal(file_name: str) -> None:
+def mark_gaps_removed(file_name: str) -> None:
+    with msu.FileState.of(file_name) as state:
+        state.set(NO_GAPS_FIELD, NO_GAPS_VALUE)
+
+
+def video_gap_removal(file_name: str, freezes: msu.MovieSections = None) -> None:
+    """ Remove commercials and freezes from FILE_NAME.  FREEZES, if supplied,
+        are the freezes and silences already found while transcoding the file.
+    """
     if gaps_already_removed(file_name):
         return
 
-    log.info(f"Finding gaps in: {file_name}")
-    print(f"{msu.Color.BOLD}{msu.Color.BLUE}Finding gaps{msu.Color.END} in: {file_name}")
-
     try:
-        gaps: msu.MovieSections = find_commercials_and_freezes(file_name)
+        if freezes is not None:
+            log.info(f"Using gaps found during transcode of: {file_name}")
+            gaps: msu.MovieSections = find_commercials(msu.MediaProbe.probe(file_name)) | freezes
+        else:
+            log.info(f"Finding gaps in: {file_name}")
+            print(f"{msu.Color.BOLD}{msu.Color.BLUE}Finding gaps{msu.Color.END} in: {file_name}")
+            gaps: msu.MovieSections = find_commercials_and_freezes(file_name)
     except msu.MediaServerUtilityException:
         # Exception should have been logged already.
         return
     except UnicodeDecodeError:
         # Mark file as processed.
-        os.setxattr(file_name, f"user.{NO_GAPS_FIELD}", bytes(NO_GAPS_VALUE, "UTF-8"))
+        mark_gaps_removed(file_name)
         return
 
     if len(gaps.section_list) > 0:
@@ -277,21 +250,50 @@ def video_gap_removal(file_name: str) -> None:
         print(f"    Found no gaps to remove in {file_name}.")
 
     # Mark file as processed.
-    os.setxattr(file_name, f"user.{NO_GAPS_FIELD}", bytes(NO_GAPS_VALUE, "UTF-8"))
+    mark_gaps_removed(file_name)
 
 
-def walk_dir_removing_gaps(dir_name: str) -> None:
-    for (current_dir, dirs, files) in os.walk(dir_name):
-        dirs.sort()
-        for f in sorted(files):
-            if f.endswith(".mp4") or f.endswith(".mkv"):
-                full_path = os.path.join(current_dir, f)
-                video_gap_removal(full_path)
+def walk_dir_removing_gaps(dir_name: str, rescan: bool = False) -> None:
+    # ONLY NEW, CHANGED OR UNFINISHED FILES ARE FOUND.  WORK STARTS WHILE THE SCAN CONTINUES.
+    with msu.LibraryScanner(dir_name, SCANNER_NAME, rescan=rescan) as scanner:
+        for full_path in scanner:
+            video_gap_removal(full_path)
+            if msu.is_user_attribute_set_to_yes(full_path, NO_GAPS_FIELD):
+                scanner.mark_done(full_path)
 
 
 def main():
     parser = op.OptionParser()
-    _, vals = parser.parse_args()
+    parser.add_option("-r", "--rescan",
+                      dest="rescan", action="store_true", default=False,
+                      help="Look at every file again instead of only new or changed ones."
+                      )
+    parser.add_option("-d", "--detect-shards",
+                      dest="detect_shards", type="int", default=DETECT_SHARDS,
+                      help="Search this many pieces of each long video for freezes at the same time."
+                      )
+    parser.add_option("-c", "--coarse",
+                      dest="coarse", action="store_true", default=False,
+                      help="Find candidate gaps with a quick pass over key frames, then search only around them. "
+                           "With --detect-shards, that many windows are searched at the same time."
+                      )
+    parser.add_option("--coarse-padding",
+                      dest="coarse_padding", type="float", default=COARSE_PADDING,
+                      help="Seconds searched before and after each candidate. Gaps the quick pass misplaces by "
+                           "more than this may be missed."
+                      )
+    parser.add_option("-m", "--smart-render",
+                      dest="smart_render", action="store_true", default=False,
+                      help="Cut hevc videos exactly at the gaps, re-encoding only the few frames between each cut "
+                           "and the nearest key frame."
+                      )
+    options, vals = parser.parse_args()
+    if options.detect_shards < 1:
+        parser.error("--detect-shards must be at least 1.")
+    if options.coarse_padding <= 0:
+        parser.error("--coarse-padding must be positive.")
+    configure_detection(options.detect_shards, options.coarse, options.coarse_padding)
+    configure_cutting(options.smart_render)
     path_to_process: str = vals[0]
 
     if len(vals) != 1:
@@ -302,7 +304,7 @@ def main():
             video_gap_removal(path_to_process)
         else:
             if os.path.isdir(path_to_process):
-                walk_dir_removing_gaps(path_to_process)
+                walk_dir_removing_gaps(path_to_process, options.rescan)
             else:
                 log.error(f"{path_to_process} is not a valid video file or directory.")
                 print(f"{path_to_process} is not a valid video file or directory.")
@@ -1,13 +1,12 @@
-import datetime as dt
 import logging as log
 import optparse as op
 import os
-import shutil
-import subprocess as proc
 import sys
+import time
 import typing as typ
 
 import msutils as msu
+from msutils.ThroughputHistory import ORDER_DEADLINE, ORDER_SCAN, ORDERS, parse_deadline
 
 WORK_FILE = "working"
 
@@ -24,12 +23,21 @@ GRAPHIC_SUBTITLE_CODECS: [str] = ["dvd_subtitle", "vobsub"]
 CODECS_TO_IGNORE: [str] = ["bin_data", "png", ""]
 
 TRANSCODED_ATTRIBUTE: str = "transcoded_to_hevc"
+SCANNER_NAME: str = "transcode_to_hevc"
 
 VIDEO_CODEC = PROPER_VIDEO_CODECS[0]
 AUDIO_CODEC = PROPER_AUDIO_CODECS[0]
 SUBTITLE_CODEC = PROPER_SUBTITLE_CODECS[0]
 CORRECT_CODEC = "copy"
 
+# SPLIT THE VIDEO INTO CHUNKS OF THIS MANY MINUTES AND ENCODE CHUNK_JOBS OF THEM AT ONCE.  0 DISABLES.
+CHUNK_MINUTES: float = 0.0
+CHUNK_JOBS: int = 4
+# SHARED DIRECTORY WHERE CHUNKS ARE PUBLISHED FOR chunk_worker.py ON OTHER HOSTS.  None ENCODES LOCALLY.
+SPOOL_DIR: str | None = None
+# CHUNK SIZE FOR --benchmark WHEN --chunk-minutes IS NOT GIVEN.
+BENCHMARK_CHUNK_MINUTES: float = 5.0
+
 if "__main__" == __name__:
     # SETUP LOGGER BEFORE IMPORTS SO THEY CAN USE THESE SETTINGS
     log.basicConfig(filename="transcoding-to-hevc.log",
@@ -82,7 +90,7 @@ def already_transcoded(file_name: str) -> bool:
     return return_val
 
 
-def determine_new_codecs(file_name: str) -> (str, str, str):
+def determine_new_codecs(file_name: str, probe: msu.MediaProbe = None) -> (str, str, str):
     if has_transcoded_attribute(file_name):
         print(f"    {file_name} {msu.Color.BOLD}{msu.Color.DOUBLE_UNDERLINE}was previously "
               f"transcoded{msu.Color.END} and marked as such."
@@ -95,8 +103,9 @@ def determine_new_codecs(file_name: str) -> (str, str, str):
     audio_codec: typ.Optional[str] = None
     subtitle_codec: typ.Optional[str] = None
 
-    codecs: [str] = msu.all_codecs_for(file_name)
-    for c in codecs:
+    if probe is None:
+        probe = msu.MediaProbe.probe(file_name)
+    for c in probe.codecs():
         c2: str = c.lower()
         if c2 not in PROPER_VIDEO_CODECS and \
            c2 not in OTHER_VIDEO_CODECS and \
@@ -149,15 +158,154 @@ def determine_new_codecs(file_name: str) -> (str, str, str):
     return video_codec, audio_codec, subtitle_codec
 
 
-def transcode(file_name: str) -> None:
-    global current_ffmpeg_index
-
+def x265_thread_args(vid_codec: str) -> [str]:
+    """ x265 sizes its own thread pool from the machine, not from ffmpeg's -threads. """
+    if vid_codec != VIDEO_CODEC or msu.current_workspace is None or msu.current_workspace.thread_count() == 0:
+        return []
+    return ["-x265-params", f"pools={msu.current_workspace.thread_count()}"]
+
+
+def configure_chunking(chunk_minutes: float, chunk_jobs: int, spool_dir: str = None) -> None:
+    global CHUNK_MINUTES, CHUNK_JOBS, SPOOL_DIR
+
+    CHUNK_MINUTES = chunk_minutes
+    CHUNK_JOBS = chunk_jobs
+    SPOOL_DIR = spool_dir
+
+
+def use_chunks(vid_codec: str, probe: msu.MediaProbe) -> bool:
+    """ Only worth it for a real video encode of something longer than two chunks. """
+    return CHUNK_MINUTES > 0 and (CHUNK_JOBS > 1 or SPOOL_DIR is not None) and vid_codec == VIDEO_CODEC and \
+        probe.duration > 2 * CHUNK_MINUTES * 60
+
+
+def chunk_video_args(vid_codec: str) -> [str]:
+    """ Share this job's cores between the chunks encoding at the same time. """
+    cores: int = len(os.sched_getaffinity(0))
+    if msu.current_workspace is not None and msu.current_workspace.thread_count() > 0:
+        cores = msu.current_workspace.thread_count()
+    return ["-c:v", vid_codec, "-x265-params", f"pools={max(1, cores // CHUNK_JOBS)}"]
+
+
+def gap_detection_args(probe: msu.MediaProbe) -> ([str], [str], [str]):
+    """ Arguments that run freeze/silence detection as side branches of the
+        transcode's filter graph.  Returns (filter args, video map, extra output).
+    """
+    filter_graph: str = f"[0:v:0]{msu.FREEZE_DETECT_FILTER}[vout]"
+    silence_output: [str] = []
+    if probe.has_audio():
+        # AUDIO MAY BE STREAM COPIED, SO SILENCE DETECTION GETS ITS OWN (DISCARDED) OUTPUT.
+        filter_graph += f";[0:a:0]{msu.SILENCE_DETECT_FILTER}[silence]"
+        silence_output = ["-map", "[silence]", "-f", "null", "-"]
+
+    return ["-filter_complex", filter_graph], ["-map", "[vout]"], silence_output
+
+
+def can_cut_while_encoding(vid_codec: str, probe: msu.MediaProbe) -> bool:
+    """ Can gaps be left out of this encode rather than cut from its output?
+        Subtitles cannot go through the filter graph and a chunked encode
+        has no single graph, so those are still cut afterwards.
+    """
+    return vid_codec == VIDEO_CODEC and not use_chunks(vid_codec, probe) and not probe.has_subtitles()
+
+
+def cut_args(cuts: msu.MovieSections, probe: msu.MediaProbe) -> ([str], [str], float):
+    """ Arguments that encode only what is left of the movie once CUTS are
+        removed: each part is trimmed out of the decoded streams and the
+        parts are joined by the concat filter.  Returns (filter args, maps,
+        duration of the result).
+    """
+    kept: [msu.MovieSection] = cuts.kept_sections(probe.duration)
+    if len(kept) == 0:
+        raise msu.MediaServerUtilityException(f"Nothing is left of {cuts.file_name} once its gaps are cut.")
+    audio_count: int = len(probe.streams_of_type("audio"))
+    chains: [str] = []
+    parts: str = ""
+    for idx, sect in enumerate(kept):
+        span: str = f"start={sect.start:.6f}:end={sect.end:.6f}"
+        chains.append(f"[0:v:0]trim={span},setpts=PTS-STARTPTS[v{idx}]")
+        parts += f"[v{idx}]"
+        for aud in range(audio_count):
+            chains.append(f"[0:a:{aud}]atrim={span},asetpts=PTS-STARTPTS[a{aud}p{idx}]")
+            parts += f"[a{aud}p{idx}]"
+    outputs: str = "[vout]" + "".join(f"[aout{aud}]" for aud in range(audio_count))
+    chains.append(f"{parts}concat=n={len(kept)}:v=1:a={audio_count}{outputs}")
+
+    maps: [str] = ["-map", "[vout]"]
+    for aud in range(audio_count):
+        maps += ["-map", f"[aout{aud}]"]
+    # CHAPTER TIMES (INCLUDING THE ADVERTISEMENTS JUST REMOVED) NO LONGER MATCH THE VIDEO.
+    maps += ["-map_chapters", "-1"]
+    return ["-filter_complex", ";".join(chains)], maps, sum(s.end - s.start for s in kept)
+
+
+def is_usable_prefetch(file_name: str, staged: typ.Optional[msu.StagedFile]) -> bool:
+    """ Is STAGED a copy of FILE_NAME as it is now? """
+    if staged is None or staged.staged_path is None or not os.path.exists(staged.staged_path):
+        return False
+    return staged.file_key == msu.ProbeCache.key_for(file_name)
+
+
+def transcode(file_name: str,
+              detect_gaps: bool = False,
+              staged: msu.StagedFile = None
+              ) -> typ.Optional[msu.MovieSections]:
+    """ Transcode FILE_NAME to hevc/ac3.  If DETECT_GAPS and the video is
+        re-encoded, freezes and silences are detected during the same decode
+        and returned.  Otherwise None.
+        STAGED is a copy of the file already prefetched to local disk.
+    """
     assert file_name.endswith(".mp4") or file_name.endswith(".mkv")
-    work_file_name: str = f"{WORK_FILE}{file_name[-4:]}"
+    work_file_name: str = msu.work_path(f"{WORK_FILE}{file_name[-4:]}")
+
+    probe: typ.Optional[msu.MediaProbe] = None
+    if not has_transcoded_attribute(file_name):
+        probe = msu.MediaProbe.probe(file_name)
 
-    (vid_codec, aud_codec, sbt_codec) = determine_new_codecs(file_name)
+    codecs: typ.Optional[tuple] = codecs_to_use(file_name, probe)
+    if codecs is None:
+        return None
+    (vid_codec, aud_codec, sbt_codec) = codecs
+
+    print(f"{msu.Color.BOLD}{msu.Color.BLUE}Transcoding{msu.Color.END} {file_name} to "
+          f"{vid_codec}/{aud_codec}/{sbt_codec} using "
+          f"{msu.Color.CYAN}{FFMPEG_PROGRAM_LOCS[current_ffmpeg_index]}{msu.Color.END}."
+          )
+    log.debug(f"Transcoding {file_name} to hevc/ac3/{sbt_codec} using {FFMPEG_PROGRAM_LOCS[current_ffmpeg_index]}.")
+
+    stage_work_copy(file_name, work_file_name, staged)
+
+    freezes: msu.MovieSections | None = encode_video(file_name,
+                                                     work_file_name,
+                                                     msu.temp_results_file_name(file_name),
+                                                     codecs,
+                                                     probe,
+                                                     detect_gaps
+                                                     )
+    finish_transcode(file_name)
+    return freezes
+
+
+def stage_work_copy(file_name: str, work_file_name: str, staged: msu.StagedFile = None) -> None:
+    """ Put a local copy of FILE_NAME at WORK_FILE_NAME, using the prefetched
+        copy STAGED when it is still current.
+    """
+    if is_usable_prefetch(file_name, staged):
+        print(f"    Using copy of {file_name} prefetched to local disk.")
+        msu.move_file(staged.staged_path, work_file_name)
+    else:
+        print(f"    Copying {work_file_name} to local disk for faster processing ... ", end="", flush=True)
+        msu.stage_file(file_name, work_file_name)
+        print("COMPLETE")
+
+
+def codecs_to_use(file_name: str, probe: msu.MediaProbe | None) -> typ.Optional[tuple]:
+    """ (video, audio, subtitle) codecs for the transcode of FILE_NAME, or
+        None if it does not need one.
+    """
+    (vid_codec, aud_codec, sbt_codec) = determine_new_codecs(file_name, probe)
     if vid_codec == CORRECT_CODEC and aud_codec == CORRECT_CODEC:
-        return
+        return None
     if vid_codec is None:
         log.error(f"No video found for {file_name}.  Skipping file.")
 
@@ -167,74 +315,190 @@ def transcode(file_name: str) -> None:
     if sbt_codec is None:
         sbt_codec = CORRECT_CODEC
 
-    print(f"{msu.Color.BOLD}{msu.Color.BLUE}Transcoding{msu.Color.END} {file_name} to "
-          f"{vid_codec}/{aud_codec}/{sbt_codec} using "
-          f"{msu.Color.CYAN}{FFMPEG_PROGRAM_LOCS[current_ffmpeg_index]}{msu.Color.END}."
-          )
-    log.debug(f"Transcoding {file_name} to hevc/ac3/{sbt_codec} using {FFMPEG_PROGRAM_LOCS[current_ffmpeg_index]}.")
+    return vid_codec, aud_codec, sbt_codec
+
+
+def encode_video(file_name: str,
+                 work_file_name: str,
+                 output_file_name: str,
+                 codecs: (str, str, str),
+                 probe: msu.MediaProbe,
+                 detect_gaps: bool = False,
+                 cuts: msu.MovieSections = None
+                 ) -> typ.Optional[msu.MovieSections]:
+    """ Encode WORK_FILE_NAME (a local copy of FILE_NAME) into OUTPUT_FILE_NAME
+        with CODECS.  Returns the freezes and silences found on the way if
+        DETECT_GAPS and they could be found during the encode.
+        CUTS (only if can_cut_while_encoding) are gaps to leave out.
+    """
+    (vid_codec, aud_codec, sbt_codec) = codecs
+    start: float = time.monotonic()
+    if use_chunks(vid_codec, probe):
+        # NO SINGLE DECODE OF THE WHOLE FILE TO HANG GAP DETECTION ON.  CALLER DOES A SEPARATE PASS.
+        transcode_in_chunks(work_file_name, output_file_name, vid_codec, aud_codec, sbt_codec, probe)
+        msu.record_throughput(msu.STAGE_TRANSCODE, probe, time.monotonic() - start, transcode_detail(vid_codec, probe))
+        return None
+
+    # FREEZES CAN ONLY BE DETECTED FOR FREE WHEN THE VIDEO IS DECODED ANYWAY.
+    detect_gaps = detect_gaps and vid_codec != CORRECT_CODEC and cuts is None
+    filter_args: [str] = []
+    video_map: [str] = ["-map", "0:v:0"]    # Use 1st video stream
+    other_maps: [str] = ["-map", "0:a?",    # Keep all audio streams
+                         "-map", "0:s?"]    # Keep all subtitles
+    silence_output: [str] = []
+    out_duration: float = probe.duration
+    if detect_gaps:
+        filter_args, video_map, silence_output = gap_detection_args(probe)
+    if cuts is not None:
+        # THE GAPS ARE CUT HERE, FRAME ACCURATE, SO THE FILE IS WRITTEN ONCE.  FILTERED AUDIO CANNOT BE COPIED.
+        filter_args, video_map, out_duration = cut_args(cuts, probe)
+        other_maps = []
+        aud_codec = AUDIO_CODEC if aud_codec == CORRECT_CODEC else aud_codec
 
-    print(f"    Copying {work_file_name} to local disk for faster processing ... ", end="", flush=True)
-    shutil.copy2(file_name, work_file_name)
-    print("COMPLETE")
     ffmpeg_args: [str] = \
         [
             "nice",
             FFMPEG_PROGRAM_LOCS[current_ffmpeg_index],
             "-y",
             "-i", work_file_name,                # input file
-            "-map", "0:v:0",                # Use 1st video stream
-            "-map", "0:a?",                 # Keep all audio streams
-            "-map", "0:s?",                 # Keep all subtitles
+            *filter_args,
+            *video_map,
+            *other_maps,
             "-c:v", vid_codec,              # video codec (hevc/h.265)
             "-c:a", aud_codec,              # audio codec (ac3)
             "-c:s", sbt_codec,              # subtitle codec (matches original)
-            msu.temp_results_file_name(file_name),
+            *msu.ffmpeg_thread_args(),      # stay within the cores assigned to this job
+            *x265_thread_args(vid_codec),
+            output_file_name,
+            *silence_output,
         ]
 
-    pre_transcode_text: [str] = []
-    start_ts: dt.datetime = dt.datetime.now()
-    with proc.Popen(ffmpeg_args, text=True, stderr=proc.PIPE) as process:
+    runner: msu.FFmpegRunner = msu.FFmpegRunner(ffmpeg_args, out_duration, "Transcoding",
+                                                file_name=file_name,
+                                                expected_seconds=predicted_transcode_seconds(probe, vid_codec)
+                                                )
+    finder: msu.FreezeAndSilenceFinder = msu.FreezeAndSilenceFinder(file_name)
+    detection_failed: bool = False
+
+    def find_gaps(line: str) -> bool:
+        nonlocal detection_failed
         try:
-            pre_transcode_text = msu.ffmpeg_output_before_transcode(process.stderr)
-            duration: float = msu.find_duration(pre_transcode_text)
+            return finder.handle_line(line)
         except msu.MediaServerUtilityException as msue:
-            log.error(f"Error during startup of ffmpeg for {file_name}")
-            log.exception(msue)
-        except UnicodeDecodeError:
-            # Trouble parsing text, but video is still ok.
-            duration = 3600
-            pass
+            if not detection_failed:
+                # KEEP TRANSCODING.  GAPS WILL BE FOUND WITH A SEPARATE PASS.
+                log.error(f"Gap detection failed while transcoding {file_name}.")
+                log.exception(msue)
+            detection_failed = True
+            return True
+
+    if detect_gaps:
+        runner.add_line_handler(find_gaps)
+    runner.run()
+
+    if runner.returncode != 0:
+        next_ffmpeg_program()
+        raise msu.MediaServerUtilityException(f"An error occurred while transcoding " +
+                                              f"{file_name}. Return code: {runner.returncode}"
+                                              )
 
-        try:
-            for line in process.stderr:
-                if msu.is_ffmpeg_update(line):
-                    current_loc = msu.ffmpeg_get_current_time(line)
-                    percent_progress = msu.pretty_progress_with_timer(start_ts, current_loc, duration)
-                    print(f"    Progress: {msu.Color.BOLD}{msu.Color.GREEN}{percent_progress}{msu.Color.END}    ",
-                          end="\r"
-                          )
-                else:
-                    log.info(f"ffmpeg says: {line}")
-                    # print(f"*** ffmpeg says: {line}")
-        except UnicodeDecodeError:
-            # Trouble parsing text, but video is still ok.
-            duration = 3600
-            pass
+    msu.record_throughput(msu.STAGE_TRANSCODE, probe, time.monotonic() - start, transcode_detail(vid_codec, probe))
+    if not detect_gaps or detection_failed:
+        return None
+    return finder.freezes_and_silences()
 
-    if process.returncode != 0:
-        current_ffmpeg_index += 1
-        if current_ffmpeg_index >= len(FFMPEG_PROGRAM_LOCS):
-            current_ffmpeg_index = 0
 
-        for t in pre_transcode_text:
-            log.debug(t)
+def transcode_detail(vid_codec: str, probe: msu.MediaProbe) -> str:
+    """ What the throughput history compares: copying the video is much
+        faster than encoding it, and chunked encodes run in parallel.
+    """
+    if use_chunks(vid_codec, probe):
+        return f"{vid_codec}-chunked"
+    return vid_codec
 
-        raise msu.MediaServerUtilityException(f"An error occurred while transcoding " +
-                                              f"{file_name}. Return code: {process.returncode}"
-                                              )
 
-    percent_progress = msu.pretty_progress(duration, duration)
-    print(f"    {msu.Color.GREEN}Complete: {msu.Color.BOLD}{percent_progress}{msu.Color.END}          ")
+def predicted_transcode_seconds(probe: msu.MediaProbe, vid_codec: str) -> float:
+    return msu.default_throughput_history().predict(msu.STAGE_TRANSCODE, probe, transcode_detail(vid_codec, probe))
+
+
+def planned_video_codec(file_name: str, probe: msu.MediaProbe) -> typ.Optional[str]:
+    """ Video codec a transcode would use (without marking or printing
+        anything, unlike determine_new_codecs), or None if none is needed.
+    """
+    if has_transcoded_attribute(file_name):
+        return None
+    codecs: [str] = probe.codecs()
+    video_ok: bool = any(c in PROPER_VIDEO_CODECS for c in codecs)
+    if video_ok and any(c in PROPER_AUDIO_CODECS for c in codecs):
+        return None
+    return CORRECT_CODEC if video_ok else VIDEO_CODEC
+
+
+def needs_transcode(file_name: str) -> bool:
+    """ Whether transcode will encode FILE_NAME, judged by its (cached) probe.
+        Only those are worth prefetching.
+    """
+    try:
+        return planned_video_codec(file_name, msu.MediaProbe.probe(file_name)) is not None
+    except msu.MediaServerUtilityException:
+        return False
+
+
+def predicted_seconds(file_name: str) -> float:
+    probe: msu.MediaProbe = msu.MediaProbe.probe(file_name)
+    vid_codec: typ.Optional[str] = planned_video_codec(file_name, probe)
+    return 0.0 if vid_codec is None else predicted_transcode_seconds(probe, vid_codec)
+
+
+def next_ffmpeg_program() -> None:
+    """ Try the next ffmpeg build after a failure. """
+    global current_ffmpeg_index
+
+    current_ffmpeg_index += 1
+    if current_ffmpeg_index >= len(FFMPEG_PROGRAM_LOCS):
+        current_ffmpeg_index = 0
+
+
+def transcode_in_chunks(work_file_name: str,
+                        output_file_name: str,
+                        vid_codec: str,
+                        aud_codec: str,
+                        sbt_codec: str,
+                        probe: msu.MediaProbe
+                        ) -> None:
+    try:
+        if SPOOL_DIR is not None:
+            print(f"    Encoding in {CHUNK_MINUTES:g} minute chunks on the workers of {SPOOL_DIR}.")
+            msu.encode_on_spool(FFMPEG_PROGRAM_LOCS[current_ffmpeg_index],
+                                work_file_name,
+                                output_file_name,
+                                ["-c:v", vid_codec],    # WORKERS CHOOSE THEIR OWN THREAD COUNTS
+                                aud_codec,
+                                sbt_codec,
+                                CHUNK_MINUTES * 60,
+                                SPOOL_DIR,
+                                probe.duration
+                                )
+            return
+
+        print(f"    Encoding in {CHUNK_MINUTES:g} minute chunks, {CHUNK_JOBS} at a time.")
+        msu.encode_in_chunks(FFMPEG_PROGRAM_LOCS[current_ffmpeg_index],
+                             work_file_name,
+                             output_file_name,
+                             chunk_video_args(vid_codec),
+                             aud_codec,
+                             sbt_codec,
+                             CHUNK_MINUTES * 60,
+                             CHUNK_JOBS,
+                             probe.duration
+                             )
+    except msu.MediaServerUtilityException:
+        next_ffmpeg_program()
+        raise
+
+
+def finish_transcode(file_name: str) -> None:
+    """ Replace FILE_NAME with the transcoded results and mark it as done. """
     log.info(f"... Transcode of {file_name} complete.  Rename file.")
 
     msu.replace_file(file_name,
@@ -245,30 +509,201 @@ def transcode(file_name: str) -> None:
     log.info(f"... Rename complete.")
 
 
-def walk_dir_transcoding(dir_name: str) -> None:
-    for (current_dir, dirs, files) in os.walk(dir_name):
-        dirs.sort()
-        for f in sorted(files):
-            if f.endswith(".mp4") or f.endswith(".mkv"):
-                full_path = os.path.join(current_dir, f)
+def benchmark_chunking(file_name: str) -> None:
+    """ Time a single process encode of FILE_NAME against a chunked one.
+        FILE_NAME itself is left untouched.
+    """
+    probe: msu.MediaProbe = msu.MediaProbe.probe(file_name, use_cache=False)
+    work_file_name: str = msu.work_path(f"{WORK_FILE}{file_name[-4:]}")
+    output: str = msu.temp_results_file_name(file_name)
+    msu.stage_file(file_name, work_file_name)
+
+    try:
+        start: float = time.monotonic()
+        runner: msu.FFmpegRunner = msu.FFmpegRunner(["nice",
+                                                     FFMPEG_PROGRAM_LOCS[current_ffmpeg_index],
+                                                     "-y",
+                                                     "-i", work_file_name,
+                                                     "-map", "0:v:0",
+                                                     "-map", "0:a?",
+                                                     "-map", "0:s?",
+                                                     "-c:v", VIDEO_CODEC,
+                                                     "-c:a", AUDIO_CODEC,
+                                                     "-c:s", CORRECT_CODEC,
+                                                     *msu.ffmpeg_thread_args(),
+                                                     *x265_thread_args(VIDEO_CODEC),
+                                                     output,
+                                                     ],
+                                                    probe.duration,
+                                                    "Single",
+                                                    file_name=file_name
+                                                    )
+        if runner.run() != 0:
+            raise msu.MediaServerUtilityException(f"Single process encode of {file_name} failed. " +
+                                                  f"Return code: {runner.returncode}"
+                                                  )
+        single_secs: float = time.monotonic() - start
+
+        start = time.monotonic()
+        msu.encode_in_chunks(FFMPEG_PROGRAM_LOCS[current_ffmpeg_index],
+                             work_file_name,
+                             output,
+                             chunk_video_args(VIDEO_CODEC),
+                             AUDIO_CODEC,
+                             CORRECT_CODEC,
+                             CHUNK_MINUTES * 60,
+                             CHUNK_JOBS,
+                             probe.duration
+                             )
+        chunked_secs: float = time.monotonic() - start
+    finally:
+        for f in (work_file_name, output):
+            if os.path.exists(f):
+                os.unlink(f)
+
+    print(f"{msu.Color.BOLD}{file_name}{msu.Color.END}: single process {single_secs:,.1f}s, "
+          f"{CHUNK_JOBS} x {CHUNK_MINUTES:g} minute chunks {chunked_secs:,.1f}s, "
+          f"speedup {msu.Color.BOLD}{msu.Color.GREEN}{single_secs / chunked_secs:.2f}x{msu.Color.END}"
+          )
+    log.info(f"Benchmark {file_name}: single={single_secs:.1f}s chunked={chunked_secs:.1f}s "
+             f"chunk_minutes={CHUNK_MINUTES} chunk_jobs={CHUNK_JOBS}"
+             )
+
+
+def walk_dir_transcoding(dir_name: str,
+                         prefetch: int = msu.PREFETCH_DEPTH,
+                         scratch_dir: str = None,
+                         rescan: bool = False,
+                         order: str = ORDER_SCAN,
+                         deadline: float = None,
+                         plan_only: bool = False
+                         ) -> None:
+    # ONLY NEW, CHANGED OR UNFINISHED FILES ARE FOUND.  WORK STARTS WHILE THE SCAN CONTINUES.
+    with msu.LibraryScanner(dir_name, SCANNER_NAME, rescan=rescan) as scanner:
+        files: typ.Iterable[str] = scanner
+        if plan_only or order != ORDER_SCAN:
+            # ORDERING (OR PLANNING) NEEDS EVERY FILE AND ITS PREDICTED TIME BEFORE ANYTHING STARTS.
+            planned: [msu.PlannedJob] = msu.plan_files(scanner, predicted_seconds)
+            ordered: [msu.PlannedJob] = msu.order_jobs(planned, order, 1, deadline)
+            if len(ordered) < len(planned):
+                log.info(f"{len(planned) - len(ordered)} files are not predicted to finish in time. Left for later.")
+                print(f"{len(planned) - len(ordered):,} files would not finish before the deadline. Left for later.")
+            if plan_only:
+                msu.print_plan(ordered, 1, deadline)
+                return
+            files = [job.file_name for job in ordered]
+
+        if prefetch <= 0:
+            for full_path in files:
                 transcode(full_path)
+                scanner.mark_done(full_path)
+        else:
+            # COPY THE NEXT FILES TO LOCAL DISK WHILE THE CURRENT ONE IS ENCODING.
+            with msu.Prefetcher(files,
+                                scratch_dir or os.getcwd(),
+                                prefetch,
+                                should_stage=needs_transcode
+                                ) as prefetcher:
+                for staged in prefetcher:
+                    transcode(staged.file_name, staged=staged)
+                    scanner.mark_done(staged.file_name)
+
+    cache: msu.ProbeCache | None = msu.default_probe_cache()
+    if cache is not None:
+        cache.maintain()
 
 
 def main():
     parser = op.OptionParser()
-    _, vals = parser.parse_args()
+    parser.add_option("-b", "--benchmark",
+                      dest="benchmark", action="store_true", default=False,
+                      help="Time a normal encode of the file against a chunked one. The file is not changed."
+                      )
+    parser.add_option("--chunk-minutes",
+                      dest="chunk_minutes", type="float", default=CHUNK_MINUTES,
+                      help="Encode the video in chunks of this many minutes, in parallel. 0 disables."
+                      )
+    parser.add_option("--chunk-jobs",
+                      dest="chunk_jobs", type="int", default=CHUNK_JOBS,
+                      help="Number of chunks to encode at the same time."
+                      )
+    parser.add_option("-p", "--prefetch",
+                      dest="prefetch", type="int", default=msu.PREFETCH_DEPTH,
+                      help="Number of upcoming files to copy to local disk during an encode. 0 disables."
+                      )
+    parser.add_option("--spool-dir",
+                      dest="spool_dir", default=None,
+                      help="Shared directory where chunks are handed to chunk_worker.py processes. "
+                           "Requires --chunk-minutes."
+                      )
+    parser.add_option("--progress-hz",
+                      dest="progress_hz", type="float", default=msu.progress.RENDER_HZ,
+                      help="Maximum progress updates per second on the terminal."
+                      )
+    parser.add_option("--progress-json",
+                      dest="progress_json", default=None,
+                      help="File (or unix:/path/to/socket) that receives json progress records, one per line."
+                      )
+    parser.add_option("--plan",
+                      dest="plan", action="store_true", default=False,
+                      help="Only predict how long each file and the whole batch will take. Nothing is changed."
+                      )
+    parser.add_option("--order",
+                      dest="order", type="choice", choices=ORDERS, default=ORDER_SCAN,
+                      help="Order to transcode files in: " + ", ".join(ORDERS) + ". sjf runs the shortest "
+                           "first. deadline also skips files that would not finish before --until."
+                      )
+    parser.add_option("--until",
+                      dest="until", default=None,
+                      help="End of the processing window (HH:MM) for --plan and --order deadline."
+                      )
+    parser.add_option("-r", "--rescan",
+                      dest="rescan", action="store_true", default=False,
+                      help="Look at every file again instead of only new or changed ones."
+                      )
+    parser.add_option("-s", "--scratch-dir",
+                      dest="scratch_dir", default=None,
+                      help="Local directory for prefetched copies. Defaults to the current directory."
+                      )
+    options, vals = parser.parse_args()
+    if options.progress_hz <= 0:
+        parser.error("--progress-hz must be positive.")
+    if options.order == ORDER_DEADLINE and options.until is None:
+        parser.error("--order deadline requires --until.")
+    deadline: float | None = None
+    if options.until is not None:
+        try:
+            deadline = parse_deadline(options.until)
+        except ValueError:
+            parser.error(f"--until {options.until} is not a time (HH:MM).")
     path_to_process: str = vals[0]
+    msu.configure_progress(options.progress_hz, options.progress_json)
+    configure_chunking(options.chunk_minutes, options.chunk_jobs, options.spool_dir)
 
     if len(vals) != 1:
         print(vals)
         print("Exactly one argument (file-name/directory) expected.")
         sys.exit(1)
     else:
-        if path_to_process.endswith(".mp4") or path_to_process.endswith(".mkv"):
-            transcode(path_to_process)
+        if options.benchmark:
+            if CHUNK_MINUTES <= 0:
+                configure_chunking(BENCHMARK_CHUNK_MINUTES, options.chunk_jobs)
+            benchmark_chunking(path_to_process)
+        elif path_to_process.endswith(".mp4") or path_to_process.endswith(".mkv"):
+            if options.plan:
+                msu.print_plan(msu.plan_files([path_to_process], predicted_seconds), 1, deadline)
+            else:
+                transcode(path_to_process)
         else:
             if os.path.isdir(path_to_process):
-                walk_dir_transcoding(path_to_process)
+                walk_dir_transcoding(path_to_process,
+                                     options.prefetch,
+                                     options.scratch_dir,
+                                     options.rescan,
+                                     options.order,
+                                     deadline,
+                                     options.plan
+                                     )
             else:
                 log.error(f"{path_to_process} is not a valid video file or directory.")
                 print(f"{path_to_process} is not a valid video file or directory.")
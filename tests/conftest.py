@@ -0,0 +1,5 @@
+import os
+import sys
+
+# THE UTILITIES ARE RUN FROM src, NOT INSTALLED.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
@@ -0,0 +1,122 @@
+""" Several chunk_worker processes on one machine share a spool in a local
+    directory, standing in for one on NFS.  Encoding is stubbed: each
+    "encode" records who claimed the chunk and writes its output.
+"""
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import pytest
+
+import chunk_worker
+import msutils as msu
+
+spool_module = sys.modules["msutils.ChunkSpool"]
+
+CHUNKS: int = 9
+WORKERS: int = 3
+POLL_SECONDS: float = 0.05
+ENCODE_SECONDS: float = 0.1
+IDLE_EXIT_SECONDS: float = 1.0
+
+
+def stub_encode_chunk(ffmpeg_program: str, chunk: str, video_args: [str], on_progress=None, output: str = None) -> str:
+    # ONE write OF ONE LINE, SO CLAIMS OF SEVERAL WORKERS DO NOT INTERLEAVE.
+    with open(os.path.join(os.path.dirname(os.path.dirname(chunk)), "claims.log"), "a") as fd:
+        fd.write(f"{os.path.basename(chunk)} {os.getpid()}\n")
+    time.sleep(ENCODE_SECONDS)
+    with open(output, "w") as fd:
+        fd.write(f"encoded {os.path.basename(chunk)}\n")
+    return output
+
+
+def run_worker(spool_dir: str) -> None:
+    msu.encode_chunk = stub_encode_chunk
+    chunk_worker.POLL_SECONDS = POLL_SECONDS
+    chunk_worker.work_on_spool(spool_dir, "ffmpeg", idle_exit=IDLE_EXIT_SECONDS)
+
+
+def publish(spool: msu.ChunkSpool, count: int) -> [msu.ChunkJob]:
+    job_dir: str = spool.new_job_dir("recording.ts")
+    chunks: [str] = []
+    for idx in range(count):
+        chunks.append(os.path.join(job_dir, f"chunk-{idx:04d}.mkv"))
+        with open(chunks[-1], "w") as fd:
+            fd.write(f"source {idx}\n")
+    return spool.publish(chunks, ["-c:v", "libx265"])
+
+
+def claims(spool: msu.ChunkSpool) -> [str]:
+    with open(os.path.join(spool.spool_dir, "claims.log")) as fd:
+        return sorted(line.split()[0] for line in fd)
+
+
+@pytest.fixture
+def spool(tmp_path, monkeypatch) -> msu.ChunkSpool:
+    monkeypatch.setattr(spool_module, "POLL_SECONDS", POLL_SECONDS)
+    return msu.ChunkSpool(str(tmp_path / "spool"))
+
+
+def run_workers(spool: msu.ChunkSpool) -> None:
+    context = mp.get_context("fork")
+    workers: [mp.Process] = [context.Process(target=run_worker, args=(spool.spool_dir,)) for _ in range(WORKERS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+    assert [w.exitcode for w in workers] == [0] * WORKERS
+
+
+def test_each_job_is_claimed_once(spool):
+    jobs: [msu.ChunkJob] = publish(spool, CHUNKS)
+    run_workers(spool)
+
+    assert claims(spool) == sorted(os.path.basename(job.chunk) for job in jobs)
+    assert spool.wait_for(jobs, unclaimed_seconds=0) == [job.output for job in jobs]
+    for job in jobs:
+        assert os.path.exists(f"{job.chunk}{spool_module.DONE_SUFFIX}")
+        assert not os.path.exists(f"{job.chunk}{spool_module.LOCK_SUFFIX}")
+
+
+def test_stale_lock_is_broken(spool):
+    jobs: [msu.ChunkJob] = publish(spool, 2)
+    # A WORKER THAT DIED WHILE ENCODING THE FIRST CHUNK.
+    lock_file: str = f"{jobs[0].chunk}{spool_module.LOCK_SUFFIX}"
+    with open(lock_file, "w") as fd:
+        fd.write("dead-host:1\n")
+    long_ago: float = time.time() - spool_module.STALE_LOCK_SECONDS - 60
+    os.utime(lock_file, (long_ago, long_ago))
+    run_workers(spool)
+
+    assert claims(spool) == ["chunk-0000.mkv", "chunk-0001.mkv"]
+    assert spool.attempts(jobs[0]) == 1
+    assert os.path.exists(f"{jobs[0].chunk}{spool_module.DONE_SUFFIX}")
+
+
+def test_fresh_lock_is_kept(spool):
+    jobs: [msu.ChunkJob] = publish(spool, 2)
+    with open(f"{jobs[0].chunk}{spool_module.LOCK_SUFFIX}", "w") as fd:
+        fd.write("busy-host:1\n")
+    run_workers(spool)
+
+    assert claims(spool) == ["chunk-0001.mkv"]
+    assert spool.attempts(jobs[0]) == 0
+
+
+def test_wait_for_encodes_locally_without_workers(spool):
+    jobs: [msu.ChunkJob] = publish(spool, 3)
+    encoded: [str] = []
+
+    def encode_locally(job: msu.ChunkJob) -> None:
+        stub_encode_chunk("ffmpeg", job.chunk, job.video_args, output=job.output)
+        encoded.append(os.path.basename(job.chunk))
+
+    assert spool.wait_for(jobs, encode_locally=encode_locally, unclaimed_seconds=0.2) == [j.output for j in jobs]
+    assert encoded == ["chunk-0000.mkv", "chunk-0001.mkv", "chunk-0002.mkv"]
+
+
+def test_wait_for_fails_without_workers_or_fallback(spool):
+    jobs: [msu.ChunkJob] = publish(spool, 1)
+    with pytest.raises(msu.MediaServerUtilityException):
+        spool.wait_for(jobs, unclaimed_seconds=0.2)
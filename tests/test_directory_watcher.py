@@ -0,0 +1,71 @@
+""" DirectoryWatcher against a temporary directory: a directory is handed
+    off once its files settle, but never while a file in it is still open
+    for writing, however long its writer stalls.
+"""
+import os
+import time
+
+import pytest
+
+import msutils as msu
+
+SETTLE_SECONDS: float = 0.2
+
+
+@pytest.fixture
+def watched(tmp_path):
+    handed_off: [str] = []
+    with msu.DirectoryWatcher(str(tmp_path), handed_off.append, settle_seconds=SETTLE_SECONDS) as watcher:
+        yield watcher, handed_off
+
+
+def pump(watcher: msu.DirectoryWatcher, seconds: float) -> None:
+    """ Run the watcher for SECONDS. """
+    until: float = time.monotonic() + seconds
+    while time.monotonic() < until:
+        watcher.run_once(max_wait=until - time.monotonic())
+
+
+def test_settled_directory_is_handed_off(watched, tmp_path):
+    watcher, handed_off = watched
+    pump(watcher, 4 * SETTLE_SECONDS)
+    del handed_off[:]
+
+    (tmp_path / "recording.ts").write_bytes(b"x" * 1000)
+    pump(watcher, 4 * SETTLE_SECONDS)
+    assert handed_off == [str(tmp_path)]
+
+
+def test_stalled_writer_holds_back_its_directory(watched, tmp_path):
+    watcher, handed_off = watched
+    pump(watcher, 4 * SETTLE_SECONDS)
+    del handed_off[:]
+
+    with open(tmp_path / "recording.ts", "wb") as fd:
+        fd.write(b"x" * 1000)
+        fd.flush()
+        # THE DVR STALLS MUCH LONGER THAN IT TAKES A DIRECTORY TO SETTLE.
+        pump(watcher, 10 * SETTLE_SECONDS)
+        assert handed_off == []
+        fd.write(b"y" * 1000)
+        fd.flush()
+        pump(watcher, 4 * SETTLE_SECONDS)
+        assert handed_off == []
+
+    pump(watcher, 4 * SETTLE_SECONDS)
+    assert handed_off == [str(tmp_path)]
+
+
+def test_file_moved_in_is_handed_off(watched, tmp_path):
+    watcher, handed_off = watched
+    outside: str = str(tmp_path.parent / f"{tmp_path.name}-outside.ts")
+    with open(outside, "wb") as fd:
+        fd.write(b"x" * 1000)
+    sub_dir: str = str(tmp_path / "show")
+    os.mkdir(sub_dir)
+    pump(watcher, 4 * SETTLE_SECONDS)
+    del handed_off[:]
+
+    os.rename(outside, os.path.join(sub_dir, "episode.ts"))
+    pump(watcher, 4 * SETTLE_SECONDS)
+    assert handed_off == [sub_dir]
@@ -0,0 +1,157 @@
+""" The sharded search must find the same sections as a single pass.  The
+    detect filters' output is generated from known freezes and silences,
+    as ffmpeg would print it for the whole file and for each shard.  Where
+    ffmpeg is installed, both searches also run on a generated clip.
+"""
+import shutil as sh
+import subprocess as proc
+import sys
+
+import pytest
+
+import msutils as msu
+import remove_gaps
+from msutils.sharded_detect import MIN_SHARD_SECONDS, DetectShard, search_shards, shard_windows, stitch
+
+FILE_NAME: str = "recording.ts"
+DURATION: float = 1800.0
+
+# (start, end) IN WHOLE-FILE TIME.  SHARDS OF DURATION START AT 0 AND 900 AND THE FIRST READS ON TO 960.
+INSIDE_SHARD: [(float, float)] = [(100.0, 130.0)]
+ACROSS_BORDER: [(float, float)] = [(880.0, 940.0)]
+PAST_OVERLAP: [(float, float)] = [(890.0, 1000.0)]
+SILENCES: [(float, float)] = [(98.0, 131.5), (879.25, 941.0), (885.0, 1010.0), (1500.0, 1520.0)]
+
+
+def freeze_lines(start: float, end: float | None) -> [str]:
+    lines: [str] = [f"[freezedetect @ 0x5581] lavfi.freezedetect.freeze_start: {start}"]
+    if end is not None:
+        lines.append(f"[freezedetect @ 0x5581] lavfi.freezedetect.freeze_duration: {end - start}")
+        lines.append(f"[freezedetect @ 0x5581] lavfi.freezedetect.freeze_end: {end}")
+    return lines
+
+
+def silence_lines(start: float, end: float | None) -> [str]:
+    lines: [str] = [f"[silencedetect @ 0x5582] silence_start: {start}"]
+    if end is not None:
+        lines.append(f"[silencedetect @ 0x5582] silence_end: {end} | silence_duration: {end - start}")
+    return lines
+
+
+def detect_output(freezes: [(float, float)], silences: [(float, float)], shard: DetectShard) -> [str]:
+    """ What the detect filters print reading SHARD: times from the shard's
+        start, sections already going on start with it, and sections still
+        going on when it stops are never ended.
+    """
+    stop: float = DURATION if shard.end is None else shard.end
+    events: [(float, [str])] = []
+    for sections, lines_of in ((freezes, freeze_lines), (silences, silence_lines)):
+        for start, end in sections:
+            if end <= shard.start or start >= stop:
+                continue
+            events.append((max(start, shard.start), lines_of(max(start, shard.start) - shard.start,
+                                                            end - shard.start if end < stop else None
+                                                            )))
+    return [line for _, lines in sorted(events, key=lambda e: e[0]) for line in lines]
+
+
+def single_pass(freezes: [(float, float)], silences: [(float, float)]) -> msu.MovieSections:
+    finder: msu.FreezeAndSilenceFinder = msu.FreezeAndSilenceFinder(FILE_NAME)
+    for line in detect_output(freezes, silences, DetectShard(0.0, None)):
+        finder.handle_line(line)
+    return finder.freezes_and_silences()
+
+
+def sharded(freezes: [(float, float)], silences: [(float, float)], shards: int) -> msu.MovieSections:
+    found: list = []
+    for shard in shard_windows(DURATION, shards):
+        finder: msu.FreezeAndSilenceFinder = msu.FreezeAndSilenceFinder(FILE_NAME, shard.start)
+        for line in detect_output(freezes, silences, shard):
+            finder.handle_line(line)
+        # AS search_shard DOES.
+        if shard.end is not None:
+            finder.close_open_sections(shard.end)
+        found.append((finder.found_video_freezes, finder.found_silences))
+    return stitch(FILE_NAME, found)
+
+
+@pytest.mark.parametrize("freezes", [INSIDE_SHARD, ACROSS_BORDER, PAST_OVERLAP, INSIDE_SHARD + ACROSS_BORDER])
+def test_sharded_matches_single_pass(freezes):
+    expected: msu.MovieSections = single_pass(freezes, SILENCES)
+    assert len(expected.section_list) == len(freezes)
+    assert sharded(freezes, SILENCES, 2).to_list() == expected.to_list()
+
+
+def test_freeze_across_border_is_one_section():
+    assert len(shard_windows(DURATION, 2)) == 2
+    found: msu.MovieSections = sharded(PAST_OVERLAP, SILENCES, 2)
+    assert [(s.start, s.end) for s in found.section_list] == [(890.0, 1000.0)]
+
+
+def test_short_file_is_one_shard():
+    assert shard_windows(MIN_SHARD_SECONDS * 1.5, 4) == [DetectShard(0.0, None)]
+
+
+# (start, end) OF THE FROZEN AND SILENT PARTS OF THE CLIP.  ITS THREE SHARDS START AT 0, 30 AND 60 AND READ
+# CLIP_OVERLAP INTO THE NEXT ONE: ONE GAP INSIDE A SHARD, ONE ENDING IN AN OVERLAP AND ONE RUNNING PAST IT.
+CLIP_SECONDS: float = 90.0
+CLIP_SHARDS: int = 3
+CLIP_OVERLAP: float = 5.0
+CLIP_GAPS: [(float, float)] = [(4.0, 10.0), (26.0, 33.0), (55.0, 68.0)]
+# THE LOSSY ENCODE LEAVES MORE NOISE IN A FROZEN PICTURE THAN THE RECORDINGS' DETECTION ALLOWS.
+CLIP_FREEZE_FILTER: str = "freezedetect=n=0.01"
+# FREEZES AND SILENCES END ON A FRAME (0.1 SECS) OR AN AUDIO FRAME.
+CLIP_TOLERANCE: float = 0.5
+# BOTH SEARCHES DECODE THE SAME FRAMES, SO THEY ONLY DIFFER WHERE A SHARD STARTS.
+SHARD_TOLERANCE: float = 0.2
+
+
+def make_clip(file_name: str) -> None:
+    """ A recording whose picture moves and whose sound plays except
+        during CLIP_GAPS.  Key frames are a GOP apart, as in a broadcast.
+    """
+    # TIME THE PICTURE HAS MOVED FOR: IT STANDS STILL DURING EACH GAP.
+    moved: str = "-".join(["T", *(f"clip(T-{start:g},0,{end - start:g})" for start, end in CLIP_GAPS)])
+    playing: str = "+".join(f"between(t,{start:g},{end:g})" for start, end in CLIP_GAPS)
+    proc.run(["ffmpeg", "-y", "-v", "error",
+              "-f", "lavfi",
+              "-i", f"color=c=black:s=64x48:r=10:d={CLIP_SECONDS:g},format=yuv420p,"
+                    f"geq=lum='128+100*sin((X+Y+7*floor(10*({moved})))/6)':cb=128:cr=128",
+              "-f", "lavfi",
+              "-i", f"aevalsrc='0.5*sin(440*2*PI*t)*not({playing})':s=48000:d={CLIP_SECONDS:g}",
+              "-c:v", "mpeg2video", "-q:v", "2", "-g", "12",
+              "-c:a", "ac3",
+              file_name,
+              ],
+             check=True
+             )
+
+
+def sections_of(found: msu.MovieSections) -> [(float, float)]:
+    return [(s.start, s.end) for s in found.section_list]
+
+
+def assert_close(found: [(float, float)], expected: [(float, float)], tolerance: float) -> None:
+    assert len(found) == len(expected), found
+    for (start, end), (expected_start, expected_end) in zip(found, expected):
+        assert abs(start - expected_start) <= tolerance and abs(end - expected_end) <= tolerance, found
+
+
+@pytest.mark.skipif(sh.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_sharded_matches_single_pass_on_clip(tmp_path, monkeypatch):
+    clip: str = str(tmp_path / "clip.mkv")
+    make_clip(clip)
+    monkeypatch.setattr(remove_gaps, "DETECT_SHARDS", 1)
+    monkeypatch.setattr(msu, "FREEZE_DETECT_FILTER", CLIP_FREEZE_FILTER)
+    monkeypatch.setattr(sys.modules["msutils.sharded_detect"], "MIN_SHARD_SECONDS", CLIP_SECONDS / CLIP_SHARDS)
+
+    single: [(float, float)] = sections_of(remove_gaps.find_freezes(clip, CLIP_SECONDS))
+    assert_close(single, CLIP_GAPS, CLIP_TOLERANCE)
+
+    # THE REAL -ss/-to OF EACH SHARD AND THE OFFSETS OF ffmpeg'S OWN TIMESTAMPS.
+    windows: [DetectShard] = shard_windows(CLIP_SECONDS, CLIP_SHARDS, CLIP_OVERLAP)
+    assert [w.start for w in windows] == [0.0, 30.0, 60.0]
+    sharded: [(float, float)] = sections_of(stitch(clip, search_shards("ffmpeg", clip, windows, CLIP_SHARDS,
+                                                                       CLIP_SECONDS
+                                                                       )))
+    assert_close(sharded, single, SHARD_TOLERANCE)